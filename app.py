@@ -1,11 +1,39 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
 import gradio as gr
 
 from colorbynumber.config import default_config
+from colorbynumber.shadow import ShadowMode
 from gradio_server import callbacks
 from gradio_server import doc
+from gradio_server.session_store import SessionStore
 
 MAX_NUM_COLORS = 50 # Mostly for UI purposes
 
+# Run the pipeline in worker processes if COLORBYNUMBER_WORKERS is set.
+if os.environ.get("COLORBYNUMBER_WORKERS"):
+    callbacks.set_worker_pool(
+        ProcessPoolExecutor(max_workers = int(os.environ["COLORBYNUMBER_WORKERS"])))
+
+# Compare a sample of the pages with the reference implementation if
+# COLORBYNUMBER_SHADOW_LOG is set (see colorbynumber/shadow.py).
+if os.environ.get("COLORBYNUMBER_SHADOW_LOG"):
+    callbacks.set_shadow_mode(ShadowMode(
+        log_path = os.environ["COLORBYNUMBER_SHADOW_LOG"],
+        sample_rate = float(os.environ.get("COLORBYNUMBER_SHADOW_RATE", 0.01)),
+    ))
+
+# Stop runs taking longer than COLORBYNUMBER_TIMEOUT seconds, if set.
+if os.environ.get("COLORBYNUMBER_TIMEOUT"):
+    callbacks.set_run_timeout(float(os.environ["COLORBYNUMBER_TIMEOUT"]))
+
+# Results of each browser session are kept on the server for font changes.
+callbacks.set_session_store(SessionStore(
+    ttl_seconds = int(os.environ.get("COLORBYNUMBER_SESSION_TTL", 3600)),
+    max_bytes = int(os.environ.get("COLORBYNUMBER_SESSION_MB", 256)) * 1024 * 1024,
+))
+
 with gr.Blocks(title = "Color by number") as demo:
     with gr.Row():
         # Inputs
@@ -183,13 +211,25 @@ with gr.Blocks(title = "Color by number") as demo:
                     )
             legend_image = gr.Image(label = "Legend")
             simplified_image = gr.Image(label = "Simplified image")
-            islands_image = gr.Image(label = "Islands (no numbers)", visible=False)
-            data = gr.State() # To store the data for font change
+            denoised_image = gr.Image(label = "Denoised image")
+            # Key of the results kept on the server for font changes (see callbacks).
+            session_key = gr.State()
+            # Generation of the latest submit, see callbacks.cancel_session_run.
+            run_generation = gr.State()
 
-        # Submit button callback
+        # A new submit stops the runs of the earlier submits of the session.
+        # This is not queued, so that it does not wait behind the run it stops,
+        # and the run of this submit follows it.
         submit_button.click(
+            fn = callbacks.cancel_session_run,
+            inputs = [session_key],
+            outputs = [session_key, run_generation],
+            queue = False,
+        ).then(
             fn = callbacks.get_color_by_number,
             inputs = [
+                session_key,
+                run_generation,
                 image_path, 
                 number_of_colors,
                 is_automatic_colors,
@@ -208,7 +248,8 @@ with gr.Blocks(title = "Color by number") as demo:
                 font_thickness,
                 *color_pickers
                 ],
-            outputs = [color_by_number_image, legend_image, simplified_image, islands_image, data]
+            outputs = [color_by_number_image, legend_image, simplified_image, denoised_image,
+                       session_key]
         )
 
         # Callback to change font on image
@@ -216,8 +257,7 @@ with gr.Blocks(title = "Color by number") as demo:
                 triggers=[font_size.change, font_thickness.change],
                 fn = callbacks.change_font_on_image,
                 inputs = [
-                    islands_image, 
-                    data, 
+                    session_key, 
                     font_size, 
                     font_color, 
                     font_thickness
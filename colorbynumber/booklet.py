@@ -0,0 +1,261 @@
+import zipfile
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .config import default_config
+from .legend import generate_color_legend
+from .pipeline import run
+from .png_encoding import ROWS_PER_BATCH, palettize, write_png, _bit_depth, _pack_rows
+
+# Page sizes in points (1/72 inch), portrait.
+PAGE_SIZES = {
+    "A4": (595, 842),
+    "letter": (612, 792),
+}
+
+
+class PdfBookletWriter:
+    def __init__(self, fileobj, page_size = "A4", margin = 36, compression_level = 6):
+        """
+        Writes images as the pages of a PDF file, one image per page, as they
+        are added. Only the position of the objects already written is kept,
+        so memory use does not grow with the size of the images or the book.
+
+        Args:
+            fileobj: Binary file object to write to. It does not have to be seekable.
+            page_size: Key of PAGE_SIZES. Pages are turned to landscape for
+                images wider than tall.
+            margin: Blank margin around the image, in points.
+            compression_level: zlib compression level (0-9) of the images.
+        """
+        self.fileobj = fileobj
+        self.page_size = PAGE_SIZES[page_size]
+        self.margin = margin
+        self.compression_level = compression_level
+
+        self.position = 0
+        # Byte position of every object, the catalog and page tree being 1 and 2.
+        self.object_positions = [None, None]
+        self.page_ids = []
+        self._write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def _write(self, data):
+        self.fileobj.write(data)
+        self.position += len(data)
+
+    def _new_object_id(self):
+        self.object_positions.append(None)
+        return len(self.object_positions)
+
+    def _begin_object(self, object_id):
+        self.object_positions[object_id - 1] = self.position
+        self._write(b"%d 0 obj\n" % object_id)
+
+    def _write_object(self, object_id, data):
+        self._begin_object(object_id)
+        self._write(data + b"\nendobj\n")
+
+    def _write_image(self, image):
+        palettized_image = palettize(image)
+        if palettized_image is not None:
+            indices, palette = palettized_image
+            bit_depth = _bit_depth(len(palette))
+            rows = _pack_rows(indices, bit_depth)
+            color_space = b"[/Indexed /DeviceRGB %d <%s>]" % (len(palette) - 1, palette.tobytes().hex().encode())
+        else:
+            rows = image.astype(np.uint8)
+            if rows.ndim == 2:
+                rows = np.repeat(rows[:, :, None], 3, axis = 2)
+            rows = rows.reshape((rows.shape[0], -1))
+            bit_depth = 8
+            color_space = b"/DeviceRGB"
+
+        # The length of the stream is only known once it is written, so it is
+        # stored in an object of its own.
+        image_id = self._new_object_id()
+        length_id = self._new_object_id()
+        height, width = image.shape[:2]
+        self._begin_object(image_id)
+        self._write(b"<< /Type /XObject /Subtype /Image /Width %d /Height %d "
+                    b"/ColorSpace %s /BitsPerComponent %d /Filter /FlateDecode "
+                    b"/Length %d 0 R >>\nstream\n"
+                    % (width, height, color_space, bit_depth, length_id))
+        compressor = zlib.compressobj(self.compression_level)
+        length = 0
+        for start in range(0, height, ROWS_PER_BATCH):
+            data = compressor.compress(rows[start:start + ROWS_PER_BATCH].tobytes())
+            self._write(data)
+            length += len(data)
+        data = compressor.flush()
+        self._write(data)
+        length += len(data)
+        self._write(b"\nendstream\nendobj\n")
+        self._write_object(length_id, b"%d" % length)
+        return image_id
+
+    def add_page(self, image, name = None):
+        """
+        Adds a page showing an image, scaled to fit the page.
+
+        Args:
+            image: RGB image as a 3D array, or grayscale image as a 2D array.
+            name: Unused, for compatibility with ZipBookletWriter.
+        """
+        height, width = image.shape[:2]
+        page_width, page_height = self.page_size
+        if width > height:
+            page_width, page_height = page_height, page_width
+        scale = min((page_width - 2 * self.margin) / width, (page_height - 2 * self.margin) / height)
+        draw_width, draw_height = width * scale, height * scale
+        x, y = (page_width - draw_width) / 2, (page_height - draw_height) / 2
+
+        image_id = self._write_image(image)
+        contents = b"q %.2f 0 0 %.2f %.2f %.2f cm /Im0 Do Q" % (draw_width, draw_height, x, y)
+        contents_id = self._new_object_id()
+        self._write_object(contents_id, b"<< /Length %d >>\nstream\n%s\nendstream"
+                           % (len(contents), contents))
+        page_id = self._new_object_id()
+        self._write_object(page_id, b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] "
+                           b"/Resources << /XObject << /Im0 %d 0 R >> >> /Contents %d 0 R >>"
+                           % (page_width, page_height, image_id, contents_id))
+        self.page_ids.append(page_id)
+        self.fileobj.flush()
+
+    def close(self):
+        """Writes the page tree and the cross-reference table. Does not close fileobj."""
+        kids = b" ".join(b"%d 0 R" % page_id for page_id in self.page_ids)
+        self._write_object(2, b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(self.page_ids)))
+        self._write_object(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+
+        xref_position = self.position
+        self._write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(self.object_positions) + 1))
+        for object_position in self.object_positions:
+            self._write(b"%010d 00000 n \n" % object_position)
+        self._write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+                    % (len(self.object_positions) + 1, xref_position))
+        self.fileobj.flush()
+
+
+class ZipBookletWriter:
+    def __init__(self, fileobj, compression_level = 6):
+        """
+        Writes images as PNG files of a zip archive as they are added.
+
+        Args:
+            fileobj: Binary file object to write to. It does not have to be seekable.
+            compression_level: zlib compression level (0-9) of the PNGs.
+        """
+        self.compression_level = compression_level
+        # PNGs are already compressed.
+        self.archive = zipfile.ZipFile(fileobj, "w", compression = zipfile.ZIP_STORED)
+        self.num_pages = 0
+
+    def add_page(self, image, name = None):
+        """
+        Adds an image as a PNG file.
+
+        Args:
+            image: RGB image as a 3D array, or grayscale image as a 2D array.
+            name: Name of the file in the archive. Defaults to the page number.
+        """
+        self.num_pages += 1
+        if name is None:
+            name = f"page_{self.num_pages:04d}.png"
+        with self.archive.open(name, "w") as f:
+            write_png(image, f, compression_level = self.compression_level)
+
+    def close(self):
+        """Writes the directory of the archive. Does not close the underlying file object."""
+        self.archive.close()
+
+
+def iter_map(function, items, max_workers = 1, max_pending = None):
+    """
+    Yields function(item) for every item, in the order of the items,
+    computing up to max_workers of them in parallel threads.
+
+    Args:
+        function: Function of one item.
+        items: Iterable of items. It is consumed as results are needed, so it
+            can be a generator loading images lazily.
+        max_workers: Number of items processed in parallel.
+        max_pending: Maximum number of items being processed or waiting to
+            be yielded, which bounds memory use. Defaults to 2 * max_workers.
+    """
+    if max_workers <= 1:
+        for item in items:
+            yield function(item)
+        return
+
+    if max_pending is None:
+        max_pending = 2 * max_workers
+    pending = deque()
+    with ThreadPoolExecutor(max_workers = max_workers) as executor:
+        for item in items:
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+            pending.append(executor.submit(function, item))
+        while pending:
+            yield pending.popleft().result()
+
+
+def iter_results(images, palette_spec, config = default_config, max_workers = 1,
+                 max_pending = None):
+    """
+    Runs pipeline.run on every image and yields the results in the order of
+    the images (see iter_map).
+
+    Args:
+        images: Iterable of images in the RGB color space.
+        palette_spec: pipeline.PaletteSpec used for all images.
+        config: Dictionary of configuration parameters.
+        max_workers: Number of images processed in parallel.
+        max_pending: See iter_map.
+
+    Yields:
+        pipeline.Result for every image.
+    """
+    return iter_map(lambda image: run(image, palette_spec, config), images,
+                    max_workers, max_pending)
+
+
+def write_booklet(results, fileobj, booklet_format = "pdf", legend = True,
+                  page_size = "A4", compression_level = 6):
+    """
+    Writes the numbered page of every result, each followed by its color
+    legend, to a multi-page PDF or a zip archive of PNGs. Pages are written
+    as results arrive, and no result is kept after its pages are written.
+
+    Args:
+        results: Iterable of pipeline.Result, for example from iter_results.
+        fileobj: Path or binary file object to write to.
+        booklet_format: "pdf" or "zip".
+        legend: If True, every page is followed by its color legend.
+        page_size: Key of PAGE_SIZES (PDF only).
+        compression_level: zlib compression level (0-9).
+
+    Returns:
+        Number of results written.
+    """
+    assert booklet_format in ("pdf", "zip"), f"Unknown booklet format: {booklet_format}"
+    if isinstance(fileobj, str):
+        with open(fileobj, "wb") as f:
+            return write_booklet(results, f, booklet_format, legend, page_size, compression_level)
+
+    if booklet_format == "pdf":
+        writer = PdfBookletWriter(fileobj, page_size = page_size, compression_level = compression_level)
+    else:
+        writer = ZipBookletWriter(fileobj, compression_level = compression_level)
+
+    num_results = 0
+    for result in results:
+        num_results += 1
+        writer.add_page(result.numbered_islands, f"page_{num_results:04d}.png")
+        if legend:
+            writer.add_page(generate_color_legend(result.color_list),
+                            f"page_{num_results:04d}_legend.png")
+    writer.close()
+    return num_results
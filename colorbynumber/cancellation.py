@@ -0,0 +1,66 @@
+import threading
+import time
+
+
+class Cancelled(Exception):
+    """
+    Raised by the pipeline when its CancellationToken is cancelled.
+
+    Attributes:
+        partial_result: Last stage completed by pipeline.iter_stages before
+            the run stopped (a DenoisedStage, SimplifiedStage or
+            IslandsStage), or None if no stage completed.
+    """
+    def __init__(self, message = "Cancelled", partial_result = None):
+        super().__init__(message)
+        self.partial_result = partial_result
+
+
+class DeadlineExceeded(Cancelled):
+    """Raised by the pipeline when the deadline of its CancellationToken has passed."""
+
+
+class CancellationToken:
+    def __init__(self, deadline = None, parent = None):
+        """
+        Lets a run of the pipeline be stopped from another thread, or once
+        a deadline has passed. The pipeline calls check between stages and
+        regularly inside its longer loops, so it stops soon after.
+
+        Args:
+            deadline: time.monotonic() value after which the run stops (optional).
+            parent: CancellationToken whose cancellation and deadline also
+                apply to this one (optional).
+        """
+        self.deadline = deadline
+        self.parent = parent
+        self._event = threading.Event()
+
+    @classmethod
+    def with_timeout(cls, seconds, parent = None):
+        """Returns a token whose deadline is the given number of seconds from now."""
+        return cls(deadline = time.monotonic() + seconds, parent = parent)
+
+    def cancel(self):
+        """Asks the runs using this token to stop. Can be called from any thread."""
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set() or (self.parent is not None and self.parent.cancelled)
+
+    def remaining(self):
+        """Seconds left before the deadline of this token or its parents, or None if there is none."""
+        remaining = None if self.parent is None else self.parent.remaining()
+        if self.deadline is not None:
+            own = self.deadline - time.monotonic()
+            remaining = own if remaining is None else min(remaining, own)
+        return remaining
+
+    def check(self):
+        """Raises Cancelled if the token was cancelled, or DeadlineExceeded if its deadline passed."""
+        if self.cancelled:
+            raise Cancelled()
+        remaining = self.remaining()
+        if remaining is not None and remaining <= 0:
+            raise DeadlineExceeded("Deadline exceeded")
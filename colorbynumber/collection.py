@@ -0,0 +1,66 @@
+import numpy as np
+
+from .booklet import iter_map
+from .config import default_config, make_config
+from .main import load_image
+from .palette_family import PaletteFamily, pooled_color_histogram
+from .pipeline import PaletteSpec, run
+from .simplify_image import denoise_before_simplify
+
+
+def collection_palette(image_paths, num_colors, config = default_config, max_workers = 1):
+    """
+    Computes one palette for a collection of images, such as the pages of a
+    themed set, so that they can all be painted with the same paint list.
+
+    The images are read one at a time and pooled into one color histogram,
+    every image having the same weight, which is then clustered once with
+    the palette family algorithm.
+
+    Args:
+        image_paths: Iterable of image paths.
+        num_colors: Number of colors of the palette.
+        config: Dictionary of configuration parameters. Images are denoised
+            before pooling if the config denoises before simplification.
+        max_workers: Number of images read and denoised in parallel.
+
+    Returns:
+        (num_colors, 3) uint8 array of RGB colors.
+    """
+    config = make_config(config)
+    images = iter_map(lambda path: denoise_before_simplify(load_image(path), config),
+                      image_paths, max_workers)
+    colors, weights = pooled_color_histogram(images)
+    return PaletteFamily.from_histogram(colors, weights).get_palette(num_colors)
+
+
+def iter_collection(image_paths, color_list = None, num_colors = None,
+                    config = default_config, max_workers = 1):
+    """
+    Creates color by number pages for a collection of images, all using
+    the same palette: color_list, or one computed with collection_palette.
+    The images are matched to the palette without clustering them again.
+
+    Args:
+        image_paths: List of image paths. It is read twice if color_list
+            is not provided.
+        color_list: List of colors in (R, G, B) format.
+        num_colors: Number of colors to use if color_list is not provided.
+        config: Dictionary of configuration parameters.
+        max_workers: Number of images processed in parallel.
+
+    Yields:
+        pipeline.Result for every image, in the order of image_paths.
+    """
+    assert color_list is not None or num_colors is not None, \
+        "Either color_list or num_colors must be provided."
+    config = make_config(config)
+    if color_list is None:
+        color_list = collection_palette(image_paths, num_colors, config, max_workers)
+    color_list = np.array(color_list, dtype = np.uint8)
+
+    palette_spec = PaletteSpec(color_list = color_list)
+    # The palette is fixed, so images are only matched to it.
+    config = make_config(config, apply_kmeans = False)
+    return iter_map(lambda path: run(load_image(path), palette_spec, config),
+                    image_paths, max_workers)
@@ -1,4 +1,10 @@
-default_config = {
+from types import MappingProxyType
+
+# Read-only. Use make_config to derive a configuration with other values.
+# Like the configs returned by make_config, it is a MappingProxyType, which
+# cannot be pickled: send dict(config) to other processes, and call make_config
+# on the receiving side.
+default_config = MappingProxyType({
     # If True, the image will be denoised after simplification.
     "denoise": True,
     
@@ -10,6 +16,29 @@ default_config = {
     # And then the colors will be matched to closest color in the palette.
     "apply_kmeans": True,
 
+    # Algorithm used for kmeans clustering.
+    # Options: "random_centers", "palette_family"
+    # "palette_family" computes palettes for all numbers of colors in one
+    # deterministic run and caches them per image, so changing the number of
+    # colors for the same image is almost instant.
+    "kmeans_method": "random_centers",
+    # Seed of the random centers of "random_centers", or None for different
+    # centers on every run. Setting it seeds OpenCV's random number
+    # generator of the calling thread.
+    "kmeans_seed": None,
+
+    # If True, the image is first segmented into superpixels: small groups of
+    # neighboring pixels of similar color. Colors are then chosen for whole
+    # superpixels, clustering their mean colors weighted by their size, instead
+    # of for every pixel. This gives fewer and cleaner islands, so less
+    # denoising is needed. Clustering always uses "palette_family".
+    "superpixels": False,
+    # Approximate width of a superpixel, in pixels.
+    "superpixel_size": 12,
+    # Higher values give more regular superpixels, lower values follow
+    # color edges more closely.
+    "superpixel_compactness": 10,
+
     # Type of denoising to be used.
     # Options: "fastNlMeansDenoisingColored", "gaussianBlur", "blur"
     "denoise_type": "gaussianBlur",
@@ -26,6 +55,11 @@ default_config = {
     "open_kernel_size": 3,
 
 
+    # If True, the contours and centroid of every island are found in its
+    # bounding box. If False, in a copy of the whole image: much slower, but
+    # kept as the reference implementation for shadow mode.
+    "crop_islands": True,
+
     # Color islands with area less than this threshold will be ignored.
     # The value is a percentage of the total area of the image.
     "area_perc_threshold": 0.02,
@@ -42,4 +76,28 @@ default_config = {
     "font_size": 1,
     "font_color": (140, 140, 140),
     "font_thickness": 2,
-}
\ No newline at end of file
+
+    # Where numbers are placed.
+    # Options: "centroid", "collision_aware"
+    # "centroid" places every number at the center of its island.
+    # "collision_aware" moves or shrinks numbers so that they do not overlap
+    # each other and stay inside their island when possible, and drops the
+    # numbers that do not fit (see number_placement.place_numbers).
+    "number_placement": "centroid",
+    # Smallest font size used by "collision_aware", as a fraction of font_size.
+    "min_font_scale": 0.5,
+})
+
+
+def make_config(config = None, **overrides):
+    """Returns a read-only snapshot of default_config updated with the
+    values in config and overrides. Later changes to config do not affect it.
+
+    The snapshot is a MappingProxyType, which cannot be pickled: pass
+    dict(snapshot) to other processes (for example through a
+    ProcessPoolExecutor)."""
+    snapshot = dict(default_config)
+    for key, value in dict(config or {}, **overrides).items():
+        assert key in default_config, f"Unknown config parameter: {key}"
+        snapshot[key] = value
+    return MappingProxyType(snapshot)
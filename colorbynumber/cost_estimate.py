@@ -0,0 +1,267 @@
+import time
+from collections import namedtuple
+
+import cv2 as cv
+import numpy as np
+
+from .config import default_config, make_config
+from .gen_islands import GenerateIslands
+from .pipeline import make_palette_spec
+from .simplify_image import denoise_before_simplify, simplify_denoised_image
+
+# The probe runs the pipeline on a copy of the image downscaled to this size.
+PROBE_MAX_DIM = 250
+
+# Measured probe times are extrapolated to the full image as
+# time * (1 / scale) ** exponent, scale being the probe to image size ratio.
+# These are rough estimates set by hand from the complexity of each step, not
+# fitted values: kmeans with random centers is per pixel while the palette
+# family works on a color histogram of bounded size. Superpixel segmentation
+# is per pixel, but the number of superpixels clustered does not depend on
+# the resolution since their size is scaled with the probe.
+_TIME_SCALING_EXPONENTS = {
+    "fastNlMeansDenoisingColored": 2,
+    "gaussianBlur": 2,
+    "blur": 2,
+    "random_centers": 2,
+    "palette_family": 1,
+    "superpixels": 1.5,
+    "islands": 1,
+}
+
+# Most probes run by admit, after the first one, to fit a request in the limits.
+MAX_DEGRADE_PROBES = 4
+
+# Images are downscaled by this factor at a time, while larger than
+# MIN_DEGRADE_DIM pixels, to fit the limits.
+DOWNSCALE_STEP = 0.75
+MIN_DEGRADE_DIM = 400
+
+# The probe does not place numbers. Placing one with polylabel takes about
+# this long (measured on a single core at full resolution).
+SECONDS_PER_NUMBER = 0.01
+
+# Estimated cost of running the pipeline.
+CostEstimate = namedtuple("CostEstimate", [
+    "wall_time",       # Seconds.
+    "peak_memory",     # Bytes.
+    "island_count",    # Number of numbered islands on the page.
+    "component_count", # Number of connected components examined, including discarded ones.
+])
+
+# Limits checked by admit. None means unlimited.
+AdmissionLimits = namedtuple(
+    "AdmissionLimits",
+    ["max_wall_time", "max_peak_memory", "max_island_count"],
+    defaults = (None, None, None),
+)
+
+# Outcome of admit: the image and config to run, their estimate (None if no
+# limit is set) and the list of changes (human readable) made to fit the limits.
+Admission = namedtuple("Admission", ["image", "config", "estimate", "actions"])
+
+
+class AdmissionRejected(Exception):
+    """Raised by admit when a request cannot be made to fit the limits."""
+    def __init__(self, estimate, limits):
+        super().__init__(f"Estimated cost {dict(estimate._asdict())} exceeds limits "
+                         f"{dict(limits._asdict())}")
+        self.estimate = estimate
+        self.limits = limits
+
+
+def _scale_config(config, scale):
+    # Kernel sizes are in pixels, so they shrink with the probe, while the
+    # perimeter to area ratio of a shape grows as it shrinks.
+    def _odd(size):
+        return max(int(round(size * scale)) | 1, 1)
+    return make_config(
+        config,
+        blur_size = _odd(config["blur_size"]),
+        open_kernel_size = max(int(round(config["open_kernel_size"] * scale)), 1),
+        border_padding = max(int(round(config["border_padding"] * scale)), 1),
+        superpixel_size = max(int(round(config["superpixel_size"] * scale)), 2),
+        arc_length_area_ratio_threshold = config["arc_length_area_ratio_threshold"] / scale,
+    )
+
+
+def _peak_memory(num_pixels, num_colors, component_count, config):
+    image_bytes = num_pixels * 3
+    # Input, denoised, simplified, islands and numbered images.
+    base = 5 * image_bytes
+    # _choose_closest_colors broadcasts an int64 difference per pixel, color and channel.
+    closest_colors = num_pixels * num_colors * (3 + 1) * 8 \
+        if (config["apply_kmeans"] or config["denoise_order"] == "after_simplify") else 0
+    kmeans = num_pixels * (3 * 4 + 4 + 8)
+    # Label image, per color mask and the cropped island images.
+    islands = num_pixels * (4 + 2) + component_count * 64
+    return base + max(closest_colors, kmeans, islands)
+
+
+def estimate_cost(image, palette_spec, config = default_config):
+    """
+    Estimates the cost of pipeline.run from a quick run on a low resolution
+    copy of the image. Island counts do not depend much on the resolution
+    since area thresholds are relative; times are extrapolated from the probe.
+
+    Args:
+        image: Image in the RGB color space as a 3D array.
+        palette_spec: pipeline.PaletteSpec with the colors to use.
+        config: Dictionary of configuration parameters.
+
+    Returns:
+        CostEstimate
+    """
+    config = make_config(config)
+    palette_spec = make_palette_spec(palette_spec.color_list, palette_spec.num_colors)
+    height, width = image.shape[:2]
+    scale = min(PROBE_MAX_DIM / max(height, width), 1)
+    probe = cv.resize(image, (max(int(width * scale), 1), max(int(height * scale), 1)),
+                      interpolation = cv.INTER_AREA)
+    probe_config = _scale_config(config, scale)
+
+    start = time.perf_counter()
+    denoised = denoise_before_simplify(probe, probe_config)
+    denoise_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    _, indices_color_choices, color_list = simplify_denoised_image(
+        denoised, palette_spec.color_list, palette_spec.num_colors, probe_config)
+    simplify_time = time.perf_counter() - start
+    if config["denoise"] and config["denoise_order"] == "after_simplify":
+        # The probe's simplify time includes denoising the simplified image.
+        simplify_time, denoise_time = simplify_time / 2, simplify_time / 2
+
+    start = time.perf_counter()
+    generate_islands_obj = GenerateIslands(indices_color_choices, compute_centroids = False)
+    island_borders_list, _ = generate_islands_obj.get_islands(config = probe_config)
+    islands_time = time.perf_counter() - start
+
+    # Components smaller than the opening kernel at full resolution are not
+    # visible in the probe; assume their number grows like the perimeters.
+    probe_components = sum(len(fills) for fills in generate_islands_obj.island_fills.values())
+    component_count = int(probe_components / scale)
+
+    inverse_scale = 1 / scale
+    wall_time = islands_time * inverse_scale**_TIME_SCALING_EXPONENTS["islands"] \
+        + len(island_borders_list) * SECONDS_PER_NUMBER
+    if config["superpixels"]:
+        wall_time += simplify_time * inverse_scale**_TIME_SCALING_EXPONENTS["superpixels"]
+    elif palette_spec.color_list is None or config["apply_kmeans"]:
+        wall_time += simplify_time * inverse_scale**_TIME_SCALING_EXPONENTS[config["kmeans_method"]]
+    else:
+        wall_time += simplify_time * inverse_scale**2
+    if config["denoise"]:
+        wall_time += denoise_time * inverse_scale**_TIME_SCALING_EXPONENTS[config["denoise_type"]]
+
+    return CostEstimate(
+        wall_time = wall_time,
+        peak_memory = _peak_memory(height * width, len(color_list), component_count, config),
+        island_count = len(island_borders_list),
+        component_count = component_count,
+    )
+
+
+def _within(estimate, limits):
+    return (limits.max_wall_time is None or estimate.wall_time <= limits.max_wall_time) \
+        and (limits.max_peak_memory is None or estimate.peak_memory <= limits.max_peak_memory) \
+        and (limits.max_island_count is None or estimate.island_count <= limits.max_island_count)
+
+
+def _cheaper_configs(config):
+    """Yields (action, config), each cheaper than the previous one."""
+    if config["denoise"] and config["denoise_type"] == "fastNlMeansDenoisingColored":
+        config = make_config(config, denoise_type = "gaussianBlur")
+        yield "denoise_type=gaussianBlur", config
+    if config["kmeans_method"] != "palette_family":
+        config = make_config(config, kmeans_method = "palette_family")
+        yield "kmeans_method=palette_family", config
+    while config["open_kernel_size"] < 9:
+        config = make_config(config, open_kernel_size = config["open_kernel_size"] + 2)
+        yield f"open_kernel_size={config['open_kernel_size']}", config
+
+
+def _downscaled_sizes(image):
+    """Returns the (width, height) of the image after each downscaling step."""
+    height, width = image.shape[:2]
+    sizes = []
+    while max(width, height) > MIN_DEGRADE_DIM:
+        width, height = int(width * DOWNSCALE_STEP), int(height * DOWNSCALE_STEP)
+        sizes.append((width, height))
+    return sizes
+
+
+def _extrapolate(estimate, pixel_ratio):
+    # Time and memory are about proportional to the number of pixels, while
+    # island counts do not depend much on the resolution.
+    return estimate._replace(
+        wall_time = estimate.wall_time * pixel_ratio,
+        peak_memory = int(estimate.peak_memory * pixel_ratio),
+    )
+
+
+def admit(image, palette_spec, config = default_config, limits = AdmissionLimits(),
+          policy = "degrade"):
+    """
+    Checks a request against the limits before the pipeline runs.
+
+    With the "degrade" policy, cheaper settings are tried first, each checked
+    with a probe. Then the image is downscaled: the size is chosen by
+    extrapolating the last estimate, and checked with a probe, trying the
+    next smaller size if it does not fit. At most MAX_DEGRADE_PROBES probes
+    are run after the first one.
+
+    Args:
+        image: Image in the RGB color space as a 3D array.
+        palette_spec: pipeline.PaletteSpec with the colors to use.
+        config: Dictionary of configuration parameters.
+        limits: AdmissionLimits.
+        policy: "reject" to reject requests over the limits, or "degrade" to
+            first try cheaper settings, then a smaller image.
+
+    Returns:
+        Admission with the image and config to run. Its estimate is None if
+        no limit is set, since nothing is estimated then.
+
+    Raises:
+        AdmissionRejected if the request does not fit the limits.
+    """
+    config = make_config(config)
+    if limits == AdmissionLimits():
+        return Admission(image, config, None, [])
+    estimate = estimate_cost(image, palette_spec, config)
+    if _within(estimate, limits):
+        return Admission(image, config, estimate, [])
+    if policy == "reject":
+        raise AdmissionRejected(estimate, limits)
+
+    sizes = _downscaled_sizes(image)
+    # Keep a probe for the downscaled image.
+    setting_probes = MAX_DEGRADE_PROBES - 1 if sizes else MAX_DEGRADE_PROBES
+    actions = []
+    probes = 0
+    for action, cheaper_config in _cheaper_configs(config):
+        if probes == setting_probes:
+            break
+        probes += 1
+        actions.append(action)
+        config = cheaper_config
+        estimate = estimate_cost(image, palette_spec, config)
+        if _within(estimate, limits):
+            return Admission(image, config, estimate, actions)
+
+    if not sizes:
+        raise AdmissionRejected(estimate, limits)
+    num_pixels = image.shape[0] * image.shape[1]
+    step = next((step for step, (width, height) in enumerate(sizes)
+                 if _within(_extrapolate(estimate, width * height / num_pixels), limits)),
+                len(sizes) - 1)
+    while probes < MAX_DEGRADE_PROBES and step < len(sizes):
+        probes += 1
+        width, height = sizes[step]
+        downscaled = cv.resize(image, (width, height), interpolation = cv.INTER_AREA)
+        estimate = estimate_cost(downscaled, palette_spec, config)
+        if _within(estimate, limits):
+            return Admission(downscaled, config, estimate, actions + [f"downscale={width}x{height}"])
+        step += 1
+    raise AdmissionRejected(estimate, limits)
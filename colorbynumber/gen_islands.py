@@ -1,3 +1,5 @@
+import copy
+
 import cv2 as cv
 import numpy as np
 from polylabel import polylabel
@@ -6,30 +8,73 @@ from .config import default_config
 
 
 class GenerateIslands:
-    def __init__(self, indices_color_choices):
+    def __init__(self, indices_color_choices, compute_centroids = True):
         """
         Args:
             indices_color_choices: 2D numpy array with the same shape as the image.
                 Shows the color index chosen for each pixel in the image.
+            compute_centroids: If False, the centroids of all islands are NaN.
+                Saves time when only the island borders or counts are needed.
         """
         self.indices_color_choices = indices_color_choices
-        
+        self.compute_centroids = compute_centroids
+        self._reset()
+
+    def _reset(self):
+        # Called at the start of every get_islands so that results of
+        # earlier calls do not accumulate.
+        color_indices = np.unique(self.indices_color_choices)
+
         # List of coordinates for each islands border
         self.island_borders = {}
-        for color_index in np.unique(indices_color_choices):
+        for color_index in color_indices:
             self.island_borders[color_index] = []
         
-        # Images of the islands
+        # Images of the islands, cropped to their bounding box plus one pixel.
+        # island_offsets has the (x, y) position of each crop in the padded image.
         self.island_fills = {}
-        for color_index in np.unique(indices_color_choices):
+        self.island_offsets = {}
+        for color_index in color_indices:
             self.island_fills[color_index] = []
+            self.island_offsets[color_index] = []
         
         # Coordinate of centroids of islands
         self.island_centroids = {}
-        for color_index in np.unique(indices_color_choices):
+        for color_index in color_indices:
             self.island_centroids[color_index] = []
 
+        # Id of every island, and (row, col) of its first pixel in raster
+        # order, which is the order connected components are numbered in.
+        self.island_ids = {}
+        self.island_starts = {}
+        for color_index in color_indices:
+            self.island_ids[color_index] = []
+            self.island_starts[color_index] = []
+
+        # Id of the island covering each pixel of the padded image, 0 if none.
+        # Allocated by get_islands, which knows the padding.
+        self.island_map = None
+        self.next_island_id = 1
+        self.island_ids_list = []
+
     
+    def copy(self):
+        """
+        Returns a copy of this object and of its islands that update_islands
+        can change without affecting this object. The arrays describing
+        individual islands are never modified, so they are shared.
+        """
+        other = copy.copy(self)
+        other.indices_color_choices = self.indices_color_choices.copy()
+        if self.island_map is not None:
+            other.island_map = self.island_map.copy()
+        (other.island_borders, other.island_centroids, other.island_fills,
+         other.island_offsets, other.island_ids, other.island_starts) = (
+            {color_index: list(islands) for color_index, islands in island_lists.items()}
+            for island_lists in self._island_lists())
+        other.island_ids_list = list(self.island_ids_list)
+        return other
+
     def _is_valid_shape(self, contours, hierarchy, total_area, area_perc_threshold,
                         arc_length_area_ratio_threshold):
         holes_contours_ids = np.where(hierarchy[0,:,-1] != -1)[0]
@@ -61,7 +106,11 @@ class GenerateIslands:
 
 
     def _get_cleaned_up_contours(self, island_fill, area_perc_threshold, 
-                                 arc_length_area_ratio_threshold, check_shape_validity):
+                                 arc_length_area_ratio_threshold, check_shape_validity,
+                                 offset = (0, 0)):
+        # island_fill may be a crop of the padded image whose top left corner
+        # is at offset (x, y). The returned contours are in padded image
+        # coordinates, the returned image has the shape of island_fill.
         contours_image = np.ones_like(island_fill)
 
         total_area = self.indices_color_choices.shape[0] * self.indices_color_choices.shape[1]
@@ -69,7 +118,8 @@ class GenerateIslands:
         contours, hierarchy = cv.findContours(
             island_fill, 
             mode = cv.RETR_TREE,
-            method = cv.CHAIN_APPROX_NONE
+            method = cv.CHAIN_APPROX_NONE,
+            offset = offset
         )
 
         if check_shape_validity:
@@ -95,7 +145,8 @@ class GenerateIslands:
                         contours = [contour], 
                         contourIdx = 0, 
                         color = (0,255,0), 
-                        thickness = 1)
+                        thickness = 1,
+                        offset = (-offset[0], -offset[1]))
                     contours_selected.append(contour)
                     hierarchy_selected.append(hierarchy[0][cntr_id])
         
@@ -106,7 +157,7 @@ class GenerateIslands:
 
 
     def _get_centroid_for_island(self, contours, hierarchy):
-        if len(contours) == 0:
+        if len(contours) == 0 or not self.compute_centroids:
             return np.array([np.nan, np.nan])
 
         coordinates_for_polylabel = []
@@ -127,9 +178,93 @@ class GenerateIslands:
         return [int(centroid_coords[0]), int(centroid_coords[1])]
 
 
+    def _add_island(self, color_index, this_component, offset, start, island_id,
+                    area_perc_threshold, arc_length_area_ratio_threshold, check_shape_validity):
+        # this_component is the island cropped to its bounding box plus one
+        # pixel, whose top left corner is at offset (x, y) in the padded image.
+        self.island_fills[color_index].append(this_component)
+        self.island_offsets[color_index].append(offset)
+        self.island_ids[color_index].append(island_id)
+        self.island_starts[color_index].append(start)
+
+        # Get cleaned up contours
+        cleaned_up_contours, contours_selected, hierarchies_selected = self._get_cleaned_up_contours(
+            island_fill = this_component, 
+            area_perc_threshold = area_perc_threshold, 
+            arc_length_area_ratio_threshold = arc_length_area_ratio_threshold,
+            check_shape_validity = check_shape_validity,
+            offset = offset
+        )
+
+        # Get the centroid of the island
+        centroid_coords = self._get_centroid_for_island(
+            contours_selected,
+            hierarchies_selected
+        )
+        self.island_centroids[color_index].append(centroid_coords)
+
+        rows, cols = np.where(cleaned_up_contours == 0)
+        contour_border_coords = (rows + offset[1], cols + offset[0])
+        self.island_borders[color_index].append((color_index, contour_border_coords))
+
+
+    def _add_components(self, color_index, labels_im, stats, component_ids, origin,
+                        area_perc_threshold, arc_length_area_ratio_threshold, check_shape_validity,
+                        crop_islands = True, cancellation_token = None):
+        # labels_im holds the connected components of a part of the padded
+        # image whose top left corner is at origin (row, col). Components are
+        # added in the raster order of their first pixel: the order of the
+        # labels depends on the labeling algorithm used by OpenCV.
+        # crop_islands is config["crop_islands"].
+        starts = {}
+        for component_id in component_ids:
+            x, y, w = (int(value) for value in stats[component_id, :3])
+            starts[component_id] = (origin[0] + y,
+                                    origin[1] + x + int(np.argmax(labels_im[y, x:x + w] == component_id)))
+
+        for component_id in sorted(starts, key = starts.get):
+            if cancellation_token is not None:
+                cancellation_token.check()
+            island_id = self.next_island_id
+            self.next_island_id += 1
+            if crop_islands:
+                # Work on the bounding box of the component, with a margin of one
+                # pixel so that contours are found as in the full image.
+                x, y, w, h = (int(value) for value in stats[component_id, :4])
+                top, left = max(y - 1, 0), max(x - 1, 0)
+                bottom = min(y + h + 1, labels_im.shape[0])
+                right = min(x + w + 1, labels_im.shape[1])
+                this_component = np.pad(
+                    (labels_im[top:bottom, left:right] == component_id).astype(np.uint8),
+                    ((top - (y - 1), (y + h + 1) - bottom), (left - (x - 1), (x + w + 1) - right)),
+                    mode='constant', constant_values=0)
+                island_pixels = this_component[1:-1, 1:-1].astype(bool)
+                self.island_map[origin[0] + y:origin[0] + y + h,
+                                origin[1] + x:origin[1] + x + w][island_pixels] = island_id
+                offset = (origin[1] + x - 1, origin[0] + y - 1)
+            else:
+                # Reference implementation: the component in the whole of labels_im.
+                this_component = (labels_im == component_id).astype(np.uint8)
+                self.island_map[origin[0]:origin[0] + labels_im.shape[0],
+                                origin[1]:origin[1] + labels_im.shape[1]][this_component.astype(bool)] \
+                    = island_id
+                offset = (origin[1], origin[0])
+
+            self._add_island(
+                color_index = color_index,
+                this_component = this_component,
+                offset = offset,
+                start = starts[component_id],
+                island_id = island_id,
+                area_perc_threshold = area_perc_threshold,
+                arc_length_area_ratio_threshold = arc_length_area_ratio_threshold,
+                check_shape_validity = check_shape_validity,
+            )
+
+
     def _get_islands_for_one_color(self, color_index, border_padding, area_perc_threshold, 
                                    arc_length_area_ratio_threshold, check_shape_validity,
-                                   open_kernel_size):
+                                   open_kernel_size, crop_islands = True, cancellation_token = None):
         # Get a binary image with just the selected color
         this_color = (self.indices_color_choices == color_index).astype(np.uint8)
         # Pad the image to enable border detection on image boundaries
@@ -140,40 +275,88 @@ class GenerateIslands:
         this_color = cv.morphologyEx(this_color, cv.MORPH_OPEN, kernel)
 
         # Find connected components
-        num_labels, labels_im = cv.connectedComponents(this_color)
+        num_labels, labels_im, stats, _ = cv.connectedComponentsWithStats(this_color)
 
-        for component_id in range(1, num_labels):
-            this_component = (labels_im == component_id).astype(np.uint8)
-            self.island_fills[color_index].append(this_component)
-            
+        self._add_components(
+            color_index = color_index,
+            labels_im = labels_im,
+            stats = stats,
+            component_ids = range(1, num_labels),
+            origin = (0, 0),
+            area_perc_threshold = area_perc_threshold,
+            arc_length_area_ratio_threshold = arc_length_area_ratio_threshold,
+            check_shape_validity = check_shape_validity,
+            crop_islands = crop_islands,
+            cancellation_token = cancellation_token,
+        )
 
-            # Get cleaned up contours
-            cleaned_up_contours, contours_selected, hierarchies_selected = self._get_cleaned_up_contours(
-                island_fill = this_component, 
-                area_perc_threshold = area_perc_threshold, 
-                arc_length_area_ratio_threshold = arc_length_area_ratio_threshold,
-                check_shape_validity = check_shape_validity
-            )
 
-            # Get the centroid of the island
-            centroid_coords = self._get_centroid_for_island(
-                contours_selected,
-                hierarchies_selected
-            )
-            self.island_centroids[color_index].append(centroid_coords)
+    def _padded_labels(self, top, bottom, left, right, border_padding):
+        # Part of the color indices padded with border_padding zeros, given
+        # in padded image coordinates.
+        height, width = self.indices_color_choices.shape
+        crop = np.zeros((bottom - top, right - left), dtype = self.indices_color_choices.dtype)
+        inner_top, inner_left = max(top, border_padding), max(left, border_padding)
+        inner_bottom = min(bottom, height + border_padding)
+        inner_right = min(right, width + border_padding)
+        if inner_top < inner_bottom and inner_left < inner_right:
+            crop[inner_top - top:inner_bottom - top, inner_left - left:inner_right - left] = \
+                self.indices_color_choices[inner_top - border_padding:inner_bottom - border_padding,
+                                           inner_left - border_padding:inner_right - border_padding]
+        return crop
+
 
-            contour_border_coords = np.where(cleaned_up_contours == 0)
-            self.island_borders[color_index].append((color_index, contour_border_coords))
+    def _island_lists(self):
+        # Per color lists describing the islands, with one entry per island.
+        return (self.island_borders, self.island_centroids, self.island_fills,
+                self.island_offsets, self.island_ids, self.island_starts)
+
+
+    def _flatten(self):
+        # Flatten the list of borders. island_ids_list has the id of each island.
+        island_borders_list = []
+        centroid_coords_list = []
+        self.island_ids_list = []
+        for color_id in self.island_borders:
+            for idx, border_coords in enumerate(self.island_borders[color_id]):
+                if len(border_coords[1][0]) > 0:
+                    island_borders_list.append(self.island_borders[color_id][idx])
+                    centroid_coords_list.append(self.island_centroids[color_id][idx])
+                    self.island_ids_list.append(self.island_ids[color_id][idx])
+        
+        return island_borders_list, centroid_coords_list
 
     
-    def get_islands(self, config = default_config):
+    def islands(self):
+        """Returns the lists returned by the last get_islands or update_islands."""
+        return self._flatten()
+
+    
+    def get_islands(self, config = default_config, cancellation_token = None):
+        """
+        Args:
+            config: Dictionary of configuration parameters.
+            cancellation_token: cancellation.CancellationToken checked for
+                every color and every island (optional).
+
+        Returns:
+            List of (color_index, border coordinates) of the islands and
+            list of the coordinates of their centroids.
+        """
         border_padding = config["border_padding"]
         area_perc_threshold = config["area_perc_threshold"]
         arc_length_area_ratio_threshold = config["arc_length_area_ratio_threshold"]
         check_shape_validity = config["check_shape_validity"]
         open_kernel_size = config["open_kernel_size"]
+        crop_islands = config["crop_islands"]
 
+        self._reset()
+        height, width = self.indices_color_choices.shape
+        self.island_map = np.zeros((height + 2 * border_padding, width + 2 * border_padding),
+                                   dtype = np.int32)
         for color_index in np.unique(self.indices_color_choices):
+            if cancellation_token is not None:
+                cancellation_token.check()
             self._get_islands_for_one_color(
                 color_index = color_index, 
                 border_padding = border_padding, 
@@ -181,15 +364,138 @@ class GenerateIslands:
                 arc_length_area_ratio_threshold = arc_length_area_ratio_threshold,
                 check_shape_validity = check_shape_validity,
                 open_kernel_size = open_kernel_size,
+                crop_islands = crop_islands,
+                cancellation_token = cancellation_token,
             )
         
-        # Flatten the list of borders
-        island_borders_list = []
-        centroid_coords_list = []
-        for color_id in self.island_borders:
-            for idx, border_coords in enumerate(self.island_borders[color_id]):
-                if len(border_coords[1][0]) > 0:
-                    island_borders_list.append(self.island_borders[color_id][idx])
-                    centroid_coords_list.append(self.island_centroids[color_id][idx])
-        
-        return island_borders_list, centroid_coords_list
+        return self._flatten()
+
+
+    def update_islands(self, region_mask, new_color_indices, config = default_config):
+        """
+        Changes the color indices of the pixels in region_mask, in place, and
+        updates the islands found by get_islands. Only the islands near the
+        edited pixels are recomputed, so the cost depends on the size of the
+        edit and of the islands it touches rather than on the image size.
+        The results are the same as those of get_islands on the edited indices.
+
+        Args:
+            region_mask: 2D boolean array with the shape of the image.
+            new_color_indices: Color index (starting at 1) for the pixels in
+                region_mask, or 2D array of color indices with the shape of
+                the image of which only the pixels in region_mask are used.
+            config: Configuration used by the previous get_islands.
+
+        Returns:
+            List of (color_index, border coordinates) of the islands, list of
+            the coordinates of their centroids, and the (top, bottom, left,
+            right) box of the padded image outside of which the islands did
+            not change, or None if region_mask is empty.
+        """
+        assert self.island_map is not None, "get_islands must run before update_islands."
+        border_padding = config["border_padding"]
+        area_perc_threshold = config["area_perc_threshold"]
+        arc_length_area_ratio_threshold = config["arc_length_area_ratio_threshold"]
+        check_shape_validity = config["check_shape_validity"]
+        open_kernel_size = config["open_kernel_size"]
+        crop_islands = config["crop_islands"]
+
+        region_mask = np.asarray(region_mask, dtype = bool)
+        rows, cols = np.nonzero(region_mask)
+        if len(rows) == 0:
+            return self._flatten() + (None,)
+        self.indices_color_choices[region_mask] = \
+            np.broadcast_to(new_color_indices, region_mask.shape)[region_mask]
+
+        # The opening only changes within reach of the edited pixels (the
+        # dirty box), and needs the labels within reach of those pixels.
+        map_height, map_width = self.island_map.shape
+        reach = 2 * open_kernel_size
+        def _grow(box, margin):
+            top, bottom, left, right = box
+            return (max(top - margin, 0), min(bottom + margin, map_height),
+                    max(left - margin, 0), min(right + margin, map_width))
+        dirty = _grow((rows.min() + border_padding, rows.max() + border_padding + 1,
+                       cols.min() + border_padding, cols.max() + border_padding + 1), reach)
+        window = _grow(dirty, reach)
+        # Islands touching the dirty box, or next to it, may merge with or
+        # be split by the edit: they are all recomputed.
+        touching = _grow(dirty, 1)
+
+        island_locations = {}
+        for color_index, ids in self.island_ids.items():
+            for idx, island_id in enumerate(ids):
+                island_locations[island_id] = (color_index, idx)
+        removed_ids = np.unique(
+            self.island_map[touching[0]:touching[1], touching[2]:touching[3]])
+        removed_ids = set(int(island_id) for island_id in removed_ids if island_id != 0)
+
+        # Area holding the dirty box and all the removed islands.
+        area = list(touching)
+        for island_id in removed_ids:
+            color_index, idx = island_locations[island_id]
+            x, y = self.island_offsets[color_index][idx]
+            h, w = self.island_fills[color_index][idx].shape
+            area = [min(area[0], max(y, 0)), max(area[1], min(y + h, map_height)),
+                    min(area[2], max(x, 0)), max(area[3], min(x + w, map_width))]
+        area_map = self.island_map[area[0]:area[1], area[2]:area[3]]
+        area_opened = area_map != 0
+        area_labels = self._padded_labels(*area, border_padding)
+        window_labels = self._padded_labels(*window, border_padding)
+        dirty_in_area = (slice(dirty[0] - area[0], dirty[1] - area[0]),
+                         slice(dirty[2] - area[2], dirty[3] - area[2]))
+        dirty_in_window = (slice(dirty[0] - window[0], dirty[1] - window[0]),
+                           slice(dirty[2] - window[2], dirty[3] - window[2]))
+        touching_in_area = (slice(touching[0] - area[0], touching[1] - area[0]),
+                            slice(touching[2] - area[2], touching[3] - area[2]))
+
+        # Forget the removed islands.
+        removed_colors = set()
+        for color_index, ids in self.island_ids.items():
+            keep = [idx for idx, island_id in enumerate(ids) if island_id not in removed_ids]
+            if len(keep) == len(ids):
+                continue
+            removed_colors.add(color_index)
+            for island_lists in self._island_lists():
+                island_lists[color_index] = [island_lists[color_index][idx] for idx in keep]
+        area_map[np.isin(area_map, list(removed_ids))] = 0
+
+        kernel = np.ones((open_kernel_size, open_kernel_size), np.uint8)
+        colors = set(np.unique(window_labels)) | removed_colors
+        colors.discard(0)
+        for color_index in sorted(colors):
+            for island_lists in self._island_lists():
+                island_lists.setdefault(color_index, [])
+
+            # Opened mask of this color: unchanged outside the dirty box,
+            # recomputed from the window of labels inside it.
+            this_color = (area_opened & (area_labels == color_index)).astype(np.uint8)
+            opened = cv.morphologyEx((window_labels == color_index).astype(np.uint8),
+                                     cv.MORPH_OPEN, kernel)
+            this_color[dirty_in_area] = opened[dirty_in_window]
+
+            num_labels, labels_im, stats, _ = cv.connectedComponentsWithStats(this_color)
+            component_ids = np.unique(labels_im[touching_in_area])
+            self._add_components(
+                color_index = color_index,
+                labels_im = labels_im,
+                stats = stats,
+                component_ids = component_ids[component_ids != 0],
+                origin = (area[0], area[2]),
+                area_perc_threshold = area_perc_threshold,
+                arc_length_area_ratio_threshold = arc_length_area_ratio_threshold,
+                check_shape_validity = check_shape_validity,
+                crop_islands = crop_islands,
+            )
+
+            # Keep the order of get_islands.
+            order = sorted(range(len(self.island_starts[color_index])),
+                           key = lambda idx: self.island_starts[color_index][idx])
+            for island_lists in self._island_lists():
+                island_lists[color_index] = [island_lists[color_index][idx] for idx in order]
+
+        for island_lists in self._island_lists():
+            for color_index in sorted(island_lists):
+                island_lists[color_index] = island_lists.pop(color_index)
+
+        return self._flatten() + (tuple(area),)
@@ -0,0 +1,202 @@
+import struct
+import zlib
+
+import cv2 as cv
+import numpy as np
+
+from .config import default_config, make_config
+from .gen_islands import GenerateIslands
+
+# File layout, all little endian:
+#   header           HEADER_FORMAT: magic, version, bytes per island id (2 or 4),
+#                    height, width, number of islands, number of colors.
+#   palette          (number of colors, 3) uint8 RGB colors.
+#   island table     One ISLAND_DTYPE record per island. Island i is stored
+#                    at index i - 1; island 0 means "no island".
+#   island id map    uint32 length, then the zlib compressed (height, width)
+#                    array giving the island of every pixel of the page.
+MAGIC = b"CBNI"
+VERSION = 1
+HEADER_FORMAT = "<4sHHIIII"
+
+ISLAND_DTYPE = np.dtype([
+    ("color_id", "<u2"),   # Color index (starting at 1) of the island.
+    ("number_x", "<i4"),   # Position of the number, -1 if it has none.
+    ("number_y", "<i4"),
+    ("left", "<i4"),       # Bounding box, end exclusive.
+    ("top", "<i4"),
+    ("right", "<i4"),
+    ("bottom", "<i4"),
+    ("area", "<u4"),       # Number of pixels.
+])
+
+
+def island_id_map(generate_islands_obj, border_padding, fill_gaps = True):
+    """
+    Returns the island of every pixel of the page, numbering islands from 1
+    in the order of island_borders_list, and 0 for pixels of no island.
+
+    Args:
+        generate_islands_obj: GenerateIslands after get_islands.
+        border_padding: config["border_padding"] used by get_islands.
+        fill_gaps: If True, pixels of the image that belong to no island,
+            such as the small areas removed by the open operation, are given
+            to the closest island, so that tapping anywhere inside the
+            borders of an island selects it.
+    """
+    island_map = generate_islands_obj.island_map
+    lookup = np.zeros(generate_islands_obj.next_island_id, dtype = np.uint32)
+    lookup[generate_islands_obj.island_ids_list] = \
+        np.arange(1, len(generate_islands_obj.island_ids_list) + 1)
+    id_map = lookup[island_map]
+    if not fill_gaps or not len(generate_islands_obj.island_ids_list):
+        return id_map
+
+    # Every pixel gets the label of the closest pixel of an island; with
+    # DIST_LABEL_PIXEL these labels are numbered in raster order.
+    gaps = (id_map == 0).astype(np.uint8)
+    _, labels = cv.distanceTransformWithLabels(gaps, cv.DIST_L2, 3, labelType = cv.DIST_LABEL_PIXEL)
+    nearest = np.concatenate([[0], id_map[gaps == 0]])
+    filled = nearest[labels]
+
+    height, width = island_map.shape
+    inside = (slice(border_padding, height - border_padding), slice(border_padding, width - border_padding))
+    id_map[inside] = filled[inside]
+    return id_map
+
+
+def _island_table(id_map, island_borders_list, number_coords_list):
+    num_islands = len(island_borders_list)
+    table = np.zeros(num_islands, dtype = ISLAND_DTYPE)
+    table["color_id"] = [color_id for color_id, _ in island_borders_list]
+    for idx, position in enumerate(number_coords_list):
+        if np.isnan(position).any():
+            table["number_x"][idx] = table["number_y"][idx] = -1
+        else:
+            table["number_x"][idx], table["number_y"][idx] = (int(c) for c in position)
+
+    rows, cols = np.nonzero(id_map)
+    islands = id_map[rows, cols].astype(np.intp) - 1
+    table["area"] = np.bincount(islands, minlength = num_islands)
+    for field, coords, reduce, initial in (("left", cols, np.minimum, id_map.shape[1]),
+                                           ("top", rows, np.minimum, id_map.shape[0]),
+                                           ("right", cols + 1, np.maximum, 0),
+                                           ("bottom", rows + 1, np.maximum, 0)):
+        values = np.full(num_islands, initial, dtype = np.int64)
+        reduce.at(values, islands, coords)
+        table[field] = values
+    return table
+
+
+def write_interactive_page(result, fileobj, config = default_config,
+                           generate_islands_obj = None, fill_gaps = True):
+    """
+    Writes a page for digital "tap to fill" coloring: the island of every
+    pixel, the color, number position and bounding box of every island, and
+    the palette, in one binary file (see the layout at the top of this
+    module, and InteractivePage to read it). Finding the island under a tap
+    is then a single lookup in the id map, and filling it only needs the
+    part of the id map inside its bounding box.
+
+    Args:
+        result: pipeline.Result of the page.
+        fileobj: Path or binary file object to write to.
+        config: Dictionary of configuration parameters used to create result.
+        generate_islands_obj: GenerateIslands that found the islands of
+            result (optional). Defaults to result.generate_islands_obj; if
+            that is None too, the islands are found again.
+        fill_gaps: See island_id_map.
+    """
+    if isinstance(fileobj, str):
+        with open(fileobj, "wb") as f:
+            return write_interactive_page(result, f, config, generate_islands_obj, fill_gaps)
+
+    config = make_config(config)
+    if generate_islands_obj is None:
+        generate_islands_obj = result.generate_islands_obj
+    if generate_islands_obj is None:
+        generate_islands_obj = GenerateIslands(result.indices_color_choices)
+        generate_islands_obj.get_islands(config = config)
+    assert len(generate_islands_obj.island_ids_list) == len(result.island_borders_list), \
+        "generate_islands_obj does not match result."
+
+    id_map = island_id_map(generate_islands_obj, config["border_padding"], fill_gaps)
+    table = _island_table(id_map, result.island_borders_list, result.centroid_coords_list)
+    palette = np.asarray(result.color_list, dtype = np.uint8).reshape((-1, 3))
+    id_dtype = np.dtype("<u2") if len(table) < (1 << 16) else np.dtype("<u4")
+    compressed_map = zlib.compress(id_map.astype(id_dtype).tobytes())
+
+    height, width = id_map.shape
+    fileobj.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION, id_dtype.itemsize,
+                              height, width, len(table), len(palette)))
+    fileobj.write(palette.tobytes())
+    fileobj.write(table.tobytes())
+    fileobj.write(struct.pack("<I", len(compressed_map)))
+    fileobj.write(compressed_map)
+
+
+class InteractivePage:
+    def __init__(self, id_map, islands, color_list):
+        """
+        Page written by write_interactive_page.
+
+        Args:
+            id_map: Island (starting at 1, 0 for none) of every pixel of the page.
+            islands: ISLAND_DTYPE array describing island i at index i - 1.
+            color_list: (N, 3) uint8 array of the RGB colors of the palette.
+        """
+        self.id_map = id_map
+        self.islands = islands
+        self.color_list = color_list
+
+    @classmethod
+    def read(cls, fileobj):
+        """Reads a page from a path or a binary file object."""
+        if isinstance(fileobj, str):
+            with open(fileobj, "rb") as f:
+                return cls.read(f)
+
+        header = fileobj.read(struct.calcsize(HEADER_FORMAT))
+        magic, version, id_bytes, height, width, num_islands, num_colors = \
+            struct.unpack(HEADER_FORMAT, header)
+        assert magic == MAGIC, "Not an interactive page."
+        assert version == VERSION, f"Unsupported interactive page version: {version}"
+
+        color_list = np.frombuffer(fileobj.read(3 * num_colors), dtype = np.uint8).reshape((-1, 3))
+        islands = np.frombuffer(fileobj.read(ISLAND_DTYPE.itemsize * num_islands), dtype = ISLAND_DTYPE)
+        compressed_length, = struct.unpack("<I", fileobj.read(4))
+        id_map = np.frombuffer(zlib.decompress(fileobj.read(compressed_length)),
+                               dtype = "<u%d" % id_bytes).reshape((height, width))
+        return cls(id_map, islands, color_list)
+
+    def hit_test(self, x, y):
+        """Returns the island (starting at 1) at pixel (x, y), or 0 if there is none."""
+        height, width = self.id_map.shape
+        if not (0 <= x < width and 0 <= y < height):
+            return 0
+        return int(self.id_map[int(y), int(x)])
+
+    def island_mask(self, island):
+        """
+        Returns (box, mask) with box the (top, bottom, left, right) bounding
+        box of an island and mask the boolean mask of its pixels in the box.
+        """
+        record = self.islands[island - 1]
+        top, bottom, left, right = (int(record[field]) for field in ("top", "bottom", "left", "right"))
+        return (top, bottom, left, right), self.id_map[top:bottom, left:right] == island
+
+    def fill(self, image, island, color = None):
+        """
+        Paints an island on an image of the page, in place.
+
+        Args:
+            image: RGB image with the shape of the page.
+            island: Island to paint, as returned by hit_test. 0 does nothing.
+            color: (R, G, B) color. Defaults to the color of the island.
+        """
+        if island == 0:
+            return
+        if color is None:
+            color = self.color_list[self.islands[island - 1]["color_id"] - 1]
+        (top, bottom, left, right), mask = self.island_mask(island)
+        image[top:bottom, left:right][mask] = color
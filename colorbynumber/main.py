@@ -1,72 +1,214 @@
+import time
+
 import cv2 as cv
 import numpy as np
 
-from .config import default_config
-from .simplify_image import simplify_image, downsample_image
-from .gen_islands import GenerateIslands
-from .numbered_islands import create_islands, add_numbers_to_image
+from .cancellation import CancellationToken
+from .config import default_config, make_config
+from .simplify_image import downsample_image
+from .interactive_page import write_interactive_page
+from .legend import generate_color_legend
+from .page_editor import PageEditor
+from .pipeline import STAGES, PaletteSpec, Result, iter_stages
+from .shared_arrays import SharedArray, SharedArrays, pack_island_borders
+
+def load_image(image_path):
+    """Reads an image file as a downsampled RGB array."""
+    image = cv.imread(image_path)
+    image = cv.cvtColor(image, cv.COLOR_BGR2RGB)
+    return downsample_image(image)
 
 class ColorByNumber:
-    def __init__(self, image_path, 
+    def __init__(self, image_path = None, 
                  color_list = None, num_colors = None,
-                 config = default_config):
+                 config = default_config,
+                 image = None,
+                 shadow = None,
+                 cancellation_token = None,
+                 timeout = None,
+                 downsample = True):
         """
         Args:
             image_path: Path to the image file.
             color_list: List of colors in (R, G, B) format.
             config: Dictionary of configuration parameters (optional).
+            image: Image in the RGB color space as a 3D array.
+                Used instead of reading image_path (optional).
+            shadow: shadow.ShadowMode comparing a sample of the results with
+                the reference implementation (optional).
+            cancellation_token: cancellation.CancellationToken that another
+                thread can cancel to stop create_color_by_number (optional).
+            timeout: Seconds after which each call of create_color_by_number
+                or iter_color_by_number stops with DeadlineExceeded (optional).
+            downsample: If False, image is used as is, without a copy, because
+                it was already downsampled (for example by load_image).
         """
         assert color_list is not None or num_colors is not None, \
             "Either color_list or num_colors must be provided."
+        assert image_path is not None or image is not None, \
+            "Either image_path or image must be provided."
 
         self.image_path = image_path
-        self.config = config
+        self.config = make_config(config)
         self.color_list = color_list
         self.num_colors = num_colors
+        self.shadow = shadow
+        self.cancellation_token = cancellation_token
+        self.timeout = timeout
+
+        if image is None:
+            self.image = load_image(self.image_path)
+        elif downsample:
+            self.image = downsample_image(image)
+        else:
+            self.image = image
+
+        # Created by the first call to edit.
+        self.page_editor = None
+
+    @classmethod
+    def from_shared_image(cls, image_descriptor,
+                          color_list = None, num_colors = None,
+                          config = default_config, cancellation_token = None, timeout = None):
+        """
+        Creates a ColorByNumber from an image in shared memory, given the
+        SharedArray descriptor sent by another process. The image is copied
+        out of the segment, which was already downsampled by the sender. The
+        segment is not unlinked; that is left to the process that created it.
+
+        To stop the run from the sending process, pass a
+        shared_arrays.SharedCancellationToken attached to the sender's token.
+        """
+        shared_image = SharedArray.attach(image_descriptor)
+        try:
+            return cls(
+                color_list = color_list,
+                num_colors = num_colors,
+                config = config,
+                image = shared_image.array.copy(),
+                cancellation_token = cancellation_token,
+                timeout = timeout,
+                downsample = False,
+            )
+        finally:
+            shared_image.close()
 
-        image = cv.imread(self.image_path)
-        image = cv.cvtColor(image, cv.COLOR_BGR2RGB)
-        image = downsample_image(image)
-        self.image = image
+    def iter_color_by_number(self, progress_callback = None):
+        """
+        Yields the intermediate results of pipeline.iter_stages as each stage
+        completes and finally the pipeline.Result, whose outputs are then
+        stored as attributes of this object.
 
-    def create_color_by_number(self):
+        Raises cancellation.Cancelled, with the last stage completed as its
+        partial_result, if the run is cancelled or exceeds its timeout.
 
-        simplified_image, indices_color_choices, color_list = simplify_image(
-            image=self.image, 
-            color_list=self.color_list,
-            num_colors=self.num_colors,
-            config=self.config
+        Args:
+            progress_callback: Called with the name of each stage in STAGES
+                when that stage starts (optional).
+        """
+        palette_spec = PaletteSpec(color_list = self.color_list, num_colors = self.num_colors)
+        cancellation_token = self.cancellation_token
+        if self.timeout is not None:
+            cancellation_token = CancellationToken.with_timeout(self.timeout, parent = cancellation_token)
+        stages = iter_stages(
+            image = self.image,
+            palette_spec = palette_spec,
+            config = self.config,
+            progress_callback = progress_callback,
+            cancellation_token = cancellation_token,
             )
-        # Assigning the color_list to the one returned by simplify_image
+        # Time spent in the pipeline, not in the caller between stages.
+        elapsed = 0
+        while True:
+            start = time.perf_counter()
+            stage = next(stages, None)
+            elapsed += time.perf_counter() - start
+            if stage is None:
+                break
+
+            if isinstance(stage, Result):
+                self.page_editor = None
+                self._set_result(stage)
+                if self.shadow is not None and self.shadow.should_sample():
+                    self.shadow.record(self.image, palette_spec, self.config, stage, elapsed)
+            yield stage
+
+    def _set_result(self, result):
+        self.result = result
+
+        # Assigning the color_list to the one returned by the pipeline
         # because if it was initially None, it would have been assigned a value.
-        self.color_list = color_list
-        self.simplified_image = simplified_image
-
-        generate_islands_obj = GenerateIslands(indices_color_choices)
-        island_borders_list, centroid_coords_list = generate_islands_obj.get_islands(config=self.config)
-        self.generate_islands_obj = generate_islands_obj
-        self.island_borders_list = island_borders_list
-        self.centroid_coords_list = centroid_coords_list
-
-        # Create the islands image
-        self.islands_image = create_islands(
-            islands = self.island_borders_list, 
-            image_shape = self.image.shape, 
-            padding = self.config["border_padding"], 
-            border_color = self.config["border_color"]
-            )
+        self.color_list = result.color_list
+        self.simplified_image = result.simplified_image
+        self.island_borders_list = result.island_borders_list
+        self.centroid_coords_list = result.centroid_coords_list
+        self.islands_image = result.islands_image
+        self.numbered_islands = result.numbered_islands
+
+    def create_color_by_number(self, progress_callback = None):
+        """
+        Runs pipeline.run and stores its outputs as attributes of this object.
+        Raises cancellation.Cancelled as iter_color_by_number does.
 
-        # Add numbers to the islands image
-        self.numbered_islands = add_numbers_to_image(
-            image=self.islands_image,
-            centroid_coords_list=self.centroid_coords_list,
-            color_id_list=[color_id for color_id, _ in self.island_borders_list],
-            font_size=self.config["font_size"],
-            font_color=self.config["font_color"],
-            font_thickness=self.config["font_thickness"]
-            )
+        Args:
+            progress_callback: Called with the name of each stage in STAGES
+                when that stage starts (optional).
+        """
+        for _ in self.iter_color_by_number(progress_callback):
+            pass
+        return self.numbered_islands
 
+    def edit(self, region_mask, new_color_indices):
+        """
+        Changes the color of the pixels in region_mask after
+        create_color_by_number, recomputing only the islands near them.
+        See PageEditor.edit.
+
+        Args:
+            region_mask: 2D boolean array with the shape of the image.
+            new_color_indices: Color index (starting at 1) for the pixels in
+                region_mask, or 2D array of color indices with the shape of the image.
+        """
+        if self.page_editor is None:
+            self.page_editor = PageEditor(self.result, self.config)
+        self._set_result(self.page_editor.edit(region_mask, new_color_indices))
         return self.numbered_islands
+
+    def write_interactive_page(self, fileobj):
+        """
+        Writes the page for digital "tap to fill" coloring after
+        create_color_by_number. See interactive_page.write_interactive_page.
+
+        Args:
+            fileobj: Path or binary file object to write to.
+        """
+        # The islands kept in the result are reused, edited or not.
+        write_interactive_page(self.result, fileobj, self.config)
+
+    def share_results(self):
+        """
+        Copies the results of create_color_by_number and the color legend into
+        shared memory so that only SharedArrays.descriptor has to be sent to
+        another process. Island borders are packed with pack_island_borders.
+
+        The caller owns the returned SharedArrays: it should close() them once
+        the descriptor is handed over, and the receiver should unlink() them.
+        """
+        centroid_coords = np.array(
+            [[np.nan, np.nan] if np.isnan(centroid).any() else centroid
+             for centroid in self.centroid_coords_list],
+            dtype = np.float64,
+        ).reshape((-1, 2))
+
+        return SharedArrays.from_arrays(dict(
+            numbered_islands = self.numbered_islands,
+            islands_image = self.islands_image,
+            simplified_image = self.simplified_image,
+            legend = self.generate_color_legend(),
+            color_list = np.array(self.color_list),
+            centroid_coords = centroid_coords,
+            **pack_island_borders(self.island_borders_list),
+        ))
     
     def generate_color_legend(self,
                             cols=7,
@@ -80,6 +222,7 @@ class ColorByNumber:
                             ):
         """
         Generates a grid of colored squares with labels below them.
+        See legend.generate_color_legend.
 
         Args:
             cols: Number of columns in the grid.
@@ -92,48 +235,15 @@ class ColorByNumber:
             font_size: Font size for the labels.
             border_color: Color of the border around each square.
         """
-
-        # Calculate grid dimensions if not provided
-        if rows is None and cols is None:
-            num_colors = len(self.color_list)
-            rows = cols = int(np.sqrt(num_colors)) + 1
-
-        elif rows is None:
-            cols = min(cols, len(self.color_list))
-            rows = int(np.ceil(len(self.color_list) / cols))
-
-        # Calculate total width and height based on margins, gaps, and squares
-        total_width = 2 * margin + (cols + 1) * square_size + (cols - 1) * gap_horizontal
-        total_height = 2 * margin + (rows + 1) * square_size + (rows - 1) * gap_vertical
-
-        # Create a white image
-        image = np.ones((total_height, total_width, 3), dtype=np.uint8) * 255
-
-        # Fill squares with colors
-        for i, color in enumerate(self.color_list):
-            row = i // cols
-            col = i % cols
-
-            start_col = margin + col * (square_size + gap_horizontal)
-            end_col = start_col + square_size
-
-            start_row = margin + row * (square_size + gap_vertical)
-            end_row = start_row + square_size
-
-            # Fill square with color
-            image[start_row:end_row, start_col:end_col] = color
-
-            # Draw border around that color
-            image[start_row, start_col:end_col] = border_color # Top Border
-            image[end_row, start_col:end_col] = border_color # Bottom Border
-            image[start_row:end_row, start_col] = border_color # Left Border
-            image[start_row:end_row, end_col] = border_color # Right Border
-
-            # Draw text label below the square
-            text = str(i + 1)
-            text_size, _ = cv.getTextSize(text, font, font_size, 1)
-            text_row = (end_row + text_size[1]) + 5
-            text_col = start_col + (square_size // 2) - (text_size[0] // 2)
-            cv.putText(image, text, (text_col, text_row), font, font_size, (0, 0, 0), 1)
-
-        return image
+        return generate_color_legend(
+            self.color_list,
+            cols=cols,
+            rows=rows,
+            square_size=square_size,
+            margin=margin,
+            gap_horizontal=gap_horizontal,
+            gap_vertical=gap_vertical,
+            font=font,
+            font_size=font_size,
+            border_color=border_color,
+            )
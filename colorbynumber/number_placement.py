@@ -0,0 +1,205 @@
+from collections import namedtuple
+
+import cv2 as cv
+import numpy as np
+
+from .config import default_config
+from .numbered_islands import add_numbers_to_image
+
+FONT = cv.FONT_HERSHEY_SIMPLEX
+
+# Each smaller font size tried is this fraction of the previous one.
+FONT_SCALE_STEP = 0.75
+
+# Numbers are moved by steps of this fraction of their height, up to
+# MAX_NUDGE_STEPS steps away from the centroid horizontally and vertically.
+NUDGE_STEP = 0.5
+MAX_NUDGE_STEPS = 4
+
+# Moves tried, closest first.
+_NUDGES = sorted(
+    ((dx, dy) for dx in range(-MAX_NUDGE_STEPS, MAX_NUDGE_STEPS + 1)
+     for dy in range(-MAX_NUDGE_STEPS, MAX_NUDGE_STEPS + 1)),
+    key = lambda nudge: nudge[0]**2 + nudge[1]**2,
+)
+
+# Outcome of place_numbers, with one entry per island.
+NumberPlacement = namedtuple("NumberPlacement", [
+    "positions",   # (x, y) position of every number, NaN if it was dropped.
+    "font_sizes",  # Font size of every number.
+    "dropped",     # Indices of the islands whose number was dropped.
+])
+
+
+def _text_box(text, position, font_size, font_thickness):
+    # Box (x0, y0, x1, y1) covered by the text drawn by
+    # numbered_islands._add_text_to_image, end exclusive.
+    (text_width, text_height), _ = cv.getTextSize(text, FONT, font_size, 1)
+    left = int(position[0]) - text_width // 2
+    bottom = int(position[1]) + text_height // 2
+    margin = font_thickness // 2 + 1
+    return (left - margin, bottom - text_height - margin,
+            left + text_width + margin, bottom + margin)
+
+
+def _boxes_overlap(box_a, box_b):
+    return box_a[0] < box_b[2] and box_b[0] < box_a[2] \
+        and box_a[1] < box_b[3] and box_b[1] < box_a[3]
+
+
+class _BoxGrid:
+    """Uniform grid over the page indexing the boxes of the placed numbers,
+    so that checking a box only looks at the boxes near it."""
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.cells = {}
+
+    def _cells(self, box):
+        for cell_x in range(box[0] // self.cell_size, (box[2] - 1) // self.cell_size + 1):
+            for cell_y in range(box[1] // self.cell_size, (box[3] - 1) // self.cell_size + 1):
+                yield cell_x, cell_y
+
+    def overlaps(self, box):
+        return any(_boxes_overlap(box, other)
+                   for cell in self._cells(box) for other in self.cells.get(cell, ()))
+
+    def add(self, box):
+        for cell in self._cells(box):
+            self.cells.setdefault(cell, []).append(box)
+
+
+def _inside_island(island_map, island_id, box):
+    # The box and a margin of one pixel, so that the number does not cover
+    # the border of the island, must be inside the island.
+    top, left = box[1] - 1, box[0] - 1
+    bottom, right = box[3] + 1, box[2] + 1
+    if top < 0 or left < 0 or bottom > island_map.shape[0] or right > island_map.shape[1]:
+        return False
+    return bool((island_map[top:bottom, left:right] == island_id).all())
+
+
+def place_numbers(island_map, island_ids, color_ids, centroid_coords_list, config = default_config,
+                  cancellation_token = None):
+    """
+    Chooses the position and size of the number of every island so that
+    numbers do not overlap and, when possible, stay inside their island.
+
+    Islands are handled from the smallest to the largest, since small islands
+    have the fewest places to put a number. Each number is first tried at the
+    centroid and then moved by small steps, closest first, at the configured
+    font size and then at smaller sizes down to min_font_scale * font_size.
+    A number that fits nowhere inside its island is placed at the centroid
+    if it does not overlap another number there, otherwise it is dropped.
+    Placed numbers are kept in a uniform grid, so each check only compares
+    boxes that are close to each other.
+
+    Args:
+        island_map: Id of the island covering each pixel of the padded image
+            (GenerateIslands.island_map).
+        island_ids: Id of every island (GenerateIslands.island_ids_list).
+        color_ids: Color index of every island.
+        centroid_coords_list: (x, y) centroid of every island, NaN if the
+            island has no number.
+        config: Dictionary of configuration parameters.
+        cancellation_token: cancellation.CancellationToken checked for every
+            island (optional).
+
+    Returns:
+        NumberPlacement
+    """
+    font_size = config["font_size"]
+    font_thickness = config["font_thickness"]
+    scales = [1]
+    while scales[-1] * FONT_SCALE_STEP >= config["min_font_scale"]:
+        scales.append(scales[-1] * FONT_SCALE_STEP)
+
+    (text_width, text_height), _ = cv.getTextSize("00", FONT, font_size, 1)
+    grid = _BoxGrid(cell_size = max(text_width, text_height, 1) + font_thickness + 2)
+
+    island_areas = np.bincount(island_map.ravel())
+    order = sorted(
+        (idx for idx, centroid in enumerate(centroid_coords_list) if not np.isnan(centroid).any()),
+        key = lambda idx: island_areas[island_ids[idx]],
+    )
+
+    positions = [np.array([np.nan, np.nan])] * len(centroid_coords_list)
+    font_sizes = [font_size] * len(centroid_coords_list)
+    dropped = [idx for idx, centroid in enumerate(centroid_coords_list) if np.isnan(centroid).any()]
+    for idx in order:
+        if cancellation_token is not None:
+            cancellation_token.check()
+        text = str(color_ids[idx])
+        centroid_x, centroid_y = (int(c) for c in centroid_coords_list[idx])
+        placement = None
+        fallback = None
+        for scale in scales:
+            size = font_size * scale
+            (_, height), _ = cv.getTextSize(text, FONT, size, 1)
+            step = max(int(height * NUDGE_STEP), 1)
+            for dx, dy in _NUDGES:
+                position = (centroid_x + dx * step, centroid_y + dy * step)
+                box = _text_box(text, position, size, font_thickness)
+                if grid.overlaps(box):
+                    continue
+                if _inside_island(island_map, island_ids[idx], box):
+                    placement = (position, size, box)
+                    break
+                if fallback is None and (dx, dy) == (0, 0):
+                    fallback = (position, size, box)
+            if placement is not None:
+                break
+
+        if placement is None:
+            placement = fallback
+        if placement is None:
+            dropped.append(idx)
+            continue
+        position, size, box = placement
+        grid.add(box)
+        positions[idx] = [position[0], position[1]]
+        font_sizes[idx] = size
+
+    return NumberPlacement(positions = positions, font_sizes = font_sizes, dropped = sorted(dropped))
+
+
+def draw_numbers(islands_image, island_borders_list, centroid_coords_list,
+                 generate_islands_obj, config = default_config, cancellation_token = None):
+    """
+    Draws the numbers of the islands on a copy of islands_image, placed as
+    set by config["number_placement"].
+
+    Args:
+        islands_image: Page with the island borders.
+        island_borders_list, centroid_coords_list: Returned by
+            generate_islands_obj.get_islands.
+        generate_islands_obj: GenerateIslands that found the islands.
+        config: Dictionary of configuration parameters.
+        cancellation_token: See place_numbers.
+
+    Returns:
+        (numbered_islands, placement) with placement a NumberPlacement, or
+        None if numbers are placed at the centroids.
+    """
+    color_ids = [color_id for color_id, _ in island_borders_list]
+    placement = None
+    if config["number_placement"] == "collision_aware":
+        placement = place_numbers(
+            island_map = generate_islands_obj.island_map,
+            island_ids = generate_islands_obj.island_ids_list,
+            color_ids = color_ids,
+            centroid_coords_list = centroid_coords_list,
+            config = config,
+            cancellation_token = cancellation_token,
+        )
+        centroid_coords_list = placement.positions
+
+    numbered_islands = add_numbers_to_image(
+        image=islands_image,
+        centroid_coords_list=centroid_coords_list,
+        color_id_list=color_ids,
+        font_size=config["font_size"],
+        font_color=config["font_color"],
+        font_thickness=config["font_thickness"],
+        font_sizes=None if placement is None else placement.font_sizes,
+        )
+    return numbered_islands, placement
@@ -40,13 +40,15 @@ def _add_text_to_image(image, text, position, font_size, font_color, font_thickn
 
 def add_numbers_to_image(image, 
                          centroid_coords_list, color_id_list, 
-                         font_size, font_color, font_thickness):
+                         font_size, font_color, font_thickness,
+                         font_sizes = None):
     """Add numbers to the image.
     
     Args:
         image (np.array): Numpy image.
         centroid_coords_list (list): A list of centroid coordinates for the islands.
         color_id_list (list): A list of color ids.
+        font_sizes (list): Font size of each number, overriding font_size (optional).
     Returns:
         np.array: A new image with the numbers added.
     """
@@ -59,7 +61,7 @@ def add_numbers_to_image(image,
                 image=numbered_islands, 
                 text=str(color_id), 
                 position=centroid,
-                font_size=font_size,
+                font_size=font_size if font_sizes is None else font_sizes[idx],
                 font_color=font_color,
                 font_thickness=font_thickness
             )
@@ -0,0 +1,151 @@
+import cv2 as cv
+import numpy as np
+
+from .config import default_config, make_config
+from .gen_islands import GenerateIslands
+from .numbered_islands import add_numbers_to_image
+from .number_placement import draw_numbers
+from .pipeline import Result
+
+
+class PageEditor:
+    def __init__(self, result, config = default_config):
+        """
+        Applies local edits, such as recoloring a patch or erasing noise, to
+        a page created by pipeline.run without running the pipeline again.
+        Each edit only recomputes the islands near the edited pixels and
+        redraws that part of the page.
+
+        The editor works on a copy of result.generate_islands_obj, which knows
+        which island covers each pixel. Results built or changed by the
+        caller without it, for example with
+        result._replace(generate_islands_obj = None), have their islands
+        found once more.
+
+        Args:
+            result: pipeline.Result of the page. It is not modified.
+            config: Dictionary of configuration parameters used to create result.
+        """
+        self.config = make_config(config)
+        self.color_list = result.color_list
+        self.simplified_image = result.simplified_image.copy()
+        self.islands_image = result.islands_image.copy()
+        self.numbered_islands = result.numbered_islands.copy()
+
+        if result.generate_islands_obj is not None:
+            self.generate_islands_obj = result.generate_islands_obj.copy()
+            self.island_borders_list, self.centroid_coords_list = \
+                self.generate_islands_obj.islands()
+        else:
+            self.generate_islands_obj = GenerateIslands(result.indices_color_choices.copy())
+            self.island_borders_list, self.centroid_coords_list = \
+                self.generate_islands_obj.get_islands(config = self.config)
+        self.number_coords_list = result.centroid_coords_list
+        self.number_font_sizes = result.number_font_sizes
+        self.dropped_numbers = result.dropped_numbers
+
+        # Numbers are drawn centered on their centroid: redrawing a part of
+        # the page redraws the numbers of centroids within this margin of it.
+        text_size, baseline = cv.getTextSize(
+            str(len(self.color_list)), cv.FONT_HERSHEY_SIMPLEX, self.config["font_size"], 1)
+        self.number_margin = max(text_size) + baseline + 2 * self.config["font_thickness"]
+
+    @property
+    def result(self):
+        """pipeline.Result of the edited page. Its arrays are updated in place by later edits."""
+        return Result(
+            simplified_image = self.simplified_image,
+            indices_color_choices = self.generate_islands_obj.indices_color_choices,
+            color_list = self.color_list,
+            island_borders_list = self.island_borders_list,
+            centroid_coords_list = self.number_coords_list,
+            islands_image = self.islands_image,
+            numbered_islands = self.numbered_islands,
+            number_font_sizes = self.number_font_sizes,
+            dropped_numbers = self.dropped_numbers,
+            generate_islands_obj = self.generate_islands_obj,
+        )
+
+    def edit(self, region_mask, new_color_indices):
+        """
+        Changes the color of the pixels in region_mask and updates the page.
+
+        Args:
+            region_mask: 2D boolean array with the shape of the image.
+            new_color_indices: Color index (starting at 1) for the pixels in
+                region_mask, or 2D array of color indices with the shape of
+                the image of which only the pixels in region_mask are used.
+
+        Returns:
+            pipeline.Result of the edited page.
+        """
+        region_mask = np.asarray(region_mask, dtype = bool)
+        new_color_indices = np.broadcast_to(new_color_indices, region_mask.shape)
+        assert new_color_indices[region_mask].min(initial = 1) >= 1 \
+            and new_color_indices[region_mask].max(initial = 1) <= len(self.color_list), \
+            "Color indices must be between 1 and the number of colors."
+
+        self.island_borders_list, self.centroid_coords_list, changed_box = \
+            self.generate_islands_obj.update_islands(region_mask, new_color_indices, self.config)
+        self.simplified_image[region_mask] = \
+            np.asarray(self.color_list)[new_color_indices[region_mask] - 1]
+        self.number_coords_list = self.centroid_coords_list
+        if changed_box is not None:
+            self._redraw_islands(changed_box)
+            if self.config["number_placement"] == "centroid":
+                self._redraw_numbers(changed_box)
+            else:
+                # Moving one number can move others anywhere on the page.
+                self._place_numbers()
+        return self.result
+
+    def _redraw_islands(self, box):
+        top, bottom, left, right = box
+        self.islands_image[top:bottom, left:right] = 255
+
+        island_map = self.generate_islands_obj.island_map
+        ids_in_box = set(np.unique(island_map[top:bottom, left:right]).tolist())
+        for island_id, (_, (rows, cols)) in zip(self.generate_islands_obj.island_ids_list,
+                                                self.island_borders_list):
+            if island_id in ids_in_box:
+                inside = (rows >= top) & (rows < bottom) & (cols >= left) & (cols < right)
+                self.islands_image[rows[inside], cols[inside]] = self.config["border_color"]
+
+    def _place_numbers(self):
+        self.numbered_islands[:], placement = draw_numbers(
+            islands_image = self.islands_image,
+            island_borders_list = self.island_borders_list,
+            centroid_coords_list = self.centroid_coords_list,
+            generate_islands_obj = self.generate_islands_obj,
+            config = self.config,
+        )
+        self.number_coords_list = placement.positions
+        self.number_font_sizes = placement.font_sizes
+        self.dropped_numbers = placement.dropped
+
+    def _redraw_numbers(self, box):
+        height, width = self.islands_image.shape[:2]
+        margin = self.number_margin
+        top, bottom = max(box[0] - margin, 0), min(box[1] + margin, height)
+        left, right = max(box[2] - margin, 0), min(box[3] + margin, width)
+
+        # Numbers are drawn in the same order as in add_numbers_to_image, so
+        # that overlapping numbers look the same as on a full redraw.
+        centroid_coords_list = []
+        color_id_list = []
+        for (color_id, _), centroid in zip(self.island_borders_list, self.centroid_coords_list):
+            if np.isnan(centroid).any():
+                continue
+            x, y = centroid
+            if top - margin <= y < bottom + margin and left - margin <= x < right + margin:
+                centroid_coords_list.append((x - left, y - top))
+                color_id_list.append(color_id)
+
+        self.numbered_islands[top:bottom, left:right] = add_numbers_to_image(
+            image = np.ascontiguousarray(self.islands_image[top:bottom, left:right]),
+            centroid_coords_list = centroid_coords_list,
+            color_id_list = color_id_list,
+            font_size = self.config["font_size"],
+            font_color = self.config["font_color"],
+            font_thickness = self.config["font_thickness"],
+        )
@@ -0,0 +1,263 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from .superpixels import slic, superpixel_colors
+
+# Number of low bits dropped from each channel when building the color histogram.
+# Every bin stores the exact mean color of its pixels, so this only limits how
+# finely two very similar colors can be separated.
+HISTOGRAM_SHIFT = 2
+
+# Number of weighted Lloyd iterations run after each split.
+LLOYD_ITERATIONS = 10
+
+# Number of images for which palette families are kept in memory.
+CACHE_SIZE = 8
+
+
+def _bin_index(pixels, shift):
+    bits = 8 - shift
+    quantized = (pixels >> shift).astype(np.int64)
+    return (quantized[:, 0] << (2 * bits)) | (quantized[:, 1] << bits) | quantized[:, 2]
+
+
+def color_histogram(image, shift = HISTOGRAM_SHIFT):
+    """Builds a sparse color histogram of an RGB image.
+
+    Args:
+        image: Image in the RGB color space as a 3D uint8 array.
+        shift: Number of low bits dropped from each channel.
+
+    Returns:
+        colors: (N, 3) float array with the mean color of each occupied bin.
+        weights: (N,) float array with the number of pixels in each bin.
+        pixel_bins: 2D array with the index (into colors) of each pixel's bin.
+    """
+    num_bins = 1 << (3 * (8 - shift))
+    pixels = image.reshape((-1, 3))
+    bin_index = _bin_index(pixels, shift)
+
+    counts = np.bincount(bin_index, minlength = num_bins)
+    occupied = np.nonzero(counts)[0]
+    colors = np.stack(
+        [np.bincount(bin_index, weights = pixels[:, c], minlength = num_bins)[occupied]
+         for c in range(3)],
+        axis = 1
+    ) / counts[occupied, None]
+
+    lookup = np.zeros(num_bins, dtype = np.int64)
+    lookup[occupied] = np.arange(len(occupied))
+    pixel_bins = lookup[bin_index].reshape(image.shape[:2])
+
+    return colors, counts[occupied].astype(np.float64), pixel_bins
+
+
+def pooled_color_histogram(images, shift = HISTOGRAM_SHIFT):
+    """Builds one sparse color histogram for several images, reading them one
+    at a time. Every image has the same total weight, whatever its size.
+
+    Args:
+        images: Iterable of images in the RGB color space as 3D uint8 arrays.
+        shift: Number of low bits dropped from each channel.
+
+    Returns:
+        colors: (N, 3) float array with the mean color of each occupied bin.
+        weights: (N,) float array with the weight of each bin.
+    """
+    num_bins = 1 << (3 * (8 - shift))
+    weights = np.zeros(num_bins)
+    sums = np.zeros((3, num_bins))
+    for image in images:
+        pixels = image.reshape((-1, 3))
+        bin_index = _bin_index(pixels, shift)
+        image_weight = 1 / len(pixels)
+        weights += np.bincount(bin_index, minlength = num_bins) * image_weight
+        for c in range(3):
+            sums[c] += np.bincount(bin_index, weights = pixels[:, c], minlength = num_bins) * image_weight
+
+    occupied = np.nonzero(weights)[0]
+    return (sums[:, occupied] / weights[occupied]).T, weights[occupied]
+
+
+def _nearest_centers(points, centers):
+    distances = (points**2).sum(axis = 1)[:, None] \
+        - 2 * points @ centers.T \
+        + (centers**2).sum(axis = 1)[None, :]
+    return distances.argmin(axis = 1), distances
+
+
+def weighted_kmeans(points, weights, centers, iterations = LLOYD_ITERATIONS):
+    """Runs weighted Lloyd iterations starting from the given centers.
+
+    Returns the refined centers and the label of each point.
+    """
+    centers = centers.astype(np.float64).copy()
+    num_centers = len(centers)
+    for _ in range(iterations):
+        labels, _ = _nearest_centers(points, centers)
+        cluster_weights = np.bincount(labels, weights = weights, minlength = num_centers)
+        new_centers = centers.copy()
+        non_empty = cluster_weights > 0
+        for c in range(3):
+            sums = np.bincount(labels, weights = weights * points[:, c], minlength = num_centers)
+            new_centers[non_empty, c] = sums[non_empty] / cluster_weights[non_empty]
+        converged = np.allclose(new_centers, centers, atol = 0.5)
+        centers = new_centers
+        if converged:
+            break
+    labels, _ = _nearest_centers(points, centers)
+    return centers, labels
+
+
+def _split_worst_cluster(points, weights, centers, labels):
+    """Splits the cluster with the largest weighted squared error along its
+    principal axis. Returns None if no cluster can be split."""
+    _, distances = _nearest_centers(points, centers)
+    point_errors = distances[np.arange(len(points)), labels] * weights
+    cluster_errors = np.bincount(labels, weights = point_errors, minlength = len(centers))
+
+    for cluster_id in np.argsort(cluster_errors)[::-1]:
+        if cluster_errors[cluster_id] <= 0:
+            return None
+        members = labels == cluster_id
+        if members.sum() < 2:
+            continue
+
+        member_points = points[members]
+        member_weights = weights[members]
+        mean = np.average(member_points, axis = 0, weights = member_weights)
+        covariance = np.cov(member_points - mean, rowvar = False, aweights = member_weights)
+        eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+        offset = np.sqrt(max(eigenvalues[-1], 0)) * eigenvectors[:, -1]
+
+        new_centers = centers.copy()
+        new_centers[cluster_id] = mean - offset
+        return np.vstack([new_centers, mean + offset])
+    return None
+
+
+class PaletteFamily:
+    def __init__(self, image, superpixel_size = None, superpixel_compactness = 10):
+        """
+        Computes a nested family of palettes for an image, one for each number
+        of colors. The palette with k colors is obtained by splitting one cluster
+        of the palette with k-1 colors and refining all the centers with k-means
+        warm-started from that split, so the results are deterministic.
+
+        Args:
+            image: Image in the RGB color space as a 3D uint8 array.
+            superpixel_size: If given, the image is first segmented into
+                superpixels of about this width (see superpixels.slic), and
+                their mean colors, weighted by their size, are clustered
+                instead of the color histogram. All the pixels of a
+                superpixel then get the same color.
+            superpixel_compactness: compactness of superpixels.slic.
+        """
+        self.image_shape = image.shape
+        if superpixel_size is None:
+            colors, weights, pixel_bins = color_histogram(image)
+        else:
+            pixel_bins = slic(image, superpixel_size, superpixel_compactness)
+            colors, weights = superpixel_colors(image, pixel_bins)
+        self._set_histogram(colors, weights, pixel_bins)
+
+    @classmethod
+    def from_histogram(cls, colors, weights):
+        """
+        Palette family of a color histogram not tied to one image, such as
+        one from pooled_color_histogram. Only get_palette can be used.
+        """
+        palette_family = cls.__new__(cls)
+        palette_family.image_shape = None
+        palette_family._set_histogram(colors, weights, None)
+        return palette_family
+
+    def _set_histogram(self, colors, weights, pixel_bins):
+        self.colors, self.weights, self.pixel_bins = colors, weights, pixel_bins
+
+        # palettes[k - 1] holds the (k, 3) float centers for k colors.
+        initial_center = np.average(self.colors, axis = 0, weights = self.weights)
+        self.palettes = [initial_center[None, :]]
+        self._labels = np.zeros(len(self.colors), dtype = np.int64)
+        # Cached families are shared between threads.
+        self._lock = threading.Lock()
+
+    @property
+    def max_num_colors(self):
+        """Largest number of colors that can be represented (number of distinct colors)."""
+        return len(self.colors)
+
+    def _extend(self, num_colors):
+        while len(self.palettes) < num_colors:
+            centers = _split_worst_cluster(self.colors, self.weights, self.palettes[-1], self._labels)
+            if centers is None:
+                break
+            centers, self._labels = weighted_kmeans(self.colors, self.weights, centers)
+            self.palettes.append(centers)
+
+    def get_palette(self, num_colors):
+        """Returns the palette with num_colors colors as a (k, 3) uint8 array.
+        Fewer colors are returned if the image has less distinct colors."""
+        with self._lock:
+            self._extend(num_colors)
+            centers = self.palettes[min(num_colors, len(self.palettes)) - 1]
+        return np.clip(np.round(centers), 0, 255).astype(np.uint8)
+
+    def simplify(self, num_colors):
+        """Same return values as simplify_image._kmeans_simplify_image."""
+        color_list = self.get_palette(num_colors)
+        bin_labels, _ = _nearest_centers(self.colors, color_list.astype(np.float64))
+        labels = bin_labels[self.pixel_bins]
+
+        simplified_image = color_list[labels]
+        indices_color_choices = labels + 1
+        return simplified_image, indices_color_choices, color_list
+
+    def match(self, color_list, num_clusters = None):
+        """
+        Gives every pixel the color of color_list closest to its bin's color,
+        or, if num_clusters is given, closest to the center of its bin's
+        cluster in the palette with num_clusters colors.
+
+        Returns:
+            Same return values as simplify_image._choose_closest_colors.
+        """
+        colors = self.colors
+        if num_clusters is not None:
+            palette = self.get_palette(num_clusters)
+            cluster_labels, _ = _nearest_centers(colors, palette.astype(np.float64))
+            colors = palette[cluster_labels].astype(np.float64)
+        color_list = np.array(color_list)
+        bin_labels, _ = _nearest_centers(colors, color_list.astype(np.float64))
+        labels = bin_labels[self.pixel_bins]
+        return color_list[labels], labels + 1
+
+
+_palette_family_cache = OrderedDict()
+_palette_family_cache_lock = threading.Lock()
+
+def _image_key(image):
+    digest = hashlib.blake2b(image.tobytes(), digest_size = 16)
+    digest.update(str((image.shape, image.dtype.str)).encode())
+    return digest.hexdigest()
+
+def get_palette_family(image, superpixel_size = None, superpixel_compactness = 10):
+    """Returns the PaletteFamily for an image, reusing the cached one if
+    the same image was seen recently with the same superpixel settings."""
+    key = (_image_key(image), superpixel_size, superpixel_compactness)
+    with _palette_family_cache_lock:
+        if key in _palette_family_cache:
+            _palette_family_cache.move_to_end(key)
+            return _palette_family_cache[key]
+
+    # Built outside the lock; if two threads race, both results are equivalent.
+    palette_family = PaletteFamily(image, superpixel_size, superpixel_compactness)
+    with _palette_family_cache_lock:
+        palette_family = _palette_family_cache.setdefault(key, palette_family)
+        _palette_family_cache.move_to_end(key)
+        while len(_palette_family_cache) > CACHE_SIZE:
+            _palette_family_cache.popitem(last = False)
+    return palette_family
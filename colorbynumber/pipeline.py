@@ -0,0 +1,176 @@
+from collections import namedtuple
+
+from .cancellation import Cancelled
+from .config import default_config, make_config
+from .simplify_image import denoise_before_simplify, simplify_denoised_image
+from .gen_islands import GenerateIslands
+from .numbered_islands import create_islands
+from .number_placement import draw_numbers
+
+# Stages of run, in order, as reported to progress_callback.
+STAGES = ("denoise", "simplify", "islands", "numbers")
+
+# Colors to use for the page: either a fixed color_list of (R, G, B) colors,
+# or num_colors to let kmeans choose them.
+PaletteSpec = namedtuple("PaletteSpec", ["color_list", "num_colors"], defaults = (None, None))
+
+# Outputs of run. All images are in the RGB color space.
+Result = namedtuple("Result", [
+    "simplified_image",       # Image with every pixel replaced by its palette color.
+    "indices_color_choices",  # Color index (starting at 1) of every pixel.
+    "color_list",             # Palette used, in (R, G, B) format.
+    "island_borders_list",    # List of (color_id, border coordinates) for every island.
+    "centroid_coords_list",   # Position of the number of every island.
+    "islands_image",          # Page with the island borders only.
+    "numbered_islands",       # Page with the island borders and numbers.
+    "number_font_sizes",      # Font size of every number, None if all use config["font_size"].
+    "dropped_numbers",        # Indices of the islands whose number did not fit
+                              # ("collision_aware" number placement only).
+    "generate_islands_obj",   # GenerateIslands that found the islands, None if unknown.
+                              # Treat it as read-only; use its copy method to change it.
+], defaults = (None, (), None))
+
+# Intermediate results yielded by iter_stages, in this order, before the Result.
+DenoisedStage = namedtuple("DenoisedStage", [
+    "denoised_image",         # Input image, denoised if the config denoises before simplification.
+])
+SimplifiedStage = namedtuple("SimplifiedStage", [
+    "simplified_image",
+    "indices_color_choices",
+    "color_list",
+])
+IslandsStage = namedtuple("IslandsStage", [
+    "island_borders_list",
+    "centroid_coords_list",
+    "islands_image",
+])
+
+
+def make_palette_spec(color_list = None, num_colors = None):
+    """Returns a PaletteSpec, converting color_list to an immutable tuple of tuples."""
+    assert color_list is not None or num_colors is not None, \
+        "Either color_list or num_colors must be provided."
+    if color_list is not None:
+        color_list = tuple(tuple(int(c) for c in color) for color in color_list)
+    return PaletteSpec(color_list = color_list, num_colors = num_colors)
+
+
+def iter_stages(image, palette_spec, config = default_config, progress_callback = None,
+                cancellation_token = None):
+    """
+    Generator version of run: yields a DenoisedStage, a SimplifiedStage and an
+    IslandsStage as soon as each stage completes, and finally the Result.
+    Callers can stop iterating early to skip the remaining stages.
+
+    Same arguments as run. When the run is cancelled, the partial_result of
+    the Cancelled exception is the last stage yielded.
+    """
+    last_stage = None
+    try:
+        for stage in _iter_stages(image, palette_spec, config, progress_callback, cancellation_token):
+            last_stage = stage
+            yield stage
+    except Cancelled as e:
+        e.partial_result = last_stage
+        raise
+
+
+def _iter_stages(image, palette_spec, config, progress_callback, cancellation_token):
+    config = make_config(config)
+    palette_spec = make_palette_spec(palette_spec.color_list, palette_spec.num_colors)
+    def start_stage(stage):
+        if cancellation_token is not None:
+            cancellation_token.check()
+        if progress_callback is not None:
+            progress_callback(stage)
+
+    start_stage("denoise")
+    denoised_image = denoise_before_simplify(image, config)
+    yield DenoisedStage(denoised_image = denoised_image)
+
+    start_stage("simplify")
+    simplified_image, indices_color_choices, color_list = simplify_denoised_image(
+        image=denoised_image,
+        color_list=palette_spec.color_list,
+        num_colors=palette_spec.num_colors,
+        config=config
+        )
+    yield SimplifiedStage(
+        simplified_image = simplified_image,
+        indices_color_choices = indices_color_choices,
+        color_list = color_list,
+    )
+
+    start_stage("islands")
+    generate_islands_obj = GenerateIslands(indices_color_choices)
+    island_borders_list, centroid_coords_list = generate_islands_obj.get_islands(
+        config=config, cancellation_token=cancellation_token)
+    islands_image = create_islands(
+        islands = island_borders_list,
+        image_shape = image.shape,
+        padding = config["border_padding"],
+        border_color = config["border_color"]
+        )
+    yield IslandsStage(
+        island_borders_list = island_borders_list,
+        centroid_coords_list = centroid_coords_list,
+        islands_image = islands_image,
+    )
+
+    start_stage("numbers")
+    numbered_islands, placement = draw_numbers(
+        islands_image = islands_image,
+        island_borders_list = island_borders_list,
+        centroid_coords_list = centroid_coords_list,
+        generate_islands_obj = generate_islands_obj,
+        config = config,
+        cancellation_token = cancellation_token,
+        )
+    number_font_sizes, dropped_numbers = None, ()
+    if placement is not None:
+        centroid_coords_list = placement.positions
+        number_font_sizes, dropped_numbers = placement.font_sizes, placement.dropped
+
+    yield Result(
+        simplified_image = simplified_image,
+        indices_color_choices = indices_color_choices,
+        color_list = color_list,
+        island_borders_list = island_borders_list,
+        centroid_coords_list = centroid_coords_list,
+        islands_image = islands_image,
+        numbered_islands = numbered_islands,
+        number_font_sizes = number_font_sizes,
+        dropped_numbers = dropped_numbers,
+        generate_islands_obj = generate_islands_obj,
+    )
+
+
+def run(image, palette_spec, config = default_config, progress_callback = None,
+        cancellation_token = None):
+    """
+    Creates a color by number page for an image.
+
+    Does not modify its arguments or any shared state, so it can be called
+    from several threads at once.
+
+    Args:
+        image: Image in the RGB color space as a 3D array (see downsample_image).
+        palette_spec: PaletteSpec with the colors to use.
+        config: Dictionary of configuration parameters. A read-only snapshot
+            is taken with make_config.
+        progress_callback: Called with the name of each stage in STAGES
+            when that stage starts (optional).
+        cancellation_token: cancellation.CancellationToken checked between
+            stages and inside the loops over colors and islands (optional).
+
+    Returns:
+        Result
+
+    Raises:
+        cancellation.Cancelled (or DeadlineExceeded) if cancellation_token
+        is cancelled (or its deadline passes) before the run completes.
+        Its partial_result is the last stage completed, or None.
+    """
+    for stage in iter_stages(image, palette_spec, config, progress_callback, cancellation_token):
+        pass
+    return stage
@@ -0,0 +1,137 @@
+import struct
+import zlib
+
+import numpy as np
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# Compressed data is emitted in IDAT chunks of about this size.
+IDAT_CHUNK_SIZE = 64 * 1024
+
+# Number of image rows compressed at a time.
+ROWS_PER_BATCH = 64
+
+
+def _chunk(chunk_type, data):
+    return struct.pack(">I", len(data)) + chunk_type + data \
+        + struct.pack(">I", zlib.crc32(chunk_type + data) & 0xffffffff)
+
+
+def palettize(image, max_colors = 256):
+    """
+    Converts an image with few distinct colors to palette indices.
+
+    Args:
+        image: RGB image as a 3D array, or grayscale image as a 2D array.
+        max_colors: Maximum size of the palette.
+
+    Returns:
+        (indices, palette) with indices a 2D uint8 array and palette a
+        (N, 3) uint8 array of RGB colors, or None if the image has more
+        than max_colors distinct colors.
+    """
+    image = image.astype(np.uint8)
+    if image.ndim == 2:
+        image = np.repeat(image[:, :, None], 3, axis = 2)
+
+    packed = (image[:, :, 0].astype(np.uint32) << 16) \
+        | (image[:, :, 1].astype(np.uint32) << 8) \
+        | image[:, :, 2]
+    colors, indices = np.unique(packed, return_inverse = True)
+    if len(colors) > max_colors:
+        return None
+
+    palette = np.stack([colors >> 16, (colors >> 8) & 0xff, colors & 0xff], axis = 1)
+    return indices.reshape(packed.shape).astype(np.uint8), palette.astype(np.uint8)
+
+
+def _bit_depth(num_colors):
+    for bit_depth in (1, 2, 4):
+        if num_colors <= (1 << bit_depth):
+            return bit_depth
+    return 8
+
+
+def _pack_rows(indices, bit_depth):
+    """Packs 8 bit indices into rows of bit_depth bit samples."""
+    if bit_depth == 8:
+        return indices
+    samples_per_byte = 8 // bit_depth
+    height, width = indices.shape
+    padded_width = -(-width // samples_per_byte) * samples_per_byte
+    padded = np.zeros((height, padded_width), dtype = np.uint8)
+    padded[:, :width] = indices
+    grouped = padded.reshape((height, -1, samples_per_byte))
+
+    packed = np.zeros(grouped.shape[:2], dtype = np.uint8)
+    for i in range(samples_per_byte):
+        # The leftmost pixel goes in the most significant bits.
+        packed |= grouped[:, :, i] << (8 - bit_depth * (i + 1))
+    return packed
+
+
+def iter_png(image, palettized = True, compression_level = 6):
+    """
+    Encodes an image as PNG, yielding the encoded bytes piece by piece so
+    they can be written to a file or an HTTP response as they are produced.
+
+    If palettized is True and the image has at most 256 distinct colors, it is
+    written as an indexed PNG with the smallest bit depth (1, 2, 4 or 8) that
+    fits its palette. Otherwise it is written as 24-bit RGB.
+
+    Args:
+        image: RGB image as a 3D array, or grayscale image as a 2D array.
+        palettized: If True, use an indexed PNG when possible.
+        compression_level: zlib compression level, from 0 (fastest, largest)
+            to 9 (slowest, smallest).
+    """
+    palettized_image = palettize(image) if palettized else None
+    if palettized_image is not None:
+        indices, palette = palettized_image
+        bit_depth = _bit_depth(len(palette))
+        rows = _pack_rows(indices, bit_depth)
+        color_type = 3
+    else:
+        rows = image.astype(np.uint8)
+        if rows.ndim == 2:
+            rows = np.repeat(rows[:, :, None], 3, axis = 2)
+        bit_depth = 8
+        color_type = 2
+        rows = rows.reshape((rows.shape[0], -1))
+
+    height, width = image.shape[:2]
+    yield PNG_SIGNATURE
+    yield _chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, bit_depth, color_type, 0, 0, 0))
+    if color_type == 3:
+        yield _chunk(b"PLTE", palette.tobytes())
+
+    compressor = zlib.compressobj(compression_level)
+    pending = []
+    pending_size = 0
+    for start in range(0, height, ROWS_PER_BATCH):
+        batch = rows[start:start + ROWS_PER_BATCH]
+        # Filter type 0 (None) in front of every row.
+        filtered = np.zeros((batch.shape[0], batch.shape[1] + 1), dtype = np.uint8)
+        filtered[:, 1:] = batch
+        data = compressor.compress(filtered.tobytes())
+        if data:
+            pending.append(data)
+            pending_size += len(data)
+        if pending_size >= IDAT_CHUNK_SIZE:
+            yield _chunk(b"IDAT", b"".join(pending))
+            pending = []
+            pending_size = 0
+    pending.append(compressor.flush())
+    yield _chunk(b"IDAT", b"".join(pending))
+    yield _chunk(b"IEND", b"")
+
+
+def encode_png(image, palettized = True, compression_level = 6):
+    """Same as iter_png, but returns all the encoded bytes at once."""
+    return b"".join(iter_png(image, palettized, compression_level))
+
+
+def write_png(image, fileobj, palettized = True, compression_level = 6):
+    """Writes the image as PNG to a binary file object (see iter_png)."""
+    for data in iter_png(image, palettized, compression_level):
+        fileobj.write(data)
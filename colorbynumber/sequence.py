@@ -0,0 +1,191 @@
+import cv2 as cv
+import numpy as np
+
+from .config import default_config, make_config
+from .gen_islands import GenerateIslands
+from .numbered_islands import create_islands
+from .number_placement import draw_numbers
+from .page_editor import PageEditor
+from .palette_family import PaletteFamily
+from .pipeline import Result
+from .simplify_image import simplify_image, downsample_image, denoise_before_simplify
+
+# Frames whose changed pixels form more groups than this are updated with a
+# single edit covering all of them.
+MAX_CHANGED_REGIONS = 16
+
+
+def iter_frames(video_path):
+    """Yields the frames of a video or animated GIF as downsampled RGB arrays."""
+    capture = cv.VideoCapture(video_path)
+    if not capture.isOpened():
+        raise IOError(f"Could not open {video_path}")
+    try:
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            yield downsample_image(cv.cvtColor(frame, cv.COLOR_BGR2RGB))
+    finally:
+        capture.release()
+
+
+def sequence_palette(video_path, num_colors, config = default_config,
+                     num_sample_frames = 16, pixels_per_frame = 20000):
+    """
+    Computes one palette for a whole clip from pixels pooled over a sample of
+    its frames, so that the colors do not flicker from frame to frame.
+
+    The clip is decoded once. Frames are sampled every `stride` frames, and
+    whenever twice num_sample_frames frames have been sampled, every other
+    one is dropped and the stride doubled, so the sampled frames stay evenly
+    spaced over a clip of unknown length.
+
+    Args:
+        video_path: Path to the video or animated GIF.
+        num_colors: Number of colors of the palette.
+        config: Dictionary of configuration parameters. Frames are denoised
+            before sampling if the config denoises before simplification.
+        num_sample_frames: Minimum number of frames, evenly spaced over the
+            clip, to sample (all the frames of shorter clips). At most twice
+            as many are sampled.
+        pixels_per_frame: Number of pixels sampled from each of these frames.
+
+    Returns:
+        (num_colors, 3) uint8 array of RGB colors.
+    """
+    # Deterministic sampling so that the palette of a clip is reproducible.
+    random_state = np.random.RandomState(0)
+    samples = []
+    stride = 1
+    for frame_id, frame in enumerate(iter_frames(video_path)):
+        if frame_id % stride != 0:
+            continue
+        pixels = denoise_before_simplify(frame, config).reshape((-1, 3))
+        chosen = random_state.choice(len(pixels), min(pixels_per_frame, len(pixels)), replace = False)
+        samples.append(pixels[chosen])
+        if len(samples) == 2 * num_sample_frames:
+            samples = samples[::2]
+            stride *= 2
+
+    pooled = np.concatenate(samples).reshape((-1, 1, 3))
+    return PaletteFamily(pooled).get_palette(num_colors)
+
+
+def _first_page(labels, color_list, config):
+    generate_islands_obj = GenerateIslands(labels)
+    island_borders_list, centroid_coords_list = generate_islands_obj.get_islands(config = config)
+    islands_image = create_islands(
+        islands = island_borders_list,
+        image_shape = labels.shape + (3,),
+        padding = config["border_padding"],
+        border_color = config["border_color"]
+        )
+    numbered_islands, placement = draw_numbers(
+        islands_image = islands_image,
+        island_borders_list = island_borders_list,
+        centroid_coords_list = centroid_coords_list,
+        generate_islands_obj = generate_islands_obj,
+        config = config,
+        )
+    number_font_sizes, dropped_numbers = None, ()
+    if placement is not None:
+        centroid_coords_list = placement.positions
+        number_font_sizes, dropped_numbers = placement.font_sizes, placement.dropped
+
+    return Result(
+        simplified_image = color_list[labels - 1],
+        indices_color_choices = labels,
+        color_list = color_list,
+        island_borders_list = island_borders_list,
+        centroid_coords_list = centroid_coords_list,
+        islands_image = islands_image,
+        numbered_islands = numbered_islands,
+        number_font_sizes = number_font_sizes,
+        dropped_numbers = dropped_numbers,
+        generate_islands_obj = generate_islands_obj,
+    )
+
+
+def _changed_regions(changed, config):
+    """
+    Splits the changed pixels into groups far enough apart for their islands
+    to be updated separately, so that changes in opposite corners of a frame
+    do not recompute everything in between. Yields one mask per group.
+    """
+    # Groups closer than the reach of update_islands would recompute the same
+    # islands twice.
+    reach = 4 * config["open_kernel_size"] + 2
+    near = cv.dilate(changed.astype(np.uint8), np.ones((reach, reach), np.uint8))
+    num_groups, groups = cv.connectedComponents(near)
+    if num_groups - 1 > MAX_CHANGED_REGIONS:
+        yield changed
+        return
+    for group in range(1, num_groups):
+        yield changed & (groups == group)
+
+
+def iter_sequence(video_path, color_list = None, num_colors = None,
+                  config = default_config, change_threshold = 12):
+    """
+    Creates a color by number page for every frame of a video or animated GIF.
+
+    All frames use the same palette: color_list, or one computed with
+    sequence_palette. Pixels whose color changed by less than change_threshold
+    since their label was last computed keep that label, so static parts of the
+    clip keep exactly the same islands. The page of the first frame is made
+    from scratch; the following ones are made by editing the previous page
+    (see page_editor.PageEditor) where the labels changed, which only
+    recomputes and redraws the islands around the changed pixels.
+
+    Frames are processed one at a time, and only the previous frame's state is
+    kept in memory.
+
+    Args:
+        video_path: Path to the video or animated GIF.
+        color_list: List of colors in (R, G, B) format.
+        num_colors: Number of colors to use if color_list is not provided.
+        config: Dictionary of configuration parameters.
+        change_threshold: Largest per-channel difference (0-255) considered no change.
+
+    Yields:
+        pipeline.Result for every frame. Its arrays are not changed by later frames.
+    """
+    assert color_list is not None or num_colors is not None, \
+        "Either color_list or num_colors must be provided."
+    config = make_config(config)
+    if color_list is None:
+        color_list = sequence_palette(video_path, num_colors, config)
+    color_list = np.array(color_list, dtype = np.uint8)
+    # The palette is fixed, so frames are only matched to it.
+    config = make_config(config, apply_kmeans = False)
+
+    reference_frame = None   # Frame at the time each pixel's label was computed.
+    page_editor = None
+
+    for frame in iter_frames(video_path):
+        _, new_labels, _ = simplify_image(frame, color_list = color_list, config = config)
+
+        if reference_frame is None or reference_frame.shape != frame.shape:
+            reference_frame = frame.copy()
+            page_editor = PageEditor(_first_page(new_labels, color_list, config), config)
+        else:
+            changed = (np.abs(frame.astype(np.int16) - reference_frame).max(axis = -1)
+                       > change_threshold)
+            reference_frame[changed] = frame[changed]
+            # Pixels whose color changed may still get the same label.
+            changed &= new_labels != page_editor.generate_islands_obj.indices_color_choices
+            if changed.any():
+                for region_mask in _changed_regions(changed, config):
+                    page_editor.edit(region_mask, new_labels)
+
+        result = page_editor.result
+        yield result._replace(
+            simplified_image = result.simplified_image.copy(),
+            indices_color_choices = result.indices_color_choices.copy(),
+            island_borders_list = list(result.island_borders_list),
+            centroid_coords_list = list(result.centroid_coords_list),
+            islands_image = result.islands_image.copy(),
+            numbered_islands = result.numbered_islands.copy(),
+            generate_islands_obj = result.generate_islands_obj.copy(),
+        )
@@ -0,0 +1,216 @@
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2 as cv
+import numpy as np
+
+from .assign_colors import assign_colors
+from .config import make_config
+from .pipeline import run
+
+# Config values of the reference implementation. Shadow runs use the
+# configured values for every other parameter. The seed is fixed so that the
+# differences logged do not include the randomness of the kmeans centers.
+REFERENCE_OVERRIDES = {
+    "kmeans_method": "random_centers",
+    "kmeans_seed": 0,
+    "superpixels": False,
+    "crop_islands": False,
+    "number_placement": "centroid",
+}
+
+
+def _palette_lookup(result, reference):
+    """Returns an array giving, for every color index of reference, the index
+    of the matching color of result. Palettes are matched with assign_colors."""
+    palette = [tuple(int(c) for c in color) for color in result.color_list]
+    reference_palette = [tuple(int(c) for c in color) for color in reference.color_list]
+    if palette == reference_palette:
+        return np.arange(len(palette) + 1)
+
+    weights = np.bincount(reference.indices_color_choices.ravel() - 1, minlength = len(reference_palette))
+    color_mapping = assign_colors(reference_palette, palette, weights)
+    reference_ids = {color: color_id for color_id, color in enumerate(reference_palette, start = 1)}
+
+    # Reference colors left unassigned (if the palettes have different sizes)
+    # are mapped to the closest color.
+    distances = ((np.array(reference_palette, dtype = float)[:, None, :]
+                  - np.array(palette, dtype = float)[None, :, :])**2).sum(axis = -1)
+    lookup = np.concatenate([[0], distances.argmin(axis = 1) + 1])
+    for color_id, color in enumerate(palette, start = 1):
+        if color in color_mapping:
+            lookup[reference_ids[color_mapping[color]]] = color_id
+    return lookup
+
+
+def _border_mask(result):
+    mask = np.zeros(result.islands_image.shape[:2], dtype = bool)
+    for _, (rows, cols) in result.island_borders_list:
+        mask[rows, cols] = True
+    return mask
+
+
+def _iou(mask_a, mask_b):
+    union = np.logical_or(mask_a, mask_b).sum()
+    return float(np.logical_and(mask_a, mask_b).sum() / union) if union else 1.0
+
+
+def _centroid_distances(result, reference, reference_lookup):
+    # Distance from the number of every island to the closest number of the
+    # same color in the reference.
+    reference_centroids = {}
+    for (color_id, _), centroid in zip(reference.island_borders_list, reference.centroid_coords_list):
+        if not np.isnan(centroid).any():
+            reference_centroids.setdefault(int(reference_lookup[color_id]), []).append(centroid)
+
+    distances = []
+    unmatched = 0
+    for (color_id, _), centroid in zip(result.island_borders_list, result.centroid_coords_list):
+        if np.isnan(centroid).any():
+            continue
+        candidates = reference_centroids.get(int(color_id))
+        if not candidates:
+            unmatched += 1
+            continue
+        distances.append(np.sqrt(((np.array(candidates) - np.array(centroid))**2).sum(axis = 1)).min())
+    return np.array(distances), unmatched
+
+
+def compare_results(result, reference):
+    """
+    Measures how much a pipeline.Result differs from a reference Result of
+    the same image.
+
+    Returns:
+        Dictionary of metrics:
+        label_agreement: Fraction of pixels with the same color, after
+            matching the two palettes.
+        island_count, reference_island_count: Number of islands.
+        border_iou: Intersection over union of the island border pixels.
+        border_iou_1px: Same, counting borders within one pixel as matching.
+        centroid_distance_mean, _p95, _max: Distance in pixels from each
+            number to the closest number of the same color in the reference.
+        unmatched_islands: Islands whose color has no island in the reference.
+    """
+    reference_lookup = _palette_lookup(result, reference)
+    reference_labels = reference_lookup[reference.indices_color_choices]
+
+    border_mask = _border_mask(result)
+    reference_border_mask = _border_mask(reference)
+    kernel = np.ones((3, 3), np.uint8)
+    near_border = cv.dilate(border_mask.astype(np.uint8), kernel).astype(bool)
+    near_reference_border = cv.dilate(reference_border_mask.astype(np.uint8), kernel).astype(bool)
+    matched_border = np.logical_and(border_mask, near_reference_border).sum() \
+        + np.logical_and(reference_border_mask, near_border).sum()
+    total_border = border_mask.sum() + reference_border_mask.sum()
+
+    distances, unmatched = _centroid_distances(result, reference, reference_lookup)
+    return {
+        "label_agreement": float((result.indices_color_choices == reference_labels).mean()),
+        "island_count": len(result.island_borders_list),
+        "reference_island_count": len(reference.island_borders_list),
+        "border_iou": _iou(border_mask, reference_border_mask),
+        "border_iou_1px": float(matched_border / total_border) if total_border else 1.0,
+        "centroid_distance_mean": float(distances.mean()) if len(distances) else None,
+        "centroid_distance_p95": float(np.percentile(distances, 95)) if len(distances) else None,
+        "centroid_distance_max": float(distances.max()) if len(distances) else None,
+        "unmatched_islands": unmatched,
+    }
+
+
+class ShadowMode:
+    def __init__(self, log_path, sample_rate = 0.01, reference_overrides = REFERENCE_OVERRIDES,
+                 background = True, seed = None, max_pending = 1):
+        """
+        Runs the reference implementation alongside the configured one on a
+        sample of requests, and appends the timings of both and the
+        differences between their results (see compare_results) to a log
+        with one JSON object per line.
+
+        Args:
+            log_path: Path of the metrics log.
+            sample_rate: Fraction of requests, between 0 and 1, run in shadow mode.
+            reference_overrides: Config values of the reference implementation.
+            background: If True, shadow runs happen in a background thread
+                so that they do not delay the request.
+            seed: Seed of the sampling (optional).
+            max_pending: Number of background shadow runs that can be queued
+                or running. Samples taken while that many are pending are
+                dropped, and counted in the dropped attribute and the
+                "dropped_samples" field of the log entries.
+        """
+        self.log_path = log_path
+        self.sample_rate = sample_rate
+        self.reference_overrides = dict(reference_overrides)
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers = 1) if background else None
+        self._pending = threading.BoundedSemaphore(max_pending)
+        self.dropped = 0
+
+    def should_sample(self):
+        with self._lock:
+            return self._random.random() < self.sample_rate
+
+    def record(self, image, palette_spec, config, result, elapsed):
+        """
+        Compares a result with the reference and logs the metrics.
+
+        Args:
+            image, palette_spec, config: Arguments of the pipeline.run call.
+            result: pipeline.Result of that call.
+            elapsed: Time taken by that call, in seconds.
+        """
+        config = make_config(config)
+        reference_config = make_config(config, **self.reference_overrides)
+        if make_config(reference_config, kmeans_seed = config["kmeans_seed"]) == config:
+            # Nothing to compare: the configured engine is the reference, up
+            # to the seed of its random kmeans centers.
+            return
+        if self._executor is not None:
+            # Shadow runs are slower than requests: rather than queuing up
+            # without bound, samples are dropped while the thread is busy.
+            if not self._pending.acquire(blocking = False):
+                with self._lock:
+                    self.dropped += 1
+                return
+            self._executor.submit(self._record_pending, image, palette_spec, config, reference_config,
+                                  result, elapsed)
+        else:
+            self._record(image, palette_spec, config, reference_config, result, elapsed)
+
+    def _record_pending(self, *args):
+        try:
+            self._record(*args)
+        finally:
+            self._pending.release()
+
+    def _record(self, image, palette_spec, config, reference_config, result, elapsed):
+        entry = {
+            "time": time.time(),
+            "image_shape": list(image.shape),
+            "engine": {key: config[key] for key in self.reference_overrides},
+            "reference": dict(self.reference_overrides),
+            "engine_seconds": elapsed,
+        }
+        try:
+            start = time.perf_counter()
+            reference = run(image, palette_spec, reference_config)
+            entry["reference_seconds"] = time.perf_counter() - start
+            entry.update(compare_results(result, reference))
+        except Exception as e:
+            # A failing reference must not affect the request; log it instead.
+            entry["error"] = repr(e)
+        with self._lock:
+            entry["dropped_samples"] = self.dropped
+            with open(self.log_path, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+
+    def close(self):
+        """Waits for the pending shadow runs."""
+        if self._executor is not None:
+            self._executor.shutdown(wait = True)
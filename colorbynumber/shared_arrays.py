@@ -0,0 +1,259 @@
+import os
+import sys
+import weakref
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from .cancellation import CancellationToken
+
+# The resource tracker unlinks every segment a process created or attached to
+# when that process exits. Segments handed over to another process are
+# unlinked explicitly by whoever ends up owning them instead, so they are kept
+# out of the tracker: with track = False from Python 3.13, and before that by
+# unregistering them under the name the tracker uses (with a leading "/" on
+# POSIX, the only platform where segments are tracked).
+_HAS_TRACK = sys.version_info >= (3, 13)
+_TRACKED = not _HAS_TRACK and os.name == "posix"
+
+
+def _tracker_name(shm):
+    return "/" + shm.name
+
+
+def _open_untracked(**kwargs):
+    if _HAS_TRACK:
+        return shared_memory.SharedMemory(track = False, **kwargs)
+    shm = shared_memory.SharedMemory(**kwargs)
+    if _TRACKED:
+        resource_tracker.unregister(_tracker_name(shm), "shared_memory")
+    return shm
+
+
+def _buffer_owner(array):
+    # The memoryview at the root of the bases of an array made by
+    # np.frombuffer. It is released, with the export of the segment it holds,
+    # when the array and every view of it are gone.
+    while isinstance(array, np.ndarray):
+        array = array.base
+    return array
+
+
+def _unlink_untracked(shm):
+    if _TRACKED:
+        # SharedMemory.unlink unregisters the segment from the resource tracker.
+        resource_tracker.register(_tracker_name(shm), "shared_memory")
+    shm.unlink()
+
+
+class SharedArray:
+    def __init__(self, shm, shape, dtype):
+        """
+        NumPy array backed by a multiprocessing.shared_memory segment.
+        Use SharedArray.from_array or SharedArray.attach to create one.
+
+        Only the descriptor (segment name, shape and dtype) has to be sent to
+        another process, which can then attach to the same memory without copying.
+        """
+        self.shm = shm
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        # Unlike np.ndarray(buffer = ...), np.frombuffer holds the buffer, so
+        # the segment cannot be unmapped while views of the array exist. The
+        # segment is closed once the array and all its views are gone, on
+        # whichever thread drops the last one. At exit, the mapping is left
+        # to the operating system.
+        self.array = np.frombuffer(memoryview(shm.buf), dtype = self.dtype,
+                                   count = int(np.prod(self.shape))).reshape(self.shape)
+        self._finalizer = weakref.finalize(_buffer_owner(self.array), shm.close)
+        self._finalizer.atexit = False
+
+    @classmethod
+    def from_array(cls, array):
+        """Copies array into a new shared memory segment."""
+        array = np.ascontiguousarray(array)
+        # Zero sized segments are not allowed.
+        shm = _open_untracked(create = True, size = max(array.nbytes, 1))
+        shared_array = cls(shm, array.shape, array.dtype)
+        shared_array.array[...] = array
+        return shared_array
+
+    @classmethod
+    def attach(cls, descriptor):
+        """Attaches to the segment described by a descriptor from another process."""
+        name, shape, dtype = descriptor
+        shm = _open_untracked(name = name)
+        return cls(shm, shape, dtype)
+
+    @property
+    def descriptor(self):
+        """Small picklable (name, shape, dtype) tuple identifying the array."""
+        return (self.shm.name, self.shape, self.dtype.str)
+
+    def close(self):
+        """
+        Releases this process's mapping of the segment, which itself stays
+        alive. If views of the array are still referenced elsewhere, the
+        mapping is released when the last of them is gone.
+        """
+        self.array = None
+
+    def unlink(self):
+        """
+        Frees the segment for all processes and closes this process's view.
+        Views of the array that are still referenced stay valid (see close):
+        the memory is only released once every mapping of the segment is closed.
+        """
+        _unlink_untracked(self.shm)
+        self.close()
+
+
+def unlink_descriptor(descriptor):
+    """Frees the segment of a SharedArray descriptor that could not be attached."""
+    shm = _open_untracked(name = descriptor[0])
+    try:
+        _unlink_untracked(shm)
+    finally:
+        shm.close()
+
+
+class SharedCancellationToken(CancellationToken):
+    def __init__(self, shared_flag, deadline = None, parent = None):
+        """
+        CancellationToken that can be cancelled from another process: its
+        state is one byte of shared memory. Use create in one process and
+        send descriptor to the other, which uses attach.
+
+        Args:
+            shared_flag: SharedArray of one byte, nonzero once cancelled.
+            deadline, parent: See CancellationToken.
+        """
+        super().__init__(deadline = deadline, parent = parent)
+        self.shared_flag = shared_flag
+        # Kept so that cancel can still be called after close or unlink.
+        self._flag = shared_flag.array
+
+    @classmethod
+    def create(cls, deadline = None, parent = None):
+        return cls(SharedArray.from_array(np.zeros(1, dtype = np.uint8)), deadline, parent)
+
+    @classmethod
+    def attach(cls, descriptor, deadline = None, parent = None):
+        return cls(SharedArray.attach(descriptor), deadline, parent)
+
+    @property
+    def descriptor(self):
+        return self.shared_flag.descriptor
+
+    def cancel(self):
+        self._flag[0] = 1
+        super().cancel()
+
+    @property
+    def cancelled(self):
+        return bool(self._flag[0]) or super().cancelled
+
+    def close(self):
+        self.shared_flag.close()
+
+    def unlink(self):
+        self.shared_flag.unlink()
+
+
+def pack_island_borders(island_borders_list):
+    """Packs the list of (color_id, (rows, cols)) island borders into flat arrays.
+
+    Returns:
+        Dictionary with "color_ids", "offsets", "rows" and "cols" arrays.
+        The border of island i is rows[offsets[i]:offsets[i + 1]] (same for cols).
+    """
+    lengths = [len(rows) for _, (rows, _) in island_borders_list]
+    offsets = np.zeros(len(island_borders_list) + 1, dtype = np.int64)
+    offsets[1:] = np.cumsum(lengths)
+
+    def _concatenate(axis):
+        if not island_borders_list:
+            return np.zeros(0, dtype = np.int32)
+        return np.concatenate(
+            [coords[axis] for _, coords in island_borders_list]).astype(np.int32)
+
+    return {
+        "color_ids": np.array([color_id for color_id, _ in island_borders_list], dtype = np.int32),
+        "offsets": offsets,
+        "rows": _concatenate(0),
+        "cols": _concatenate(1),
+    }
+
+
+def unpack_island_borders(color_ids, offsets, rows, cols):
+    """Inverse of pack_island_borders. The coordinates are views into rows and cols."""
+    return [
+        (int(color_id), (rows[offsets[i]:offsets[i + 1]], cols[offsets[i]:offsets[i + 1]]))
+        for i, color_id in enumerate(color_ids)
+    ]
+
+
+class SharedArrays:
+    def __init__(self, shared_arrays):
+        """A named group of SharedArrays managed together."""
+        self.shared_arrays = shared_arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Copies a dictionary of arrays into shared memory."""
+        shared_arrays = {}
+        try:
+            for name, array in arrays.items():
+                shared_arrays[name] = SharedArray.from_array(array)
+        except BaseException:
+            for shared_array in shared_arrays.values():
+                shared_array.unlink()
+            raise
+        return cls(shared_arrays)
+
+    @classmethod
+    def attach(cls, descriptor):
+        """
+        Attaches to the segments of a descriptor from another process. If
+        attaching fails, all the segments are unlinked, since the caller
+        cannot do it.
+        """
+        shared_arrays = {}
+        try:
+            for name, d in descriptor.items():
+                shared_arrays[name] = SharedArray.attach(d)
+        except BaseException:
+            for name, d in descriptor.items():
+                try:
+                    if name in shared_arrays:
+                        shared_arrays[name].unlink()
+                    else:
+                        unlink_descriptor(d)
+                except OSError:
+                    pass
+            raise
+        return cls(shared_arrays)
+
+    @property
+    def descriptor(self):
+        return {name: shared_array.descriptor
+                for name, shared_array in self.shared_arrays.items()}
+
+    @property
+    def arrays(self):
+        return {name: shared_array.array
+                for name, shared_array in self.shared_arrays.items()}
+
+    def close(self):
+        for shared_array in self.shared_arrays.values():
+            shared_array.close()
+
+    def unlink(self):
+        for shared_array in self.shared_arrays.values():
+            shared_array.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.unlink()
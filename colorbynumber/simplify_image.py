@@ -2,6 +2,7 @@ import cv2 as cv
 import numpy as np
 
 from .config import default_config
+from .palette_family import get_palette_family
 
 def _choose_closest_colors(image, color_list):
     """
@@ -31,7 +32,11 @@ def _choose_closest_colors(image, color_list):
 
     return simplified_image, indices_color_choices
 
-def _kmeans_simplify_image(image, num_colors):
+def _kmeans_simplify_image(image, num_colors, kmeans_method = "random_centers", kmeans_seed = None):
+    if kmeans_method == "palette_family":
+        # Deterministic, and cached per image so that changing num_colors is cheap.
+        return get_palette_family(image).simplify(num_colors)
+
     Z = image.reshape((-1,3))
  
     # convert to np.float32
@@ -40,6 +45,8 @@ def _kmeans_simplify_image(image, num_colors):
     # define criteria, number of clusters(K) and apply kmeans()
     criteria = (cv.TERM_CRITERIA_EPS + cv.TERM_CRITERIA_MAX_ITER, 10, 1.0)
     K = num_colors
+    if kmeans_seed is not None:
+        cv.setRNGSeed(kmeans_seed)
     ret,label,center=cv.kmeans(Z,K,None,criteria,10,cv.KMEANS_RANDOM_CENTERS)
     
     # Now convert back into uint8, and make original image
@@ -89,6 +96,20 @@ def downsample_image(image):
     image = cv.resize(image, (new_height, new_width), interpolation = cv.INTER_AREA)
     return image
 
+def denoise_before_simplify(image, config = default_config):
+    """
+    Returns the image denoised if the config denoises before simplification,
+    otherwise the image itself.
+    """
+    if config["denoise"] and (config["denoise_order"] == "before_simplify"):
+        image = _denoise_image(
+            image=image, 
+            h = config["denoise_h"], 
+            denoise_type = config["denoise_type"], 
+            blur_size = config["blur_size"],
+            )
+    return image
+
 def simplify_image(image, 
                    color_list = None,
                    num_colors = None, 
@@ -105,21 +126,37 @@ def simplify_image(image,
     Returns:
       A copy of the image with all colors replaced with the closest color in the list.
     """
-    if config["denoise"] and (config["denoise_order"] == "before_simplify"):
-        image = _denoise_image(
-            image=image, 
-            h = config["denoise_h"], 
-            denoise_type = config["denoise_type"], 
-            blur_size = config["blur_size"],
-            )
-
-    if color_list is None:
+    image = denoise_before_simplify(image, config)
+    return simplify_denoised_image(image, color_list, num_colors, config)
+
+def simplify_denoised_image(image, 
+                            color_list = None,
+                            num_colors = None, 
+                            config = default_config,
+                            ):
+    """
+    Same as simplify_image for an image already passed through
+    denoise_before_simplify.
+    """
+    if config["superpixels"]:
+        # Colors are chosen per superpixel (see palette_family.PaletteFamily).
+        palette_family = get_palette_family(
+            image, config["superpixel_size"], config["superpixel_compactness"])
+        if color_list is None:
+            simplified_image, indices_color_choices, color_list = palette_family.simplify(num_colors)
+        else:
+            simplified_image, indices_color_choices = palette_family.match(
+                color_list, len(color_list) if config["apply_kmeans"] else None)
+
+    elif color_list is None:
         # Use kmeans to simplify the image to the specified number of colors.
-        simplified_image, indices_color_choices, color_list = _kmeans_simplify_image(image, num_colors)
+        simplified_image, indices_color_choices, color_list = _kmeans_simplify_image(
+            image, num_colors, config["kmeans_method"], config["kmeans_seed"])
 
     else:
         if config["apply_kmeans"]:
-            image, indices_color_choices, color_list_kmeans = _kmeans_simplify_image(image, len(color_list))
+            image, indices_color_choices, color_list_kmeans = _kmeans_simplify_image(
+                image, len(color_list), config["kmeans_method"], config["kmeans_seed"])
         simplified_image, indices_color_choices = _choose_closest_colors(image, color_list)
     
 
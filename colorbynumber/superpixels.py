@@ -0,0 +1,180 @@
+import cv2 as cv
+import numpy as np
+
+# Number of assignment and update steps of slic.
+SLIC_ITERATIONS = 5
+
+# Parts of superpixels smaller than this fraction of region_size**2 are
+# merged into a neighboring superpixel (see _enforce_connectivity).
+MIN_SIZE_FRACTION = 0.25
+
+
+def slic(image, region_size = 12, compactness = 10, iterations = SLIC_ITERATIONS):
+    """
+    Segments an image into superpixels, groups of neighboring pixels of
+    similar color, with simple linear iterative clustering (SLIC).
+
+    Centers start on a grid with a spacing of region_size pixels. Each pixel
+    is compared to the centers of its own grid cell and of the eight cells
+    around it, using the color distance in the CIELAB color space plus the
+    spatial distance weighted by compactness / region_size.
+
+    Args:
+        image: Image in the RGB color space as a 3D uint8 array.
+        region_size: Approximate width of a superpixel, in pixels.
+        compactness: Higher values give more regular, square superpixels;
+            lower values follow color edges more closely.
+        iterations: Number of assignment and update steps.
+
+    Returns:
+        2D int array with the superpixel (from 0 to N - 1) of every pixel.
+        Every superpixel is a 4-connected group of pixels.
+    """
+    height, width = image.shape[:2]
+    grid_height, grid_width = -(-height // region_size), -(-width // region_size)
+    padded_height, padded_width = grid_height * region_size, grid_width * region_size
+
+    lab = cv.cvtColor(image.astype(np.uint8), cv.COLOR_RGB2LAB).astype(np.float32)
+    # Pad to whole cells so that pixels can be viewed as (cell row, row in cell,
+    # cell column, column in cell). Padded pixels are dropped at the end.
+    lab = np.pad(lab, ((0, padded_height - height), (0, padded_width - width), (0, 0)), mode = "edge")
+    cells = lab.reshape((grid_height, region_size, grid_width, region_size, 3))
+    rows = np.arange(padded_height, dtype = np.float32).reshape((grid_height, region_size, 1, 1))
+    cols = np.arange(padded_width, dtype = np.float32).reshape((1, 1, grid_width, region_size))
+
+    # Centers, one per grid cell: color and position.
+    center_colors = cells.mean(axis = (1, 3))
+    center_rows = np.repeat(
+        np.minimum(np.arange(grid_height) * region_size + region_size / 2, height - 1)[:, None],
+        grid_width, axis = 1).astype(np.float32)
+    center_cols = np.repeat(
+        np.minimum(np.arange(grid_width) * region_size + region_size / 2, width - 1)[None, :],
+        grid_height, axis = 0).astype(np.float32)
+
+    spatial_weight = np.float32((compactness / region_size) ** 2)
+    center_ids = np.arange(grid_height * grid_width).reshape((grid_height, grid_width))
+    lab_pixels = lab[:height, :width].reshape((-1, 3))
+    pixel_rows, pixel_cols = np.divmod(np.arange(height * width), width)
+    channels = [np.ascontiguousarray(cells[..., channel]) for channel in range(3)]
+
+    # Neighboring cell for each of the 9 shifts, clamped at the image border.
+    shifts = [(row_shift, col_shift) for row_shift in (-1, 0, 1) for col_shift in (-1, 0, 1)]
+    neighbors = [np.ix_(np.clip(np.arange(grid_height) + row_shift, 0, grid_height - 1),
+                        np.clip(np.arange(grid_width) + col_shift, 0, grid_width - 1))
+                 for row_shift, col_shift in shifts]
+    neighbor_ids = np.stack([center_ids[neighbor] for neighbor in neighbors])
+    cell_rows = np.arange(grid_height).reshape((grid_height, 1, 1, 1))
+    cell_cols = np.arange(grid_width).reshape((1, 1, grid_width, 1))
+
+    distances = np.empty((len(shifts),) + channels[0].shape, dtype = np.float32)
+    for _ in range(iterations):
+        for shift_id, neighbor in enumerate(neighbors):
+            # Squared distance to the center, minus the squared norm of the
+            # pixel's color and position, which is the same for all centers.
+            colors = center_colors[neighbor]
+            center_row = center_rows[neighbor]
+            center_col = center_cols[neighbor]
+            constant = (colors**2).sum(axis = -1) + spatial_weight * (center_row**2 + center_col**2)
+
+            distance = distances[shift_id]
+            np.multiply(channels[0], -2 * colors[:, None, :, None, 0], out = distance)
+            distance += channels[1] * (-2 * colors[:, None, :, None, 1])
+            distance += channels[2] * (-2 * colors[:, None, :, None, 2])
+            distance += rows * (-2 * spatial_weight * center_row[:, None, :, None]) \
+                + cols * (-2 * spatial_weight * center_col[:, None, :, None]) \
+                + constant[:, None, :, None]
+
+        labels = neighbor_ids[distances.argmin(axis = 0), cell_rows, cell_cols]
+        labels = labels.reshape((padded_height, padded_width))[:height, :width].ravel()
+        counts = np.bincount(labels, minlength = center_ids.size)
+        non_empty = counts > 0
+        # Empty superpixels keep their previous center.
+        for channel in range(3):
+            sums = np.bincount(labels, weights = lab_pixels[:, channel], minlength = center_ids.size)
+            center_colors.reshape((-1, 3))[non_empty, channel] = sums[non_empty] / counts[non_empty]
+        for center_positions, pixel_positions in ((center_rows, pixel_rows), (center_cols, pixel_cols)):
+            sums = np.bincount(labels, weights = pixel_positions, minlength = center_ids.size)
+            center_positions.reshape(-1)[non_empty] = sums[non_empty] / counts[non_empty]
+
+    labels = _enforce_connectivity(labels.reshape((height, width)),
+                                   max(int(MIN_SIZE_FRACTION * region_size**2), 1))
+    # Number the superpixels that are not empty consecutively.
+    _, labels = np.unique(labels, return_inverse = True)
+    return labels.reshape((height, width))
+
+
+def _enforce_connectivity(labels, min_size):
+    """
+    Splits the superpixels into 4-connected parts. The largest part of every
+    superpixel, and the other parts of at least min_size pixels, are kept as
+    superpixels; the other parts are merged into the neighboring part they
+    share the longest border with, so that every superpixel is connected.
+
+    Returns:
+        2D int array with an id, not consecutive, for every superpixel.
+    """
+    height, width = labels.shape
+    # 4-connected parts with the same label, found by OpenCV on a grid of
+    # twice the resolution whose pixels between two neighbors are set only
+    # if both neighbors have the same label.
+    grid = np.zeros((2 * height - 1, 2 * width - 1), dtype = np.uint8)
+    grid[::2, ::2] = 1
+    grid[::2, 1::2] = labels[:, :-1] == labels[:, 1:]
+    grid[1::2, ::2] = labels[:-1] == labels[1:]
+    num_parts, parts = cv.connectedComponents(grid, connectivity = 4, ltype = cv.CV_32S)
+    parts = parts[::2, ::2]
+
+    sizes = np.bincount(parts.ravel(), minlength = num_parts)
+    part_labels = np.zeros(num_parts, dtype = labels.dtype)
+    part_labels[parts.ravel()] = labels.ravel()
+    # Parts sorted by label and then size: the last part of each label is its largest.
+    order = np.lexsort((sizes[1:], part_labels[1:])) + 1
+    largest = order[np.append(part_labels[order][1:] != part_labels[order][:-1], True)]
+    resolved = sizes >= min_size
+    resolved[largest] = True
+    # Part 0 is the background of the grid, which has no pixels.
+    resolved[0] = True
+    owner = np.arange(num_parts)
+
+    # Pairs of neighboring parts, in both directions.
+    pairs = np.concatenate([
+        np.stack([parts[:, :-1].ravel(), parts[:, 1:].ravel()], axis = 1),
+        np.stack([parts[:-1].ravel(), parts[1:].ravel()], axis = 1),
+    ])
+    pairs = pairs[pairs[:, 0] != pairs[:, 1]]
+    pairs = np.concatenate([pairs, pairs[:, ::-1]])
+
+    # Parts are merged into resolved neighbors, from the outside in.
+    while not resolved.all():
+        candidates = pairs[~resolved[pairs[:, 0]] & resolved[pairs[:, 1]]]
+        if not len(candidates):
+            break
+        merges, border_lengths = np.unique(
+            np.stack([candidates[:, 0], owner[candidates[:, 1]]], axis = 1), axis = 0, return_counts = True)
+        # Longest border last for every part.
+        order = np.lexsort((border_lengths, merges[:, 0]))
+        merges = merges[order]
+        merges = merges[np.append(merges[1:, 0] != merges[:-1, 0], True)]
+        owner[merges[:, 0]] = merges[:, 1]
+        resolved[merges[:, 0]] = True
+    return owner[parts]
+
+
+def superpixel_colors(image, labels):
+    """
+    Args:
+        image: Image in the RGB color space as a 3D array.
+        labels: Superpixel of every pixel, as returned by slic.
+
+    Returns:
+        colors: (N, 3) float array with the mean RGB color of each superpixel.
+        sizes: (N,) float array with the number of pixels in each superpixel.
+    """
+    labels = labels.ravel()
+    pixels = image.reshape((-1, 3))
+    sizes = np.bincount(labels).astype(np.float64)
+    colors = np.stack(
+        [np.bincount(labels, weights = pixels[:, c]) for c in range(3)],
+        axis = 1
+    ) / sizes[:, None]
+    return colors, sizes
@@ -4,6 +4,8 @@ import cv2 as cv
 from matplotlib import pyplot as plt
 import numpy as np
 
+from .png_encoding import write_png
+
 def show_image(image, cmap = None):
     if cmap:
         plt.imshow(image, cmap = cmap)
@@ -22,11 +24,28 @@ def draw_contours(contour, image_width, image_height):
         cv.drawContours(contours_image, [contour], 0, (0,255,0), 4)
     show_image(contours_image, cmap = 'gray')
 
-def save_image(image, filename, convert_to_bgr = True):
-    if convert_to_bgr:
-        image = cv.cvtColor(image.astype(np.uint8), cv.COLOR_RGB2BGR)
-    
+def save_image(image, filename, convert_to_bgr = True,
+               palettized = False, compression_level = 6):
+    """
+    Args:
+        image: Image to save, in the RGB color space if convert_to_bgr is True.
+        filename: Path of the image file.
+        convert_to_bgr: If False, the image is expected in the BGR color space.
+        palettized: If True and filename is a PNG, the image is saved as an
+            indexed PNG when it has at most 256 colors (see png_encoding.iter_png).
+        compression_level: zlib compression level (0-9) for palettized PNGs.
+    """
     directory = os.path.dirname(filename)
     if not os.path.exists(directory):
         os.makedirs(directory)
+
+    if palettized and filename.lower().endswith(".png"):
+        if not convert_to_bgr and image.ndim == 3:
+            image = cv.cvtColor(image.astype(np.uint8), cv.COLOR_BGR2RGB)
+        with open(filename, "wb") as f:
+            write_png(image, f, compression_level = compression_level)
+        return
+
+    if convert_to_bgr:
+        image = cv.cvtColor(image.astype(np.uint8), cv.COLOR_RGB2BGR)
     cv.imwrite(filename, image)
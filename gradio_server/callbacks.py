@@ -1,13 +1,199 @@
+import contextlib
+import itertools
+import threading
+import uuid
+
+import gradio as gr
+import numpy as np
+
+from colorbynumber.cancellation import CancellationToken, Cancelled, DeadlineExceeded
 from colorbynumber.config import default_config
-from colorbynumber.main import ColorByNumber
+from colorbynumber.legend import generate_color_legend
+from colorbynumber.main import ColorByNumber, load_image
+from colorbynumber.pipeline import DenoisedStage, SimplifiedStage, IslandsStage
 from colorbynumber.numbered_islands import add_numbers_to_image
+from colorbynumber.shared_arrays import SharedArray, SharedArrays, SharedCancellationToken
+
+from .session_store import SessionStore, SessionTooLarge
+
+# Process pool running the pipeline, see set_worker_pool.
+_worker_pool = None
+
+# Results of every browser session, referred to by a key kept in a gr.State.
+_session_store = SessionStore()
+
+# colorbynumber.shadow.ShadowMode, see set_shadow_mode.
+_shadow_mode = None
+
+# Seconds after which a run is stopped, see set_run_timeout.
+_run_timeout = None
+
+# Session key -> (CancellationToken, generation) of the run in progress for
+# that session, so that a new submit stops the previous run, and session key
+# -> generation of the latest submit. Generations are given when submit is
+# clicked (see cancel_session_run), so a run is stopped only by later clicks.
+_running = {}
+_latest_generation = {}
+_generations = itertools.count(1)
+_running_lock = threading.Lock()
+
+def set_worker_pool(pool):
+    """Runs the pipeline on a concurrent.futures.ProcessPoolExecutor.
+    Images and results are exchanged through shared memory.
+    Pass None to run in the server process again."""
+    global _worker_pool
+    _worker_pool = pool
+
+def set_session_store(store):
+    """Keeps the results of browser sessions in the given SessionStore."""
+    global _session_store
+    _session_store = store
+
+def set_shadow_mode(shadow):
+    """Compares a sample of the pages made in the server process with the
+    reference implementation (see colorbynumber.shadow.ShadowMode).
+    Pass None to disable."""
+    global _shadow_mode
+    _shadow_mode = shadow
+
+def set_run_timeout(seconds):
+    """Stops runs that take longer than the given number of seconds.
+    Pass None for no limit."""
+    global _run_timeout
+    _run_timeout = seconds
+
+def cancel_session_run(session_key):
+    """
+    Gives a new generation to a submit of a session and stops the runs of
+    earlier submits. Meant to be called without queuing when submit is
+    clicked, since the new run may otherwise wait in the queue for the
+    previous one to finish.
+
+    Returns:
+        (session_key, generation) to pass to get_color_by_number. A session
+        key is created if session_key is None.
+    """
+    if session_key is None:
+        session_key = uuid.uuid4().hex
+    with _running_lock:
+        generation = next(_generations)
+        _latest_generation[session_key] = generation
+        token, _ = _running.get(session_key, (None, None))
+    if token is not None:
+        token.cancel()
+    return session_key, generation
+
+def _new_token():
+    if _worker_pool is not None:
+        # Runs in worker processes watch the token through shared memory.
+        # Their timeout is applied in the worker.
+        return SharedCancellationToken.create()
+    if _run_timeout is not None:
+        return CancellationToken.with_timeout(_run_timeout)
+    return CancellationToken()
+
+def _start_session_run(session_key, generation):
+    token = _new_token()
+    with _running_lock:
+        latest = _latest_generation.get(session_key, generation)
+        if generation is not None and generation < latest:
+            # Submit was clicked again before this run started.
+            token.cancel()
+            return token
+        previous_token, _ = _running.get(session_key, (None, None))
+        _running[session_key] = (token, generation)
+    if previous_token is not None:
+        previous_token.cancel()
+    return token
+
+def _end_session_run(session_key, token):
+    with _running_lock:
+        running_token, generation = _running.get(session_key, (None, None))
+        if running_token is token:
+            del _running[session_key]
+            if _latest_generation.get(session_key) == generation:
+                _latest_generation.pop(session_key, None)
+    if isinstance(token, SharedCancellationToken):
+        token.unlink()
+
+def _store_session(session_key, islands_image, data, border_color):
+    # Only the border layer is kept, as a mask, for the numbers to be redrawn on.
+    value = dict(
+        data,
+        border_mask = (islands_image == np.array(border_color)).all(axis = -1),
+        border_color = tuple(border_color),
+    )
+    if session_key is None:
+        session_key = uuid.uuid4().hex
+    try:
+        return _session_store.put(session_key, value)
+    except SessionTooLarge:
+        # The page is still shown, but font changes cannot redraw it.
+        gr.Warning("This page is too large to keep on the server: "
+                   "changing the font will not redraw it. Submit again to update it.")
+        return session_key
+
+def _run_in_worker(image_descriptor, token_descriptor, color_list, num_colors, config, timeout):
+    cancellation_token = SharedCancellationToken.attach(token_descriptor)
+    try:
+        colorbynumber_obj = ColorByNumber.from_shared_image(
+            image_descriptor,
+            color_list = color_list,
+            num_colors = num_colors,
+            config = config,
+            cancellation_token = cancellation_token,
+            timeout = timeout,
+        )
+        colorbynumber_obj.create_color_by_number()
+    except Cancelled as e:
+        # The partial result is not needed, and would be pickled back.
+        e.partial_result = None
+        raise
+    finally:
+        cancellation_token.close()
+    results = colorbynumber_obj.share_results()
+    try:
+        return results.descriptor
+    finally:
+        results.close()
+
+@contextlib.contextmanager
+def _color_by_number_in_worker(image_path, color_list, num_colors, config, cancellation_token):
+    # The outputs are views into the shared memory of the worker's results,
+    # which is unlinked on exit. Views still referenced after that stay valid
+    # (see SharedArray.close). Cancelling the SharedCancellationToken stops
+    # the worker, and Cancelled is raised here.
+    shared_image = SharedArray.from_array(load_image(image_path))
+    try:
+        # Configs are read-only MappingProxyTypes, which cannot be pickled.
+        results_descriptor = _worker_pool.submit(
+            _run_in_worker, shared_image.descriptor, cancellation_token.descriptor,
+            color_list, num_colors, dict(config), _run_timeout,
+            ).result()
+    finally:
+        shared_image.unlink()
+
+    # SharedArrays.attach unlinks the segments itself if it fails.
+    with SharedArrays.attach(results_descriptor) as results:
+        outputs = results.arrays
+        outputs["data"] = {
+            "centroid_coords_list": [
+                [np.nan, np.nan] if np.isnan(centroid).any() else [int(c) for c in centroid]
+                for centroid in outputs["centroid_coords"]
+            ],
+            "color_id_list": [int(color_id) for color_id in outputs["color_ids"]],
+        }
+        try:
+            yield outputs
+        finally:
+            outputs.clear()
 
 
 def _hex_to_rgb(hex_color):
         hex_color = hex_color.lstrip("#")
         return tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
 
-def get_color_by_number(image_path, number_of_colors, 
+def get_color_by_number(session_key, run_generation, image_path, number_of_colors, 
                         is_automatic_colors, num_colors,
                         denoise_flag, denoise_order, denoise_type,
                         blur_size, denoise_h,
@@ -33,35 +219,110 @@ def get_color_by_number(image_path, number_of_colors,
     config["font_size"] = font_size
     config["font_color"] = _hex_to_rgb(font_color)
     config["font_thickness"] = font_thickness
+    # Palettes are cached per image, so changing the number of colors is fast.
+    config["kmeans_method"] = "palette_family"
+
+    # The key and generation are normally given by cancel_session_run when
+    # submit is clicked, so that a later click can stop this run.
+    if session_key is None:
+        session_key = uuid.uuid4().hex
+    cancellation_token = _start_session_run(session_key, run_generation)
+    try:
+        if cancellation_token.cancelled:
+            # Replaced by a newer submit, whose outputs will follow.
+            return
+
+        if _worker_pool is not None:
+            try:
+                with _color_by_number_in_worker(
+                    image_path = image_path,
+                    color_list = None if is_automatic_colors else color_list,
+                    num_colors = number_of_colors if is_automatic_colors else None,
+                    config = config,
+                    cancellation_token = cancellation_token,
+                ) as outputs:
+                    session_key = _store_session(
+                        session_key, outputs["islands_image"], outputs["data"], config["border_color"])
+                    # The worker only sends back the final outputs.
+                    yield outputs["numbered_islands"], outputs["legend"], outputs["simplified_image"], \
+                        None, session_key
+            except Cancelled as e:
+                if isinstance(e, DeadlineExceeded):
+                    raise
+                # Replaced by a newer submit, whose outputs will follow.
+            return
+
+        yield from _color_by_number_in_process(
+            session_key, cancellation_token, image_path, number_of_colors,
+            is_automatic_colors, color_list, config)
+    finally:
+        _end_session_run(session_key, cancellation_token)
 
+def _color_by_number_in_process(session_key, cancellation_token, image_path, number_of_colors,
+                                is_automatic_colors, color_list, config):
     if is_automatic_colors:
         colorbynumber_obj = ColorByNumber(
             image_path = image_path,
             num_colors = number_of_colors,
             config = config,
+            shadow = _shadow_mode,
+            cancellation_token = cancellation_token,
         )
     else:
         colorbynumber_obj = ColorByNumber(
             image_path = image_path, 
             color_list = color_list,
             config = config,
+            shadow = _shadow_mode,
+            cancellation_token = cancellation_token,
         )
 
-    numbered_islands = colorbynumber_obj.create_color_by_number()
+    # Stream each stage to the UI as soon as it is available.
+    # Outputs that are not computed yet are cleared (None).
+    legend = None
+    simplified_image = None
+    denoised_image = None
+    try:
+        for stage in colorbynumber_obj.iter_color_by_number():
+            if isinstance(stage, DenoisedStage):
+                denoised_image = stage.denoised_image
+                yield None, None, None, denoised_image, session_key
+
+            elif isinstance(stage, SimplifiedStage):
+                legend = generate_color_legend(stage.color_list)
+                simplified_image = stage.simplified_image
+                yield None, legend, simplified_image, denoised_image, session_key
+
+            elif isinstance(stage, IslandsStage):
+                yield stage.islands_image, legend, simplified_image, denoised_image, session_key
+    except Cancelled as e:
+        if isinstance(e, DeadlineExceeded):
+            raise
+        # Replaced by a newer submit, whose outputs will follow.
+        return
+
     data = {
         "centroid_coords_list": colorbynumber_obj.centroid_coords_list,
         "color_id_list": [color_id for color_id, _ in colorbynumber_obj.island_borders_list]
     }
-    return numbered_islands, \
-        colorbynumber_obj.generate_color_legend(), \
-        colorbynumber_obj.simplified_image, \
-        colorbynumber_obj.islands_image, \
-        data
+    session_key = _store_session(
+        session_key, colorbynumber_obj.islands_image, data, config["border_color"])
+    yield colorbynumber_obj.numbered_islands, \
+        legend, \
+        simplified_image, \
+        denoised_image, \
+        session_key
 
-def change_font_on_image(image, data, font_size, font_color, font_thickness):
-    if image is None:
-        return None
+def change_font_on_image(session_key, font_size, font_color, font_thickness):
+    # Nothing to redraw before the first submit, once the session expired, or
+    # if the page was too large to keep: the page shown is left unchanged.
+    data = _session_store.get(session_key) if session_key is not None else None
+    if data is None:
+        return gr.update()
 
+    border_mask = data["border_mask"]
+    image = np.full(border_mask.shape + (3,), 255, dtype = np.uint8)
+    image[border_mask] = data["border_color"]
     centroid_coords_list = data["centroid_coords_list"]
     color_id_list = data["color_id_list"]
 
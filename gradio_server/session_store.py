@@ -0,0 +1,100 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+
+
+def _size_of(value):
+    """Approximate memory used by the numpy arrays in a (nested) session value."""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sum(_size_of(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(_size_of(item) for item in value)
+    return 0
+
+
+class SessionTooLarge(ValueError):
+    """Raised by SessionStore.put for a value larger than the memory cap of the store."""
+
+
+class SessionStore:
+    def __init__(self, ttl_seconds = 3600, max_bytes = 256 * 1024 * 1024):
+        """
+        Keeps the results of each browser session in memory, so that the
+        browser only has to send back a session key instead of images.
+
+        Sessions expire ttl_seconds after they were last used. When the arrays
+        of all sessions take more than max_bytes, the least recently used
+        sessions are dropped.
+
+        Args:
+            ttl_seconds: Time to live of a session.
+            max_bytes: Memory cap for the arrays of all sessions.
+        """
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+
+        # Session key -> (value, size, last used time), least recently used first.
+        self._sessions = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def put(self, session_key, value):
+        """
+        Stores the value of a session, replacing the previous one.
+
+        Args:
+            session_key: Key returned by an earlier put, or None for a new session.
+            value: Value to store. It should not be modified afterwards.
+
+        Returns:
+            The session key.
+
+        Raises:
+            SessionTooLarge if the value alone takes more than max_bytes.
+            The previous value of the session is deleted anyway, since it
+            was meant to be replaced.
+        """
+        if session_key is None:
+            session_key = uuid.uuid4().hex
+        size = _size_of(value)
+        with self._lock:
+            self._pop(session_key)
+            if size > self.max_bytes:
+                raise SessionTooLarge(
+                    f"Session value of {size} bytes exceeds the {self.max_bytes} bytes cap")
+            self._sessions[session_key] = (value, size, time.time())
+            self._total_bytes += size
+            self._evict()
+        return session_key
+
+    def get(self, session_key):
+        """Returns the value of a session, or None if it is unknown, expired or was evicted."""
+        with self._lock:
+            self._evict()
+            if session_key not in self._sessions:
+                return None
+            value, size, _ = self._sessions.pop(session_key)
+            self._sessions[session_key] = (value, size, time.time())
+            return value
+
+    def delete(self, session_key):
+        with self._lock:
+            self._pop(session_key)
+
+    def _pop(self, session_key):
+        if session_key in self._sessions:
+            _, size, _ = self._sessions.pop(session_key)
+            self._total_bytes -= size
+
+    def _evict(self):
+        expiry = time.time() - self.ttl_seconds
+        while self._sessions:
+            session_key, (_, _, last_used) = next(iter(self._sessions.items()))
+            if last_used >= expiry and self._total_bytes <= self.max_bytes:
+                break
+            self._pop(session_key)
@@ -0,0 +1,83 @@
+"""Headless HTTP job service for Color by number.
+
+Usage: python -m job_server --port 8000 --workers 2
+"""
+import argparse
+import threading
+from http.server import ThreadingHTTPServer
+
+from colorbynumber.cost_estimate import AdmissionLimits
+
+from .http_handler import make_handler
+from .jobs import JobManager
+from .result_store import ResultStore
+
+
+def _sweep_expired(job_manager, interval, stop_event):
+    while not stop_event.wait(interval):
+        job_manager.delete_expired()
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Color by number job service")
+    parser.add_argument("--host", default = "127.0.0.1")
+    parser.add_argument("--port", type = int, default = 8000)
+    parser.add_argument("--workers", type = int, default = 2,
+                        help = "Number of jobs processed concurrently.")
+    parser.add_argument("--max-pending", type = int, default = 8,
+                        help = "Maximum number of queued plus running jobs.")
+    parser.add_argument("--store-dir", default = None,
+                        help = "Directory for job files. A temporary directory by default.")
+    parser.add_argument("--ttl", type = float, default = 3600,
+                        help = "Seconds after which finished jobs and their files are deleted.")
+    parser.add_argument("--png-compression", type = int, default = 6,
+                        help = "zlib level (0-9) of the output PNGs: lower is faster, higher is smaller.")
+    parser.add_argument("--max-wall-time", type = float, default = None,
+                        help = "Estimated seconds above which a job is degraded or rejected.")
+    parser.add_argument("--max-memory-mb", type = float, default = None,
+                        help = "Estimated peak memory above which a job is degraded or rejected.")
+    parser.add_argument("--max-islands", type = int, default = None,
+                        help = "Estimated island count above which a job is degraded or rejected.")
+    parser.add_argument("--job-timeout", type = float, default = None,
+                        help = "Seconds after which a running job is stopped.")
+    parser.add_argument("--admission-policy", choices = ["degrade", "reject"], default = "degrade",
+                        help = "Try cheaper settings and smaller images first, or reject directly.")
+    args = parser.parse_args()
+
+    result_store = ResultStore(root_dir = args.store_dir, ttl_seconds = args.ttl)
+    job_manager = JobManager(
+        result_store,
+        max_workers = args.workers,
+        max_pending = args.max_pending,
+        png_compression_level = args.png_compression,
+        admission_limits = AdmissionLimits(
+            max_wall_time = args.max_wall_time,
+            max_peak_memory = None if args.max_memory_mb is None else args.max_memory_mb * 1024 * 1024,
+            max_island_count = args.max_islands,
+        ),
+        admission_policy = args.admission_policy,
+        job_timeout = args.job_timeout,
+    )
+
+    stop_event = threading.Event()
+    sweeper = threading.Thread(
+        target = _sweep_expired,
+        args = (job_manager, min(args.ttl, 60), stop_event),
+        daemon = True,
+    )
+    sweeper.start()
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(job_manager))
+    print(f"Serving on http://{args.host}:{args.port} (results in {result_store.root_dir})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_event.set()
+        server.server_close()
+        job_manager.shutdown()
+
+
+if __name__ == "__main__":
+    main()
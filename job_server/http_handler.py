@@ -0,0 +1,122 @@
+import base64
+import binascii
+import json
+import re
+from http.server import BaseHTTPRequestHandler
+
+from .jobs import OUTPUTS, QueueFull
+
+_CONTENT_TYPES = {
+    ".png": "image/png",
+    ".json": "application/json",
+}
+
+_JOB_PATH = re.compile(r"^/jobs/([0-9a-f]{32})$")
+_OUTPUT_PATH = re.compile(r"^/jobs/([0-9a-f]{32})/outputs/([\w.]+)$")
+
+# Uploads larger than this are rejected.
+MAX_REQUEST_BYTES = 50 * 1024 * 1024
+
+
+def make_handler(job_manager):
+    """Returns a request handler class serving the given JobManager.
+
+    Endpoints:
+        POST /jobs
+            JSON body with "image" (base64 encoded image file), optional
+            "image_name", and either "num_colors" or "color_list", plus
+            optional "config" overrides. Responds 202 with the job id.
+        GET /jobs/<job_id>
+            Status, current stage and progress of the job.
+        GET /jobs/<job_id>/outputs/<name>
+            One of the files in jobs.OUTPUTS, once the job is done. Images
+            are PNG encoded while they are sent.
+        DELETE /jobs/<job_id>
+            Stops a queued or running job (responds 202 with its status,
+            which becomes "cancelled"), or deletes a finished job and its
+            files (responds 200).
+    """
+
+    class JobRequestHandler(BaseHTTPRequestHandler):
+        def _send_json(self, status, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_error(self, status, message):
+            self._send_json(status, {"error": message})
+
+        def do_POST(self):
+            if self.path != "/jobs":
+                return self._send_error(404, "Not found")
+
+            length = int(self.headers.get("Content-Length", 0))
+            if length > MAX_REQUEST_BYTES:
+                return self._send_error(413, "Request too large")
+            try:
+                request = json.loads(self.rfile.read(length))
+                image_bytes = base64.b64decode(request["image"], validate = True)
+            except (ValueError, KeyError, TypeError, binascii.Error):
+                return self._send_error(400, "Body must be JSON with a base64 encoded 'image'")
+
+            try:
+                job_id = job_manager.submit(
+                    image_bytes = image_bytes,
+                    image_name = request.get("image_name", "input.png"),
+                    color_list = request.get("color_list"),
+                    num_colors = request.get("num_colors"),
+                    config_overrides = request.get("config"),
+                )
+            except QueueFull:
+                return self._send_error(503, "Too many pending jobs, retry later")
+            except ValueError as e:
+                return self._send_error(400, str(e))
+
+            self._send_json(202, {"job_id": job_id, "status_url": f"/jobs/{job_id}"})
+
+        def do_GET(self):
+            match = _JOB_PATH.match(self.path)
+            if match:
+                record = job_manager.status(match.group(1))
+                if record is None:
+                    return self._send_error(404, "Unknown job")
+                return self._send_json(200, record)
+
+            match = _OUTPUT_PATH.match(self.path)
+            if not match:
+                return self._send_error(404, "Not found")
+            job_id, name = match.groups()
+            record = job_manager.status(job_id)
+            if record is None or name not in OUTPUTS:
+                return self._send_error(404, "Not found")
+            if record["status"] != "done":
+                return self._send_error(409, f"Job is {record['status']}")
+
+            chunks = job_manager.iter_output(job_id, name)
+            if chunks is None:
+                return self._send_error(404, "Not found")
+            # The length of an image is not known until it is encoded, so the
+            # response ends when the connection closes (HTTP/1.0).
+            self.send_response(200)
+            self.send_header("Content-Type", _CONTENT_TYPES[name[name.rfind("."):]])
+            self.end_headers()
+            for chunk in chunks:
+                self.wfile.write(chunk)
+
+        def do_DELETE(self):
+            match = _JOB_PATH.match(self.path)
+            if not match:
+                return self._send_error(404, "Not found")
+            job_id = match.group(1)
+            if job_manager.status(job_id) is None:
+                return self._send_error(404, "Unknown job")
+
+            record = job_manager.cancel(job_id)
+            if record is None:
+                return self._send_json(200, {"job_id": job_id, "status": "deleted"})
+            self._send_json(202, record)
+
+    return JobRequestHandler
@@ -0,0 +1,275 @@
+import json
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from colorbynumber.cancellation import CancellationToken, Cancelled, DeadlineExceeded
+from colorbynumber.config import default_config, make_config
+from colorbynumber.cost_estimate import AdmissionLimits, AdmissionRejected, admit
+from colorbynumber.legend import generate_color_legend
+from colorbynumber.main import load_image
+from colorbynumber.pipeline import STAGES, PaletteSpec, run
+from colorbynumber import png_encoding
+
+# Stages reported by a job. The cost estimate is followed by the pipeline
+# stages and writing the outputs.
+JOB_STAGES = ("admission",) + STAGES + ("legend", "saving")
+
+# Names of the files a finished job provides.
+OUTPUTS = (
+    "numbered_islands.png",
+    "legend.png",
+    "simplified_image.png",
+    "islands.json",
+)
+
+# Images are stored as .npy arrays and encoded as PNG while they are sent.
+_STORED_NAMES = {
+    "numbered_islands.png": "numbered_islands.npy",
+    "legend.png": "legend.npy",
+    "simplified_image.png": "simplified_image.npy",
+    "islands.json": "islands.json",
+}
+
+# Size of the pieces in which stored files are sent.
+_READ_SIZE = 64 * 1024
+
+
+def _iter_file(f):
+    with f:
+        while True:
+            data = f.read(_READ_SIZE)
+            if not data:
+                return
+            yield data
+
+
+class QueueFull(Exception):
+    """Raised when a job is submitted while all worker slots are taken."""
+
+
+def _islands_json(result):
+    islands = []
+    for (color_id, _), centroid in zip(result.island_borders_list,
+                                       result.centroid_coords_list):
+        if np.isnan(centroid).any():
+            centroid = None
+        else:
+            centroid = [int(centroid[0]), int(centroid[1])]
+        islands.append({"color_id": int(color_id), "centroid": centroid})
+
+    return {
+        "image_shape": list(result.islands_image.shape),
+        "color_list": [[int(c) for c in color] for color in result.color_list],
+        "islands": islands,
+    }
+
+
+class JobManager:
+    def __init__(self, result_store, max_workers = 2, max_pending = 8,
+                 png_compression_level = 6,
+                 admission_limits = AdmissionLimits(), admission_policy = "degrade",
+                 job_timeout = None):
+        """
+        Runs color by number jobs on a bounded pool of worker threads.
+
+        Args:
+            result_store: ResultStore holding job records and output files.
+            max_workers: Number of jobs processed concurrently.
+            max_pending: Maximum number of queued plus running jobs.
+                Submitting more raises QueueFull.
+            png_compression_level: zlib compression level (0-9) of the
+                output images, which are sent as indexed PNGs when possible.
+            admission_limits: cost_estimate.AdmissionLimits checked before
+                running each job.
+            admission_policy: What to do with jobs over the limits, see
+                cost_estimate.admit.
+            job_timeout: Seconds after which a running job is stopped, with
+                status "timed_out" (optional).
+        """
+        self.result_store = result_store
+        self.png_compression_level = png_compression_level
+        self.admission_limits = admission_limits
+        self.admission_policy = admission_policy
+        self.job_timeout = job_timeout
+        self._executor = ThreadPoolExecutor(max_workers = max_workers)
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+        # Job id -> (CancellationToken, Future) of the queued and running jobs.
+        self._active = {}
+        self._active_lock = threading.Lock()
+
+    def submit(self, image_bytes, image_name = "input.png",
+               color_list = None, num_colors = None, config_overrides = None):
+        """
+        Queues a job and returns its id.
+
+        Raises:
+            ValueError if the request is invalid.
+            QueueFull if too many jobs are pending.
+        """
+        if color_list is None and num_colors is None:
+            raise ValueError("Either color_list or num_colors must be provided.")
+        if config_overrides is not None:
+            if not isinstance(config_overrides, dict):
+                raise ValueError("config must be an object.")
+            unknown = sorted(set(config_overrides) - set(default_config))
+            if unknown:
+                raise ValueError(f"Unknown config parameters: {', '.join(unknown)}")
+        config = make_config(config_overrides)
+
+        if not self._slots.acquire(blocking = False):
+            raise QueueFull()
+
+        job_id = uuid.uuid4().hex
+        try:
+            self.result_store.create(job_id, {
+                "job_id": job_id,
+                "status": "queued",
+                "stage": None,
+                "progress": 0.0,
+                "error": None,
+            })
+            image_path = os.path.join(
+                self.result_store.job_dir(job_id),
+                "input" + (os.path.splitext(image_name)[1] or ".png"))
+            with open(image_path, "wb") as f:
+                f.write(image_bytes)
+            cancellation_token = CancellationToken()
+            with self._active_lock:
+                future = self._executor.submit(self._run, job_id, image_path, color_list,
+                                               num_colors, config, cancellation_token)
+                self._active[job_id] = (cancellation_token, future)
+        except Exception:
+            self._slots.release()
+            self.result_store.delete(job_id)
+            raise
+        return job_id
+
+    def status(self, job_id):
+        return self.result_store.get(job_id)
+
+    def iter_output(self, job_id, name):
+        """
+        Returns an iterator over the bytes of an output of a job, or None if
+        the job has no such output. Images are encoded as PNG piece by piece
+        while the iterator is consumed (see png_encoding.iter_png).
+
+        The stored file is opened before returning, so that an output deleted
+        afterwards, for example by delete_expired, can still be sent.
+        """
+        if name not in _STORED_NAMES:
+            return None
+        path = self.result_store.output_path(job_id, _STORED_NAMES[name])
+        if path is None:
+            return None
+        try:
+            if name.endswith(".png"):
+                image = np.load(path, mmap_mode = "r")
+                return png_encoding.iter_png(
+                    image, palettized = True, compression_level = self.png_compression_level)
+            f = open(path, "rb")
+        except FileNotFoundError:
+            # Deleted since output_path checked it.
+            return None
+        return _iter_file(f)
+
+    def cancel(self, job_id):
+        """
+        Stops a queued or running job, which then gets the status
+        "cancelled", or deletes a finished job and its files.
+
+        Returns:
+            The job record after the call, or None if the job is unknown
+            or was deleted.
+        """
+        with self._active_lock:
+            cancellation_token, future = self._active.get(job_id, (None, None))
+            if future is not None and future.cancel():
+                # The job had not started: _run will not be called.
+                del self._active[job_id]
+                self.result_store.update(job_id, status = "cancelled", error = "Cancelled")
+                self._slots.release()
+                return self.status(job_id)
+        if cancellation_token is not None:
+            # Running: it stops at its next check.
+            cancellation_token.cancel()
+            return self.status(job_id)
+
+        self.result_store.delete(job_id)
+        return None
+
+    def _set_stage(self, job_id, stage):
+        self.result_store.update(
+            job_id,
+            stage = stage,
+            progress = JOB_STAGES.index(stage) / len(JOB_STAGES),
+        )
+
+    def _run(self, job_id, image_path, color_list, num_colors, config, cancellation_token):
+        if self.job_timeout is not None:
+            cancellation_token = CancellationToken.with_timeout(self.job_timeout, parent = cancellation_token)
+        try:
+            cancellation_token.check()
+            self.result_store.update(job_id, status = "running")
+            self._set_stage(job_id, "admission")
+            palette_spec = PaletteSpec(color_list = color_list, num_colors = num_colors)
+            admission = admit(
+                load_image(image_path),
+                palette_spec,
+                config,
+                limits = self.admission_limits,
+                policy = self.admission_policy,
+            )
+            self.result_store.update(
+                job_id,
+                estimate = None if admission.estimate is None else admission.estimate._asdict(),
+                admission_actions = admission.actions,
+            )
+
+            result = run(
+                admission.image,
+                palette_spec,
+                admission.config,
+                progress_callback = lambda stage: self._set_stage(job_id, stage),
+                cancellation_token = cancellation_token,
+            )
+
+            cancellation_token.check()
+            self._set_stage(job_id, "legend")
+            legend = generate_color_legend(result.color_list)
+
+            self._set_stage(job_id, "saving")
+            job_dir = self.result_store.job_dir(job_id)
+            for name, image in (("numbered_islands.png", result.numbered_islands),
+                                ("legend.png", legend),
+                                ("simplified_image.png", result.simplified_image)):
+                np.save(os.path.join(job_dir, _STORED_NAMES[name]), image)
+            with open(os.path.join(job_dir, "islands.json"), "w") as f:
+                json.dump(_islands_json(result), f)
+
+            self.result_store.update(job_id, status = "done", stage = None, progress = 1.0)
+        except DeadlineExceeded:
+            self.result_store.update(
+                job_id, status = "timed_out", error = f"Stopped after {self.job_timeout} seconds")
+        except Cancelled:
+            self.result_store.update(job_id, status = "cancelled", error = "Cancelled")
+        except AdmissionRejected as e:
+            self.result_store.update(
+                job_id, status = "rejected", estimate = e.estimate._asdict(), error = str(e))
+        except Exception as e:
+            self.result_store.update(job_id, status = "failed", error = f"{type(e).__name__}: {e}")
+        finally:
+            with self._active_lock:
+                self._active.pop(job_id, None)
+            self._slots.release()
+
+    def delete_expired(self):
+        return self.result_store.delete_expired(
+            is_active = lambda record: record["status"] in ("queued", "running"))
+
+    def shutdown(self):
+        self._executor.shutdown(wait = False, cancel_futures = True)
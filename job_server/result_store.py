@@ -0,0 +1,68 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+
+class ResultStore:
+    def __init__(self, root_dir = None, ttl_seconds = 3600):
+        """
+        Keeps the files of each job in its own directory under root_dir
+        and deletes them ttl_seconds after the job was last updated.
+
+        Args:
+            root_dir: Directory in which job directories are created.
+                A temporary directory is used if not provided.
+            ttl_seconds: Time to live of a job and its files.
+        """
+        if root_dir is None:
+            root_dir = tempfile.mkdtemp(prefix = "colorbynumber_jobs_")
+        os.makedirs(root_dir, exist_ok = True)
+        self.root_dir = root_dir
+        self.ttl_seconds = ttl_seconds
+
+        self._records = {}
+        self._lock = threading.Lock()
+
+    def job_dir(self, job_id):
+        return os.path.join(self.root_dir, job_id)
+
+    def create(self, job_id, record):
+        os.makedirs(self.job_dir(job_id))
+        with self._lock:
+            self._records[job_id] = dict(record, updated_at = time.time())
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            if job_id in self._records:
+                self._records[job_id].update(fields, updated_at = time.time())
+
+    def get(self, job_id):
+        """Returns a copy of the job record, or None if the job is unknown or expired."""
+        with self._lock:
+            record = self._records.get(job_id)
+            return dict(record) if record is not None else None
+
+    def output_path(self, job_id, name):
+        """Returns the path of an output file of a job, or None if it does not exist."""
+        path = os.path.join(self.job_dir(job_id), os.path.basename(name))
+        if self.get(job_id) is None or not os.path.isfile(path):
+            return None
+        return path
+
+    def delete(self, job_id):
+        with self._lock:
+            self._records.pop(job_id, None)
+        shutil.rmtree(self.job_dir(job_id), ignore_errors = True)
+
+    def delete_expired(self, is_active = lambda record: False):
+        """Deletes the jobs not updated within the TTL.
+        Jobs for which is_active(record) is True are kept."""
+        expiry = time.time() - self.ttl_seconds
+        with self._lock:
+            expired = [job_id for job_id, record in self._records.items()
+                       if record["updated_at"] < expiry and not is_active(record)]
+        for job_id in expired:
+            self.delete(job_id)
+        return expired
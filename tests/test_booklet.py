@@ -0,0 +1,137 @@
+import io
+import re
+import zipfile
+import zlib
+
+import cv2 as cv
+import numpy as np
+import pytest
+
+from colorbynumber.booklet import PdfBookletWriter, ZipBookletWriter, iter_map
+
+
+class _UnseekableFile:
+    def __init__(self):
+        self.data = bytearray()
+
+    def write(self, data):
+        self.data += data
+
+    def flush(self):
+        pass
+
+
+def _objects(pdf):
+    # Object id -> body, located through the cross-reference table.
+    xref_position = int(re.search(rb"startxref\n(\d+)\n%%EOF\n$", pdf).group(1))
+    assert pdf[xref_position:].startswith(b"xref\n")
+    lines = pdf[xref_position:].split(b"\n")
+    count = int(lines[1].split()[1])
+    objects = {}
+    for object_id in range(1, count):
+        position = int(lines[2 + object_id].split()[0])
+        header = b"%d 0 obj\n" % object_id
+        assert pdf[position:position + len(header)] == header
+        end = pdf.index(b"\nendobj\n", position)
+        objects[object_id] = pdf[position + len(header):end]
+    return objects
+
+
+def _reference(body, key):
+    return int(re.search(rb"/" + key + rb" (\d+) 0 R", body).group(1))
+
+
+def _decode_image(objects, image_id):
+    body = objects[image_id]
+    width = int(re.search(rb"/Width (\d+)", body).group(1))
+    height = int(re.search(rb"/Height (\d+)", body).group(1))
+    bit_depth = int(re.search(rb"/BitsPerComponent (\d+)", body).group(1))
+    length = int(objects[_reference(body, b"Length")])
+    start = body.index(b"stream\n") + len(b"stream\n")
+    assert body[start + length:] == b"\nendstream"
+    rows = np.frombuffer(zlib.decompress(body[start:start + length]), dtype = np.uint8)
+
+    indexed = re.search(rb"/ColorSpace \[/Indexed /DeviceRGB (\d+) <([0-9a-f]*)>\]", body)
+    if indexed is None:
+        assert b"/ColorSpace /DeviceRGB" in body
+        return rows.reshape((height, width, 3))
+    palette = np.frombuffer(bytes.fromhex(indexed.group(2).decode()), dtype = np.uint8).reshape((-1, 3))
+    assert len(palette) == int(indexed.group(1)) + 1
+    # Rows start on a byte boundary, the leftmost pixel in the most significant bits.
+    bits = np.unpackbits(rows.reshape((height, -1)), axis = 1)
+    bits = bits[:, :width * bit_depth].reshape((height, width, bit_depth))
+    indices = (bits * (1 << np.arange(bit_depth - 1, -1, -1))).sum(axis = -1)
+    return palette[indices]
+
+
+def _read_pdf(pdf):
+    """Returns the images of the pages of a PDF written by PdfBookletWriter."""
+    assert pdf.startswith(b"%PDF-1.4\n")
+    objects = _objects(pdf)
+    assert _reference(objects[1], b"Pages") == 2
+    page_ids = [int(page_id) for page_id in re.findall(rb"(\d+) 0 R", objects[2])]
+    assert int(re.search(rb"/Count (\d+)", objects[2]).group(1)) == len(page_ids)
+    return [_decode_image(objects, _reference(objects[page_id], b"Im0")) for page_id in page_ids]
+
+
+def _image_with_colors(num_colors, shape = (29, 43)):
+    random_state = np.random.RandomState(num_colors)
+    palette = random_state.randint(0, 256, size = (num_colors, 3)).astype(np.uint8)
+    indices = random_state.randint(0, num_colors, size = shape)
+    indices.ravel()[:num_colors] = np.arange(num_colors)
+    return palette[indices]
+
+
+PAGES = [
+    _image_with_colors(2),
+    _image_with_colors(4, shape = (50, 20)),
+    _image_with_colors(16),
+    _image_with_colors(200),
+    # More colors than a palette can hold.
+    np.random.RandomState(0).randint(0, 256, size = (31, 17, 3)).astype(np.uint8),
+]
+
+
+@pytest.mark.parametrize("compression_level", [0, 6])
+def test_pdf_round_trip(compression_level):
+    fileobj = _UnseekableFile()
+    writer = PdfBookletWriter(fileobj, compression_level = compression_level)
+    for image in PAGES:
+        writer.add_page(image)
+    writer.close()
+
+    decoded = _read_pdf(bytes(fileobj.data))
+    assert len(decoded) == len(PAGES)
+    for image, page in zip(PAGES, decoded):
+        np.testing.assert_array_equal(page, image)
+
+
+def test_pdf_grayscale_page():
+    image = np.tile(np.arange(0, 250, 50, dtype = np.uint8), (7, 3))
+    fileobj = io.BytesIO()
+    writer = PdfBookletWriter(fileobj)
+    writer.add_page(image)
+    writer.close()
+    page, = _read_pdf(fileobj.getvalue())
+    np.testing.assert_array_equal(page, np.repeat(image[:, :, None], 3, axis = 2))
+
+
+def test_zip_round_trip():
+    fileobj = io.BytesIO()
+    writer = ZipBookletWriter(fileobj)
+    for image in PAGES[:2]:
+        writer.add_page(image)
+    writer.add_page(PAGES[2], name = "legend.png")
+    writer.close()
+
+    with zipfile.ZipFile(io.BytesIO(fileobj.getvalue())) as archive:
+        assert archive.namelist() == ["page_0001.png", "page_0002.png", "legend.png"]
+        for name, image in zip(archive.namelist(), PAGES):
+            page = cv.imdecode(np.frombuffer(archive.read(name), dtype = np.uint8), cv.IMREAD_COLOR)
+            np.testing.assert_array_equal(cv.cvtColor(page, cv.COLOR_BGR2RGB), image)
+
+
+@pytest.mark.parametrize("max_workers", [1, 3])
+def test_iter_map_keeps_order(max_workers):
+    assert list(iter_map(lambda x: x * x, iter(range(20)), max_workers = max_workers)) \
+        == [x * x for x in range(20)]
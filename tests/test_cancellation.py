@@ -0,0 +1,89 @@
+import time
+
+import numpy as np
+import pytest
+
+from colorbynumber.cancellation import CancellationToken, Cancelled, DeadlineExceeded
+from colorbynumber.config import make_config
+from colorbynumber.pipeline import DenoisedStage, PaletteSpec, Result, SimplifiedStage, run
+
+CONFIG = make_config(denoise = False, apply_kmeans = False)
+COLOR_LIST = np.array([[255, 0, 0], [0, 0, 255]], dtype = np.uint8)
+
+
+def _image():
+    image = np.empty((60, 80, 3), dtype = np.uint8)
+    image[:, :40] = COLOR_LIST[0]
+    image[:, 40:] = COLOR_LIST[1]
+    return image
+
+
+def _run(cancellation_token, progress_callback = None):
+    return run(_image(), PaletteSpec(color_list = COLOR_LIST), CONFIG,
+               progress_callback = progress_callback, cancellation_token = cancellation_token)
+
+
+def test_run_completes():
+    assert isinstance(_run(CancellationToken()), Result)
+
+
+def test_cancelled_token_raises_cancelled():
+    token = CancellationToken()
+    token.cancel()
+    with pytest.raises(Cancelled) as excinfo:
+        _run(token)
+    assert not isinstance(excinfo.value, DeadlineExceeded)
+    assert excinfo.value.partial_result is None
+
+
+def test_cancel_during_run_keeps_partial_result():
+    token = CancellationToken()
+    def progress_callback(stage):
+        if stage == "denoise":
+            # Checked when the next stage starts.
+            token.cancel()
+
+    with pytest.raises(Cancelled) as excinfo:
+        _run(token, progress_callback)
+    assert isinstance(excinfo.value.partial_result, DenoisedStage)
+
+
+def test_deadline_raises_deadline_exceeded():
+    with pytest.raises(DeadlineExceeded) as excinfo:
+        _run(CancellationToken(deadline = time.monotonic() - 1))
+    assert excinfo.value.partial_result is None
+
+
+def test_deadline_passing_during_run():
+    token = CancellationToken.with_timeout(60)
+    def progress_callback(stage):
+        if stage == "simplify":
+            token.deadline = time.monotonic() - 1
+
+    with pytest.raises(DeadlineExceeded) as excinfo:
+        _run(token, progress_callback)
+    assert isinstance(excinfo.value.partial_result, SimplifiedStage)
+
+
+def test_parent_token():
+    parent = CancellationToken.with_timeout(60)
+    token = CancellationToken.with_timeout(120, parent = parent)
+    assert 0 < token.remaining() <= 60
+    assert CancellationToken().remaining() is None
+
+    parent.cancel()
+    assert token.cancelled
+    with pytest.raises(Cancelled):
+        token.check()
+    # Cancelling a token does not cancel its parent.
+    child = CancellationToken(parent = token)
+    child_of_fresh = CancellationToken(parent = CancellationToken())
+    child_of_fresh.cancel()
+    assert child.cancelled and not child_of_fresh.parent.cancelled
+
+
+def test_parent_deadline():
+    token = CancellationToken(parent = CancellationToken(deadline = time.monotonic() - 1))
+    assert not token.cancelled
+    with pytest.raises(DeadlineExceeded):
+        token.check()
@@ -0,0 +1,136 @@
+import numpy as np
+import pytest
+
+from colorbynumber import cost_estimate
+from colorbynumber.config import make_config
+from colorbynumber.cost_estimate import (
+    MAX_DEGRADE_PROBES, MIN_DEGRADE_DIM, AdmissionLimits, AdmissionRejected, CostEstimate,
+    _downscaled_sizes, admit, estimate_cost)
+from colorbynumber.pipeline import PaletteSpec
+
+PALETTE_SPEC = PaletteSpec(num_colors = 4)
+
+
+def _image(height = 800, width = 1000):
+    random_state = np.random.RandomState(0)
+    coarse = random_state.randint(0, 256, size = (8, 10, 3)).astype(np.uint8)
+    return np.kron(coarse, np.ones((height // 8, width // 10, 1), dtype = np.uint8))
+
+
+@pytest.fixture
+def fake_estimates(monkeypatch):
+    # Time and memory proportional to the pixels, islands decreasing with the
+    # opening. Records the (shape, config) of every probe.
+    calls = []
+    def fake_estimate_cost(image, palette_spec, config):
+        calls.append((image.shape, config))
+        num_pixels = image.shape[0] * image.shape[1]
+        return CostEstimate(
+            wall_time = num_pixels / 1e5,
+            peak_memory = num_pixels * 10,
+            island_count = 100 // config["open_kernel_size"],
+            component_count = 0,
+        )
+    monkeypatch.setattr(cost_estimate, "estimate_cost", fake_estimate_cost)
+    return calls
+
+
+def test_estimate_cost():
+    image = _image(400, 500)
+    estimate = estimate_cost(image, PALETTE_SPEC, make_config(denoise = False))
+    assert estimate.wall_time > 0
+    assert estimate.peak_memory >= 5 * image.size
+    assert 0 < estimate.island_count <= estimate.component_count
+
+    # Denoising, and more of it, costs more.
+    denoised = estimate_cost(image, PALETTE_SPEC, make_config(
+        denoise = True, denoise_type = "fastNlMeansDenoisingColored"))
+    assert denoised.wall_time > estimate.wall_time
+    # Larger images use more memory.
+    assert estimate_cost(_image(), PALETTE_SPEC, make_config(denoise = False)).peak_memory \
+        > estimate.peak_memory
+
+
+def test_admit_without_limits_does_not_estimate(fake_estimates):
+    image = _image()
+    admission = admit(image, PALETTE_SPEC)
+    assert admission.image is image
+    assert admission.estimate is None and admission.actions == []
+    assert fake_estimates == []
+
+
+def test_admit_within_limits(fake_estimates):
+    image = _image()
+    admission = admit(image, PALETTE_SPEC, limits = AdmissionLimits(max_wall_time = 100))
+    assert admission.image is image
+    assert admission.actions == []
+    assert admission.estimate.wall_time == 8
+    assert len(fake_estimates) == 1
+
+
+def test_admit_reject_policy(fake_estimates):
+    limits = AdmissionLimits(max_island_count = 10)
+    with pytest.raises(AdmissionRejected) as excinfo:
+        admit(_image(), PALETTE_SPEC, limits = limits, policy = "reject")
+    assert excinfo.value.estimate.island_count == 33
+    assert excinfo.value.limits == limits
+    assert len(fake_estimates) == 1
+
+
+def test_admit_degrades_settings(fake_estimates):
+    config = make_config(denoise = True, denoise_type = "fastNlMeansDenoisingColored")
+    admission = admit(_image(), PALETTE_SPEC, config, limits = AdmissionLimits(max_island_count = 20))
+    assert admission.actions == [
+        "denoise_type=gaussianBlur", "kmeans_method=palette_family", "open_kernel_size=5"]
+    assert admission.config["open_kernel_size"] == 5
+    assert admission.config["denoise_type"] == "gaussianBlur"
+    assert admission.image.shape == (800, 1000, 3)
+    assert len(fake_estimates) == 4
+
+
+def test_admit_downscales_to_extrapolated_size(fake_estimates):
+    # Settings do not change the time: the settings probes are used up, and
+    # the size is chosen by extrapolation and checked with one more probe.
+    admission = admit(_image(), PALETTE_SPEC, limits = AdmissionLimits(max_wall_time = 3))
+    assert admission.image.shape == (450, 562, 3)
+    assert admission.actions[-1] == "downscale=562x450"
+    assert len(admission.actions) == MAX_DEGRADE_PROBES
+    assert admission.estimate.wall_time <= 3
+    assert len(fake_estimates) == 1 + MAX_DEGRADE_PROBES
+    assert fake_estimates[-1][0] == (450, 562, 3)
+
+
+def test_admit_probes_are_capped(fake_estimates):
+    with pytest.raises(AdmissionRejected):
+        admit(_image(), PALETTE_SPEC, limits = AdmissionLimits(max_wall_time = 1e-9))
+    assert len(fake_estimates) == 1 + MAX_DEGRADE_PROBES
+    # The smallest size is tried last.
+    assert max(fake_estimates[-1][0][:2]) <= MIN_DEGRADE_DIM
+
+
+def test_admit_does_not_downscale_small_images(fake_estimates):
+    image = _image(300, 400)
+    with pytest.raises(AdmissionRejected):
+        admit(image, PALETTE_SPEC, limits = AdmissionLimits(max_wall_time = 1e-9))
+    assert len(fake_estimates) == 1 + MAX_DEGRADE_PROBES
+    assert all(shape == image.shape for shape, _ in fake_estimates)
+
+
+def test_downscaled_sizes():
+    sizes = _downscaled_sizes(_image())
+    assert sizes[0] == (750, 600)
+    # Downscaling stops once the image is no larger than MIN_DEGRADE_DIM.
+    assert all(max(size) > MIN_DEGRADE_DIM for size in sizes[:-1])
+    assert max(sizes[-1]) <= MIN_DEGRADE_DIM
+    assert _downscaled_sizes(_image(320, 400)) == []
+
+
+def test_admit_with_real_estimates():
+    image = _image(600, 800)
+    config = make_config(denoise = False)
+    estimate = estimate_cost(image, PALETTE_SPEC, config)
+    admission = admit(image, PALETTE_SPEC, config,
+                      limits = AdmissionLimits(max_peak_memory = estimate.peak_memory // 2))
+    assert admission.actions[-1].startswith("downscale=")
+    assert admission.estimate.peak_memory <= estimate.peak_memory // 2
+    assert max(admission.image.shape[:2]) >= int(MIN_DEGRADE_DIM * cost_estimate.DOWNSCALE_STEP)
@@ -0,0 +1,118 @@
+import cv2 as cv
+import numpy as np
+import pytest
+
+from colorbynumber.config import make_config
+from colorbynumber.gen_islands import GenerateIslands
+from colorbynumber.page_editor import PageEditor
+from colorbynumber.pipeline import PaletteSpec, run
+
+CONFIG = make_config(open_kernel_size = 3, area_perc_threshold = 0.05)
+
+
+def _labels(seed, shape = (120, 160), num_colors = 4):
+    random_state = np.random.RandomState(seed)
+    coarse = random_state.randint(1, num_colors + 1, size = (shape[0] // 10, shape[1] // 10))
+    labels = cv.resize(coarse.astype(np.uint8), shape[::-1], interpolation = cv.INTER_NEAREST)
+    # A little noise, removed by the opening.
+    noise = random_state.rand(*shape) < 0.01
+    labels[noise] = random_state.randint(1, num_colors + 1, size = noise.sum())
+    return labels
+
+
+def _islands(island_borders_list, centroid_coords_list):
+    # Islands keyed by color and border, independent of their order.
+    return sorted(
+        (color_id, tuple(rows.tolist()), tuple(cols.tolist()), tuple(np.asarray(centroid).tolist()))
+        for (color_id, (rows, cols)), centroid in zip(island_borders_list, centroid_coords_list)
+    )
+
+
+def _random_edit(random_state, shape, num_colors = 4):
+    mask = np.zeros(shape, dtype = bool)
+    top, left = random_state.randint(0, shape[0] - 10), random_state.randint(0, shape[1] - 10)
+    mask[top:top + random_state.randint(2, 40), left:left + random_state.randint(2, 40)] = True
+    return mask, random_state.randint(1, num_colors + 1)
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_update_islands_matches_full_recompute(seed):
+    labels = _labels(seed)
+    generate_islands_obj = GenerateIslands(labels.copy())
+    generate_islands_obj.get_islands(config = CONFIG)
+
+    random_state = np.random.RandomState(seed)
+    for _ in range(5):
+        region_mask, color_index = _random_edit(random_state, labels.shape)
+        labels[region_mask] = color_index
+        island_borders_list, centroid_coords_list, changed_box = \
+            generate_islands_obj.update_islands(region_mask, color_index, CONFIG)
+        assert changed_box is not None
+
+        full = GenerateIslands(labels.copy())
+        expected = full.get_islands(config = CONFIG)
+        np.testing.assert_array_equal(generate_islands_obj.indices_color_choices, labels)
+        assert _islands(island_borders_list, centroid_coords_list) == _islands(*expected)
+        np.testing.assert_array_equal(generate_islands_obj.island_map != 0, full.island_map != 0)
+        assert len(generate_islands_obj.island_ids_list) == len(island_borders_list)
+
+
+@pytest.mark.parametrize("seed", range(2))
+def test_reference_islands_match_cropped(seed):
+    labels = _labels(seed)
+    reference_config = make_config(CONFIG, crop_islands = False)
+    cropped = GenerateIslands(labels.copy())
+    reference = GenerateIslands(labels.copy())
+    assert _islands(*cropped.get_islands(config = CONFIG)) \
+        == _islands(*reference.get_islands(config = reference_config))
+    np.testing.assert_array_equal(cropped.island_map, reference.island_map)
+
+    region_mask, color_index = _random_edit(np.random.RandomState(seed), labels.shape)
+    island_borders_list, centroid_coords_list, _ = cropped.update_islands(region_mask, color_index, CONFIG)
+    expected_borders, expected_centroids, _ = reference.update_islands(
+        region_mask, color_index, reference_config)
+    assert _islands(island_borders_list, centroid_coords_list) \
+        == _islands(expected_borders, expected_centroids)
+
+
+def test_update_islands_with_empty_mask_changes_nothing():
+    generate_islands_obj = GenerateIslands(_labels(0))
+    expected = generate_islands_obj.get_islands(config = CONFIG)
+    *islands, changed_box = generate_islands_obj.update_islands(
+        np.zeros((120, 160), dtype = bool), 1, CONFIG)
+    assert changed_box is None
+    assert _islands(*islands) == _islands(*expected)
+
+
+def test_copy_is_independent():
+    generate_islands_obj = GenerateIslands(_labels(1))
+    expected = _islands(*generate_islands_obj.get_islands(config = CONFIG))
+    island_map = generate_islands_obj.island_map.copy()
+
+    other = generate_islands_obj.copy()
+    region_mask = np.zeros((120, 160), dtype = bool)
+    region_mask[30:80, 40:100] = True
+    other.update_islands(region_mask, 2, CONFIG)
+
+    assert _islands(*generate_islands_obj.islands()) == expected
+    np.testing.assert_array_equal(generate_islands_obj.island_map, island_map)
+    assert _islands(*other.islands()) != expected
+
+
+def test_page_editor_reuses_islands_of_result():
+    labels = _labels(2)
+    color_list = np.array([[255, 0, 0], [0, 255, 0], [0, 0, 255], [255, 255, 0]], dtype = np.uint8)
+    config = make_config(CONFIG, denoise = False, apply_kmeans = False)
+    result = run(color_list[labels - 1], PaletteSpec(color_list = color_list), config)
+    assert result.generate_islands_obj is not None
+
+    region_mask = np.zeros(labels.shape, dtype = bool)
+    region_mask[20:50, 30:90] = True
+    edited = PageEditor(result, config).edit(region_mask, 3)
+    recomputed = PageEditor(result._replace(generate_islands_obj = None), config).edit(region_mask, 3)
+
+    assert _islands(edited.island_borders_list, edited.centroid_coords_list) \
+        == _islands(recomputed.island_borders_list, recomputed.centroid_coords_list)
+    np.testing.assert_array_equal(edited.numbered_islands, recomputed.numbered_islands)
+    # The result given to the editor is not modified.
+    np.testing.assert_array_equal(result.indices_color_choices, labels)
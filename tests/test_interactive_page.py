@@ -0,0 +1,86 @@
+import io
+
+import cv2 as cv
+import numpy as np
+import pytest
+
+from colorbynumber.config import make_config
+from colorbynumber.gen_islands import GenerateIslands
+from colorbynumber.interactive_page import InteractivePage, island_id_map, write_interactive_page
+from colorbynumber.page_editor import PageEditor
+from colorbynumber.pipeline import PaletteSpec, run
+
+CONFIG = make_config(open_kernel_size = 3, area_perc_threshold = 0.05, denoise = False,
+                     apply_kmeans = False)
+COLOR_LIST = np.array([[255, 0, 0], [0, 255, 0], [0, 0, 255], [255, 255, 0]], dtype = np.uint8)
+
+
+@pytest.fixture
+def result():
+    random_state = np.random.RandomState(0)
+    coarse = random_state.randint(1, len(COLOR_LIST) + 1, size = (12, 16))
+    labels = cv.resize(coarse.astype(np.uint8), (160, 120), interpolation = cv.INTER_NEAREST)
+    return run(COLOR_LIST[labels - 1], PaletteSpec(color_list = COLOR_LIST), CONFIG)
+
+
+def _write_and_read(result):
+    buffer = io.BytesIO()
+    write_interactive_page(result, buffer, CONFIG)
+    buffer.seek(0)
+    return InteractivePage.read(buffer)
+
+
+def _no_recompute(monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("get_islands called again")
+    monkeypatch.setattr(GenerateIslands, "get_islands", fail)
+
+
+def test_round_trip(result, monkeypatch):
+    _no_recompute(monkeypatch)
+    page = _write_and_read(result)
+
+    np.testing.assert_array_equal(
+        page.id_map, island_id_map(result.generate_islands_obj, CONFIG["border_padding"]))
+    np.testing.assert_array_equal(page.color_list, COLOR_LIST)
+    assert len(page.islands) == len(result.island_borders_list)
+    assert page.islands["color_id"].tolist() == [color_id for color_id, _ in result.island_borders_list]
+    assert page.islands["area"].sum() == (page.id_map != 0).sum()
+
+    for island, (color_id, (rows, cols)) in enumerate(result.island_borders_list, start = 1):
+        # Every border pixel is part of its island.
+        assert page.hit_test(cols[0], rows[0]) == island
+        record = page.islands[island - 1]
+        assert record["left"] <= cols.min() and cols.max() < record["right"]
+        assert record["top"] <= rows.min() and rows.max() < record["bottom"]
+
+    assert page.hit_test(-1, 0) == 0
+    assert page.hit_test(page.id_map.shape[1], 0) == 0
+
+
+def test_fill(result):
+    page = _write_and_read(result)
+    island = page.hit_test(80, 60)
+    image = np.zeros(page.id_map.shape + (3,), dtype = np.uint8)
+    page.fill(image, island)
+
+    filled = (image != 0).any(axis = 2)
+    np.testing.assert_array_equal(filled, page.id_map == island)
+    color_id = page.islands[island - 1]["color_id"]
+    assert (image[filled] == COLOR_LIST[color_id - 1]).all()
+
+
+def test_edited_page_reuses_islands(result, monkeypatch):
+    region_mask = np.zeros(result.indices_color_choices.shape, dtype = bool)
+    region_mask[20:50, 30:90] = True
+    edited = PageEditor(result, CONFIG).edit(region_mask, 3)
+
+    _no_recompute(monkeypatch)
+    page = _write_and_read(edited)
+    assert len(page.islands) == len(edited.island_borders_list)
+    np.testing.assert_array_equal(
+        page.id_map, island_id_map(edited.generate_islands_obj, CONFIG["border_padding"]))
+    # Away from its edges, the edited region is one island of the new color.
+    inside = page.id_map[25:45, 35:85]
+    assert len(np.unique(inside)) == 1
+    assert page.islands[inside[0, 0] - 1]["color_id"] == 3
@@ -0,0 +1,273 @@
+import base64
+import http.client
+import json
+import threading
+import time
+from http.server import ThreadingHTTPServer
+
+import cv2 as cv
+import numpy as np
+import pytest
+
+from colorbynumber import cost_estimate
+from colorbynumber.cost_estimate import MAX_DEGRADE_PROBES, MIN_DEGRADE_DIM, AdmissionLimits
+from job_server import jobs
+from job_server.http_handler import make_handler
+from job_server.jobs import OUTPUTS, JobManager, QueueFull
+from job_server.result_store import ResultStore
+
+COLOR_LIST = [[255, 0, 0], [0, 255, 0], [0, 0, 255], [255, 255, 0]]
+CONFIG = {"denoise": False, "apply_kmeans": False, "area_perc_threshold": 0.05}
+
+
+def _image_bytes(seed = 0):
+    random_state = np.random.RandomState(seed)
+    coarse = random_state.randint(0, len(COLOR_LIST), size = (6, 8))
+    labels = cv.resize(coarse.astype(np.uint8), (160, 120), interpolation = cv.INTER_NEAREST)
+    image = np.array(COLOR_LIST, dtype = np.uint8)[labels]
+    return cv.imencode(".png", image)[1].tobytes()
+
+
+def _wait(job_manager, job_id, timeout = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        record = job_manager.status(job_id)
+        if record["status"] not in ("queued", "running"):
+            return record
+        time.sleep(0.01)
+    raise AssertionError(f"Job {job_id} did not finish: {record}")
+
+
+@pytest.fixture
+def make_job_manager(tmp_path):
+    job_managers = []
+    def make(**kwargs):
+        job_manager = JobManager(ResultStore(str(tmp_path / "jobs")), **kwargs)
+        job_managers.append(job_manager)
+        return job_manager
+    yield make
+    for job_manager in job_managers:
+        job_manager.shutdown()
+
+
+def test_rejected_job(make_job_manager):
+    job_manager = make_job_manager(
+        admission_limits = AdmissionLimits(max_island_count = 0), admission_policy = "reject")
+    job_id = job_manager.submit(_image_bytes(), color_list = COLOR_LIST, config_overrides = CONFIG)
+    record = _wait(job_manager, job_id)
+    assert record["status"] == "rejected"
+    assert record["estimate"]["island_count"] > 0
+    assert "exceeds limits" in record["error"]
+    assert job_manager.iter_output(job_id, "numbered_islands.png") is None
+
+
+def test_degraded_job_rejected_after_probes(make_job_manager, monkeypatch):
+    calls = []
+    estimate_cost = cost_estimate.estimate_cost
+    def counting_estimate_cost(*args, **kwargs):
+        calls.append(args[0].shape)
+        return estimate_cost(*args, **kwargs)
+    monkeypatch.setattr(cost_estimate, "estimate_cost", counting_estimate_cost)
+
+    job_manager = make_job_manager(admission_limits = AdmissionLimits(max_wall_time = 1e-9))
+    job_id = job_manager.submit(_image_bytes(), color_list = COLOR_LIST, config_overrides = CONFIG)
+    assert _wait(job_manager, job_id)["status"] == "rejected"
+    # load_image resizes the image to 1000 pixels wide; the last probe is
+    # the smallest size, no larger than MIN_DEGRADE_DIM.
+    assert len(calls) == 1 + MAX_DEGRADE_PROBES
+    assert calls[0] == (750, 1000, 3)
+    assert max(calls[-1][:2]) <= MIN_DEGRADE_DIM
+
+
+def test_job_within_limits(make_job_manager):
+    job_manager = make_job_manager(admission_limits = AdmissionLimits(max_island_count = 10**6))
+    job_id = job_manager.submit(_image_bytes(), color_list = COLOR_LIST, config_overrides = CONFIG)
+    record = _wait(job_manager, job_id)
+    assert record["status"] == "done"
+    assert record["admission_actions"] == []
+    assert record["estimate"]["island_count"] > 0
+
+
+def test_timed_out_job(make_job_manager):
+    job_manager = make_job_manager(job_timeout = 1e-6)
+    job_id = job_manager.submit(_image_bytes(), color_list = COLOR_LIST, config_overrides = CONFIG)
+    record = _wait(job_manager, job_id)
+    assert record["status"] == "timed_out"
+    assert record["error"] == "Stopped after 1e-06 seconds"
+
+
+@pytest.fixture
+def blocked_runs(monkeypatch):
+    # Replaces the pipeline with one waiting, while checking its token, until
+    # the returned event is set.
+    started = threading.Semaphore(0)
+    release = threading.Event()
+    run = jobs.run
+    def blocked_run(*args, cancellation_token = None, **kwargs):
+        started.release()
+        while not release.wait(0.01):
+            cancellation_token.check()
+        return run(*args, cancellation_token = cancellation_token, **kwargs)
+    monkeypatch.setattr(jobs, "run", blocked_run)
+    yield started, release
+    release.set()
+
+
+def test_job_outputs(make_job_manager):
+    job_manager = make_job_manager()
+    job_id = job_manager.submit(_image_bytes(), color_list = COLOR_LIST, config_overrides = CONFIG)
+    record = _wait(job_manager, job_id)
+    assert record["status"] == "done"
+    assert record["progress"] == 1.0 and record["error"] is None
+
+    outputs = {name: b"".join(job_manager.iter_output(job_id, name)) for name in OUTPUTS}
+    images = {name: cv.imdecode(np.frombuffer(data, dtype = np.uint8), cv.IMREAD_UNCHANGED)
+              for name, data in outputs.items() if name.endswith(".png")}
+    assert all(image is not None for image in images.values())
+    assert images["simplified_image.png"].shape[:2] == (750, 1000)
+    islands = json.loads(outputs["islands.json"])
+    assert islands["image_shape"][:2] == list(images["numbered_islands.png"].shape[:2])
+    assert islands["color_list"] == COLOR_LIST
+    assert len(islands["islands"]) > 0
+    assert {island["color_id"] for island in islands["islands"]} <= {1, 2, 3, 4}
+    assert job_manager.iter_output(job_id, "input.png") is None
+
+
+def test_queue_full(make_job_manager, blocked_runs):
+    started, release = blocked_runs
+    job_manager = make_job_manager(max_workers = 1, max_pending = 1)
+    job_id = job_manager.submit(_image_bytes(), num_colors = 3, config_overrides = CONFIG)
+    with pytest.raises(QueueFull):
+        job_manager.submit(_image_bytes(), num_colors = 3, config_overrides = CONFIG)
+
+    release.set()
+    assert _wait(job_manager, job_id)["status"] == "done"
+    # The slot is free again.
+    other_id = job_manager.submit(_image_bytes(), num_colors = 3, config_overrides = CONFIG)
+    assert _wait(job_manager, other_id)["status"] == "done"
+
+
+@pytest.mark.parametrize("kwargs", [
+    {"color_list": COLOR_LIST, "config_overrides": {"denoise": False, "not_a_parameter": 1}},
+    {"color_list": COLOR_LIST, "config_overrides": [["denoise", False]]},
+    {},
+])
+def test_invalid_requests(make_job_manager, tmp_path, kwargs):
+    job_manager = make_job_manager()
+    with pytest.raises(ValueError):
+        job_manager.submit(_image_bytes(), **kwargs)
+    # Nothing is kept of rejected requests.
+    assert list((tmp_path / "jobs").iterdir()) == []
+
+
+def test_cancel_queued_job(make_job_manager, blocked_runs):
+    started, release = blocked_runs
+    job_manager = make_job_manager(max_workers = 1)
+    running_id = job_manager.submit(_image_bytes(), num_colors = 3, config_overrides = CONFIG)
+    queued_id = job_manager.submit(_image_bytes(), num_colors = 3, config_overrides = CONFIG)
+    assert started.acquire(timeout = 30)
+
+    record = job_manager.cancel(queued_id)
+    assert record["status"] == "cancelled"
+    release.set()
+    assert _wait(job_manager, running_id)["status"] == "done"
+    # The cancelled job never started.
+    assert not started.acquire(timeout = 0.1)
+    assert job_manager.status(queued_id)["status"] == "cancelled"
+
+
+def test_cancel_running_job(make_job_manager, blocked_runs):
+    started, release = blocked_runs
+    job_manager = make_job_manager()
+    job_id = job_manager.submit(_image_bytes(), num_colors = 3, config_overrides = CONFIG)
+    assert started.acquire(timeout = 30)
+    assert job_manager.status(job_id)["status"] == "running"
+
+    job_manager.cancel(job_id)
+    record = _wait(job_manager, job_id)
+    assert record["status"] == "cancelled"
+    assert record["error"] == "Cancelled"
+    assert job_manager.iter_output(job_id, "legend.png") is None
+
+    # Cancelling a finished job deletes it.
+    assert job_manager.cancel(job_id) is None
+    assert job_manager.status(job_id) is None
+
+
+def test_delete_expired_keeps_active_jobs(make_job_manager, blocked_runs):
+    started, release = blocked_runs
+    job_manager = make_job_manager(max_workers = 1)
+    done_id = job_manager.submit(_image_bytes(), num_colors = 3, config_overrides = CONFIG)
+    assert started.acquire(timeout = 30)
+    release.set()
+    assert _wait(job_manager, done_id)["status"] == "done"
+
+    release.clear()
+    running_id = job_manager.submit(_image_bytes(), num_colors = 3, config_overrides = CONFIG)
+    queued_id = job_manager.submit(_image_bytes(), num_colors = 3, config_overrides = CONFIG)
+    assert started.acquire(timeout = 30)
+    # Every job is now older than the TTL.
+    job_manager.result_store.ttl_seconds = 0
+    time.sleep(0.01)
+
+    assert job_manager.delete_expired() == [done_id]
+    assert job_manager.status(done_id) is None
+    assert job_manager.status(running_id)["status"] == "running"
+    assert job_manager.status(queued_id)["status"] == "queued"
+
+    release.set()
+    assert _wait(job_manager, running_id)["status"] == "done"
+    assert _wait(job_manager, queued_id)["status"] == "done"
+
+
+@pytest.fixture
+def http_connection(make_job_manager):
+    job_manager = make_job_manager()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(job_manager))
+    thread = threading.Thread(target = server.serve_forever, daemon = True)
+    thread.start()
+    def connect():
+        return http.client.HTTPConnection("127.0.0.1", server.server_address[1], timeout = 30)
+    yield job_manager, connect
+    server.shutdown()
+    server.server_close()
+
+
+def _request(connect, method, path, payload = None):
+    connection = connect()
+    body = None if payload is None else json.dumps(payload)
+    connection.request(method, path, body = body)
+    response = connection.getresponse()
+    data = response.read()
+    connection.close()
+    return response.status, data
+
+
+def test_http_jobs(http_connection):
+    job_manager, connect = http_connection
+    image = base64.b64encode(_image_bytes()).decode()
+
+    status, data = _request(connect, "POST", "/jobs", {
+        "image": image, "color_list": COLOR_LIST, "config": {"bad_key": 1}})
+    assert status == 400
+    assert json.loads(data)["error"] == "Unknown config parameters: bad_key"
+    status, _ = _request(connect, "POST", "/jobs", {"image": "not base64!"})
+    assert status == 400
+
+    status, data = _request(connect, "POST", "/jobs", {
+        "image": image, "color_list": COLOR_LIST, "config": CONFIG})
+    assert status == 202
+    job_id = json.loads(data)["job_id"]
+    _wait(job_manager, job_id)
+
+    status, data = _request(connect, "GET", f"/jobs/{job_id}")
+    assert status == 200 and json.loads(data)["status"] == "done"
+    status, data = _request(connect, "GET", f"/jobs/{job_id}/outputs/legend.png")
+    assert status == 200 and data.startswith(b"\x89PNG")
+    status, _ = _request(connect, "GET", f"/jobs/{job_id}/outputs/input.png")
+    assert status == 404
+
+    status, data = _request(connect, "DELETE", f"/jobs/{job_id}")
+    assert status == 200 and json.loads(data)["status"] == "deleted"
+    status, _ = _request(connect, "GET", f"/jobs/{job_id}")
+    assert status == 404
@@ -0,0 +1,179 @@
+import itertools
+
+import cv2 as cv
+import numpy as np
+import pytest
+
+from colorbynumber.config import make_config
+from colorbynumber.gen_islands import GenerateIslands
+from colorbynumber.number_placement import (
+    _BoxGrid, _inside_island, _text_box, draw_numbers, place_numbers)
+from colorbynumber.page_editor import PageEditor
+from colorbynumber.pipeline import PaletteSpec, run
+
+CONFIG = make_config(
+    denoise = False,
+    apply_kmeans = False,
+    open_kernel_size = 1,
+    area_perc_threshold = 0.001,
+    check_shape_validity = False,
+    number_placement = "collision_aware",
+    font_size = 0.4,
+)
+NUM_COLORS = 12
+COLOR_LIST = np.array([(20 * i, 255 - 20 * i, (70 * i) % 256) for i in range(NUM_COLORS)],
+                      dtype = np.uint8)
+
+
+def _dense_labels(seed = 0, shape = (160, 200), block = 12):
+    # Small blocks of random colors: many islands too small for their number.
+    random_state = np.random.RandomState(seed)
+    coarse = random_state.randint(1, NUM_COLORS + 1, size = (shape[0] // block, shape[1] // block))
+    return cv.resize(coarse.astype(np.uint8), shape[::-1], interpolation = cv.INTER_NEAREST)
+
+
+def _islands(labels, config = CONFIG):
+    generate_islands_obj = GenerateIslands(labels)
+    island_borders_list, centroid_coords_list = generate_islands_obj.get_islands(config = config)
+    return generate_islands_obj, island_borders_list, centroid_coords_list
+
+
+def _placed_boxes(color_ids, placement, config = CONFIG):
+    return [
+        _text_box(str(color_ids[idx]), position, placement.font_sizes[idx], config["font_thickness"])
+        for idx, position in enumerate(placement.positions)
+        if not np.isnan(position).any()
+    ]
+
+
+def _check_placement(generate_islands_obj, color_ids, centroid_coords_list, placement,
+                     config = CONFIG):
+    # Placed numbers do not overlap.
+    boxes = _placed_boxes(color_ids, placement, config)
+    for box_a, box_b in itertools.combinations(boxes, 2):
+        assert not (box_a[0] < box_b[2] and box_b[0] < box_a[2]
+                    and box_a[1] < box_b[3] and box_b[1] < box_a[3]), (box_a, box_b)
+
+    inside = 0
+    for idx, position in enumerate(placement.positions):
+        if idx in placement.dropped:
+            assert np.isnan(position).all()
+            continue
+        assert not np.isnan(position).any()
+        assert config["min_font_scale"] * config["font_size"] <= placement.font_sizes[idx] \
+            <= config["font_size"]
+        box = _text_box(str(color_ids[idx]), position, placement.font_sizes[idx],
+                        config["font_thickness"])
+        if _inside_island(generate_islands_obj.island_map,
+                          generate_islands_obj.island_ids_list[idx], box):
+            inside += 1
+        else:
+            # Numbers that fit nowhere inside are only kept at the centroid.
+            assert list(position) == [int(c) for c in centroid_coords_list[idx]]
+    return inside
+
+
+def test_dense_page():
+    generate_islands_obj, island_borders_list, centroid_coords_list = _islands(_dense_labels())
+    color_ids = [color_id for color_id, _ in island_borders_list]
+    placement = place_numbers(
+        island_map = generate_islands_obj.island_map,
+        island_ids = generate_islands_obj.island_ids_list,
+        color_ids = color_ids,
+        centroid_coords_list = centroid_coords_list,
+        config = CONFIG,
+    )
+
+    assert len(placement.positions) == len(placement.font_sizes) == len(island_borders_list)
+    inside = _check_placement(generate_islands_obj, color_ids, centroid_coords_list, placement)
+    # The page is crowded: some numbers are moved or shrunk, others dropped.
+    assert inside > 0
+    assert len(placement.dropped) > 0
+    assert any(size < CONFIG["font_size"] for size in placement.font_sizes)
+    assert placement.dropped == sorted(placement.dropped)
+
+
+def test_roomy_page_keeps_numbers_at_centroids():
+    labels = np.ones((200, 300), dtype = np.uint8)
+    labels[:, 100:200] = 2
+    labels[:, 200:] = 3
+    generate_islands_obj, island_borders_list, centroid_coords_list = _islands(labels)
+    color_ids = [color_id for color_id, _ in island_borders_list]
+    placement = place_numbers(generate_islands_obj.island_map, generate_islands_obj.island_ids_list,
+                              color_ids, centroid_coords_list, CONFIG)
+
+    assert placement.dropped == []
+    assert placement.font_sizes == [CONFIG["font_size"]] * 3
+    for position, centroid in zip(placement.positions, centroid_coords_list):
+        assert list(position) == [int(c) for c in centroid]
+    assert _check_placement(generate_islands_obj, color_ids, centroid_coords_list, placement) == 3
+
+
+def test_islands_without_number_are_dropped():
+    generate_islands_obj, island_borders_list, centroid_coords_list = _islands(_dense_labels(1))
+    centroid_coords_list = list(centroid_coords_list)
+    centroid_coords_list[0] = np.array([np.nan, np.nan])
+    placement = place_numbers(generate_islands_obj.island_map, generate_islands_obj.island_ids_list,
+                              [color_id for color_id, _ in island_borders_list],
+                              centroid_coords_list, CONFIG)
+    assert 0 in placement.dropped
+    assert np.isnan(placement.positions[0]).all()
+
+
+def test_box_grid():
+    grid = _BoxGrid(cell_size = 10)
+    grid.add((5, 5, 25, 15))
+    assert grid.overlaps((24, 14, 30, 30))
+    # Boxes are end exclusive: touching boxes do not overlap.
+    assert not grid.overlaps((25, 5, 35, 15))
+    assert not grid.overlaps((5, 15, 25, 20))
+    assert not grid.overlaps((100, 100, 110, 110))
+
+
+def test_pipeline_reports_dropped_numbers():
+    labels = _dense_labels(2)
+    result = run(COLOR_LIST[labels - 1], PaletteSpec(color_list = COLOR_LIST), CONFIG)
+    generate_islands_obj = result.generate_islands_obj
+    color_ids = [color_id for color_id, _ in result.island_borders_list]
+    _, centroid_coords_list = generate_islands_obj.islands()
+
+    _, placement = draw_numbers(result.islands_image, result.island_borders_list,
+                                centroid_coords_list, generate_islands_obj, CONFIG)
+    assert list(result.dropped_numbers) == placement.dropped
+    assert result.number_font_sizes == placement.font_sizes
+    _check_placement(generate_islands_obj, color_ids, centroid_coords_list,
+                     placement._replace(positions = result.centroid_coords_list))
+    assert len(result.dropped_numbers) > 0
+
+
+def test_centroid_placement_has_no_placement():
+    labels = _dense_labels(2)
+    result = run(COLOR_LIST[labels - 1], PaletteSpec(color_list = COLOR_LIST),
+                 make_config(CONFIG, number_placement = "centroid"))
+    assert result.number_font_sizes is None
+    assert tuple(result.dropped_numbers) == ()
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_page_editor_places_numbers_again(seed):
+    labels = _dense_labels(seed)
+    result = run(COLOR_LIST[labels - 1], PaletteSpec(color_list = COLOR_LIST), CONFIG)
+
+    random_state = np.random.RandomState(seed)
+    editor = PageEditor(result, CONFIG)
+    for _ in range(3):
+        region_mask = np.zeros(labels.shape, dtype = bool)
+        top, left = random_state.randint(0, 120), random_state.randint(0, 160)
+        region_mask[top:top + 40, left:left + 40] = True
+        edited = editor.edit(region_mask, random_state.randint(1, NUM_COLORS + 1))
+
+    generate_islands_obj = edited.generate_islands_obj
+    color_ids = [color_id for color_id, _ in edited.island_borders_list]
+    _, centroid_coords_list = generate_islands_obj.islands()
+    placement = place_numbers(generate_islands_obj.island_map, generate_islands_obj.island_ids_list,
+                              color_ids, centroid_coords_list, CONFIG)
+    assert len(edited.centroid_coords_list) == len(placement.positions)
+    assert all(np.array_equal(np.asarray(a, dtype = float), np.asarray(b, dtype = float), equal_nan = True)
+               for a, b in zip(edited.centroid_coords_list, placement.positions))
+    assert list(edited.dropped_numbers) == placement.dropped
+    _check_placement(generate_islands_obj, color_ids, centroid_coords_list, placement)
@@ -0,0 +1,177 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pytest
+
+from colorbynumber import palette_family as palette_family_module
+from colorbynumber.palette_family import (
+    PaletteFamily, color_histogram, get_palette_family, weighted_kmeans)
+
+BLOB_CENTERS = np.array([[30, 40, 200], [220, 60, 50], [90, 200, 90]], dtype = np.float64)
+
+
+def _blobs(seed = 0, size = 300):
+    random_state = np.random.RandomState(seed)
+    points = np.concatenate([random_state.normal(center, 5, (size, 3)) for center in BLOB_CENTERS])
+    return points, random_state.uniform(0.5, 2, len(points))
+
+
+def _image(seed = 0, shape = (60, 80)):
+    random_state = np.random.RandomState(seed)
+    labels = random_state.randint(0, len(BLOB_CENTERS), size = shape)
+    image = BLOB_CENTERS[labels] + random_state.normal(0, 12, shape + (3,))
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+
+def _weighted_error(points, weights, centers):
+    distances = ((points[:, None, :] - centers[None, :, :])**2).sum(axis = -1)
+    return (distances.min(axis = 1) * weights).sum()
+
+
+@pytest.fixture
+def empty_cache(monkeypatch):
+    monkeypatch.setattr(palette_family_module, "_palette_family_cache", OrderedDict())
+
+
+def test_weighted_kmeans_converges_to_weighted_means():
+    points, weights = _blobs()
+    start = BLOB_CENTERS + np.array([25, -20, 15])
+    centers, labels = weighted_kmeans(points, weights, start, iterations = 50)
+
+    np.testing.assert_array_equal(labels, np.repeat(np.arange(3), 300))
+    for cluster in range(3):
+        members = labels == cluster
+        np.testing.assert_allclose(
+            centers[cluster], np.average(points[members], axis = 0, weights = weights[members]),
+            atol = 0.5)
+    # The result is a fixed point.
+    again, again_labels = weighted_kmeans(points, weights, centers)
+    np.testing.assert_allclose(again, centers, atol = 0.5)
+    np.testing.assert_array_equal(again_labels, labels)
+
+
+def test_weighted_kmeans_weights_count_as_repeated_points():
+    points, _ = _blobs(1, size = 50)
+    weights = np.random.RandomState(1).randint(1, 4, len(points))
+    start = points[[0, 60, 120]]
+    weighted, _ = weighted_kmeans(points, weights.astype(np.float64), start)
+    repeated, _ = weighted_kmeans(np.repeat(points, weights, axis = 0),
+                                  np.ones(weights.sum()), start)
+    np.testing.assert_allclose(weighted, repeated)
+
+
+def test_weighted_kmeans_does_not_modify_centers():
+    points, weights = _blobs()
+    start = BLOB_CENTERS.copy()
+    weighted_kmeans(points, weights, start)
+    np.testing.assert_array_equal(start, BLOB_CENTERS)
+
+
+def test_get_palette_is_deterministic():
+    image = _image()
+    family = PaletteFamily(image)
+    other = PaletteFamily(image.copy())
+    # Asked in another order: the palettes do not depend on it.
+    expected = {num_colors: family.get_palette(num_colors) for num_colors in range(1, 9)}
+    for num_colors in (8, 3, 5, 1):
+        np.testing.assert_array_equal(other.get_palette(num_colors), expected[num_colors])
+    np.testing.assert_array_equal(family.get_palette(4), expected[4])
+
+
+def test_palettes_refine_as_colors_are_added():
+    image = _image()
+    family = PaletteFamily(image)
+    errors = []
+    for num_colors in range(1, 9):
+        palette = family.get_palette(num_colors)
+        assert palette.shape == (num_colors, 3) and palette.dtype == np.uint8
+        # Every palette is the refined split of the previous one.
+        assert len(family.palettes) >= num_colors
+        errors.append(_weighted_error(family.colors, family.weights, family.palettes[num_colors - 1]))
+    assert all(later <= earlier + 1e-6 for earlier, later in zip(errors, errors[1:]))
+
+    # Three colors find the three blobs.
+    palette = family.get_palette(3).astype(np.float64)
+    distances = np.sqrt(((palette[:, None, :] - BLOB_CENTERS[None, :, :])**2).sum(axis = -1))
+    assert distances.min(axis = 0).max() < 5
+
+
+def test_palette_size_is_limited_by_distinct_colors():
+    image = np.zeros((20, 20, 3), dtype = np.uint8)
+    image[:, 10:] = (200, 100, 0)
+    family = PaletteFamily(image)
+    assert family.max_num_colors == 2
+    palette = family.get_palette(10)
+    assert sorted(map(tuple, palette.tolist())) == [(0, 0, 0), (200, 100, 0)]
+
+
+def test_simplify_and_match():
+    image = _image()
+    family = PaletteFamily(image)
+    simplified_image, indices_color_choices, color_list = family.simplify(3)
+    assert indices_color_choices.shape == image.shape[:2]
+    np.testing.assert_array_equal(simplified_image, color_list[indices_color_choices - 1])
+
+    # Every bin gets its closest palette color.
+    colors, _, pixel_bins = color_histogram(image)
+    distances = ((colors[:, None, :] - color_list[None, :, :].astype(np.float64))**2).sum(axis = -1)
+    np.testing.assert_array_equal(indices_color_choices, distances.argmin(axis = 1)[pixel_bins] + 1)
+
+    matched_image, matched_indices = family.match(color_list[::-1], num_clusters = 3)
+    np.testing.assert_array_equal(matched_indices, 4 - indices_color_choices)
+    np.testing.assert_array_equal(matched_image, simplified_image)
+
+
+def test_cache_reuses_families(empty_cache):
+    image = _image()
+    family = get_palette_family(image)
+    assert get_palette_family(image.copy()) is family
+    assert get_palette_family(image, superpixel_size = 12) is not family
+    # Same pixels, other shape.
+    assert get_palette_family(image.reshape((80, 60, 3))) is not family
+
+
+def test_cache_evicts_least_recently_used(empty_cache, monkeypatch):
+    monkeypatch.setattr(palette_family_module, "CACHE_SIZE", 2)
+    images = [_image(seed, shape = (20, 20)) for seed in range(3)]
+    first = get_palette_family(images[0])
+    second = get_palette_family(images[1])
+    # Using the first family makes the second one the oldest.
+    assert get_palette_family(images[0]) is first
+    get_palette_family(images[2])
+
+    assert len(palette_family_module._palette_family_cache) == 2
+    assert get_palette_family(images[0]) is first
+    assert get_palette_family(images[1]) is not second
+
+
+def test_cache_is_thread_safe(empty_cache):
+    images = [_image(seed, shape = (30, 40)) for seed in range(3)]
+    expected = {(seed, num_colors): PaletteFamily(images[seed]).get_palette(num_colors)
+                for seed in range(3) for num_colors in (2, 5, 8)}
+
+    results = []
+    errors = []
+    barrier = threading.Barrier(12)
+    def worker(index):
+        try:
+            barrier.wait()
+            seed, num_colors = index % 3, (2, 5, 8)[index // 4 % 3]
+            for num_colors in (num_colors, 8, 2):
+                palette = get_palette_family(images[seed]).get_palette(num_colors)
+                results.append(((seed, num_colors), palette))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target = worker, args = (index,)) for index in range(12)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert len(results) == 36
+    for key, palette in results:
+        np.testing.assert_array_equal(palette, expected[key])
+    assert len(palette_family_module._palette_family_cache) == 3
@@ -0,0 +1,68 @@
+import io
+import struct
+
+import cv2 as cv
+import numpy as np
+import pytest
+
+from colorbynumber.png_encoding import PNG_SIGNATURE, encode_png, iter_png, write_png
+
+
+def _decode(data):
+    image = cv.imdecode(np.frombuffer(data, dtype = np.uint8), cv.IMREAD_COLOR)
+    return cv.cvtColor(image, cv.COLOR_BGR2RGB)
+
+
+def _header(data):
+    # IHDR is the first chunk: width, height, bit depth and color type.
+    assert data[:8] == PNG_SIGNATURE
+    assert data[12:16] == b"IHDR"
+    return struct.unpack(">IIBB", data[16:26])
+
+
+def _image_with_colors(num_colors, shape = (37, 53)):
+    random_state = np.random.RandomState(num_colors)
+    palette = random_state.randint(0, 256, size = (num_colors, 3)).astype(np.uint8)
+    indices = random_state.randint(0, num_colors, size = shape)
+    # Every color appears at least once.
+    indices.ravel()[:num_colors] = np.arange(num_colors)
+    return palette[indices]
+
+
+@pytest.mark.parametrize("num_colors, bit_depth", [(2, 1), (3, 2), (16, 4), (200, 8)])
+def test_palettized_round_trip(num_colors, bit_depth):
+    image = _image_with_colors(num_colors)
+    data = encode_png(image)
+    assert _header(data) == (image.shape[1], image.shape[0], bit_depth, 3)
+    np.testing.assert_array_equal(_decode(data), image)
+
+
+def test_rgb_round_trip_with_many_colors():
+    image = np.random.RandomState(0).randint(0, 256, size = (40, 70, 3)).astype(np.uint8)
+    data = encode_png(image)
+    assert _header(data) == (70, 40, 8, 2)
+    np.testing.assert_array_equal(_decode(data), image)
+
+
+def test_rgb_round_trip_when_not_palettized():
+    image = _image_with_colors(4)
+    data = encode_png(image, palettized = False)
+    assert _header(data)[2:] == (8, 2)
+    np.testing.assert_array_equal(_decode(data), image)
+
+
+def test_grayscale_round_trip():
+    image = np.tile(np.arange(0, 250, 10, dtype = np.uint8), (9, 1))
+    np.testing.assert_array_equal(_decode(encode_png(image)), np.repeat(image[:, :, None], 3, axis = 2))
+
+
+@pytest.mark.parametrize("compression_level", [0, 9])
+def test_streamed_chunks_match_encoded_bytes(compression_level):
+    # Tall enough for several row batches and IDAT chunks.
+    image = np.random.RandomState(1).randint(0, 256, size = (300, 400, 3)).astype(np.uint8)
+    chunks = list(iter_png(image, compression_level = compression_level))
+    assert len(chunks) > 4
+    fileobj = io.BytesIO()
+    write_png(image, fileobj, compression_level = compression_level)
+    assert fileobj.getvalue() == b"".join(chunks) == encode_png(image, compression_level = compression_level)
+    np.testing.assert_array_equal(_decode(fileobj.getvalue()), image)
@@ -0,0 +1,140 @@
+import json
+import threading
+
+import cv2 as cv
+import numpy as np
+import pytest
+
+from colorbynumber import shadow
+from colorbynumber.config import make_config
+from colorbynumber.pipeline import PaletteSpec, run
+from colorbynumber.shadow import REFERENCE_OVERRIDES, ShadowMode, compare_results
+
+COLOR_LIST = np.array([[255, 0, 0], [0, 255, 0], [0, 0, 255], [255, 255, 0]], dtype = np.uint8)
+CONFIG = make_config(denoise = False, apply_kmeans = False, area_perc_threshold = 0.05)
+
+
+def _image(seed = 0):
+    random_state = np.random.RandomState(seed)
+    coarse = random_state.randint(0, len(COLOR_LIST), size = (12, 16))
+    labels = cv.resize(coarse.astype(np.uint8), (160, 120), interpolation = cv.INTER_NEAREST)
+    return COLOR_LIST[labels]
+
+
+def _run(image, config = CONFIG):
+    return run(image, PaletteSpec(color_list = COLOR_LIST), config)
+
+
+def test_compare_result_with_itself():
+    result = _run(_image())
+    metrics = compare_results(result, result)
+    assert metrics["label_agreement"] == 1.0
+    assert metrics["border_iou"] == metrics["border_iou_1px"] == 1.0
+    assert metrics["island_count"] == metrics["reference_island_count"] == len(result.island_borders_list)
+    assert metrics["centroid_distance_mean"] == metrics["centroid_distance_max"] == 0.0
+    assert metrics["unmatched_islands"] == 0
+
+
+def test_compare_perturbed_result():
+    image = _image()
+    reference = _run(image)
+    perturbed_image = image.copy()
+    perturbed_image[30:70, 40:100] = COLOR_LIST[3]
+    result = _run(perturbed_image)
+
+    metrics = compare_results(result, reference)
+    changed = (result.indices_color_choices != reference.indices_color_choices).mean()
+    assert metrics["label_agreement"] == pytest.approx(1 - changed)
+    assert metrics["label_agreement"] < 1.0
+    assert metrics["border_iou"] < 1.0
+    assert metrics["border_iou"] <= metrics["border_iou_1px"]
+    assert metrics["centroid_distance_max"] > 0
+
+
+def test_compare_results_matches_palettes():
+    image = _image()
+    reference = _run(image)
+    # The same page with the palette in another order.
+    order = [2, 0, 3, 1]
+    result = run(image, PaletteSpec(color_list = COLOR_LIST[order]), CONFIG)
+    metrics = compare_results(result, reference)
+    assert metrics["label_agreement"] == 1.0
+    assert metrics["border_iou"] == 1.0
+
+
+def _record(shadow_mode, config):
+    image = _image()
+    result = _run(image, config)
+    shadow_mode.record(image, PaletteSpec(color_list = COLOR_LIST), config, result, 0.5)
+
+
+def _entries(log_path):
+    with open(log_path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_shadow_mode_log(tmp_path):
+    log_path = tmp_path / "shadow.jsonl"
+    shadow_mode = ShadowMode(str(log_path), sample_rate = 1, background = False, seed = 0)
+    assert all(shadow_mode.should_sample() for _ in range(10))
+
+    config = make_config(CONFIG, number_placement = "collision_aware")
+    _record(shadow_mode, config)
+    # The reference itself is not compared.
+    _record(shadow_mode, make_config(config, **REFERENCE_OVERRIDES))
+    shadow_mode.close()
+
+    entry, = _entries(log_path)
+    assert entry["engine"] == {key: config[key] for key in REFERENCE_OVERRIDES}
+    assert entry["reference"] == REFERENCE_OVERRIDES
+    assert entry["engine_seconds"] == 0.5
+    assert entry["reference_seconds"] > 0
+    assert entry["image_shape"] == [120, 160, 3]
+    assert entry["dropped_samples"] == 0
+    # Only the number placement differs: the colors and islands are the same.
+    assert entry["label_agreement"] == 1.0
+    assert entry["border_iou"] == 1.0
+    assert "error" not in entry
+
+
+def test_shadow_mode_sampling():
+    assert not any(ShadowMode("unused", sample_rate = 0).should_sample() for _ in range(100))
+    shadow_mode = ShadowMode("unused", sample_rate = 0.5, seed = 1)
+    samples = [shadow_mode.should_sample() for _ in range(1000)]
+    assert 400 < sum(samples) < 600
+
+
+def test_shadow_mode_drops_samples_while_busy(tmp_path, monkeypatch):
+    started = threading.Event()
+    release = threading.Event()
+    def slow_run(*args, **kwargs):
+        started.set()
+        release.wait(30)
+        return run(*args, **kwargs)
+    monkeypatch.setattr(shadow, "run", slow_run)
+
+    log_path = tmp_path / "shadow.jsonl"
+    shadow_mode = ShadowMode(str(log_path), sample_rate = 1, max_pending = 1)
+    config = make_config(CONFIG, number_placement = "collision_aware")
+    _record(shadow_mode, config)
+    assert started.wait(30)
+    _record(shadow_mode, config)
+    _record(shadow_mode, config)
+    assert shadow_mode.dropped == 2
+    release.set()
+    shadow_mode.close()
+
+    entry, = _entries(log_path)
+    assert entry["dropped_samples"] == 2
+
+
+def test_shadow_mode_logs_reference_errors(tmp_path, monkeypatch):
+    def failing_run(*args, **kwargs):
+        raise RuntimeError("reference failed")
+    monkeypatch.setattr(shadow, "run", failing_run)
+
+    log_path = tmp_path / "shadow.jsonl"
+    shadow_mode = ShadowMode(str(log_path), sample_rate = 1, background = False)
+    _record(shadow_mode, make_config(CONFIG, number_placement = "collision_aware"))
+    entry, = _entries(log_path)
+    assert "reference failed" in entry["error"]
@@ -0,0 +1,146 @@
+import gc
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pytest
+
+from colorbynumber.cancellation import Cancelled
+from colorbynumber.config import make_config
+from colorbynumber.main import ColorByNumber
+from colorbynumber.shared_arrays import (
+    SharedArray, SharedArrays, SharedCancellationToken, pack_island_borders, unpack_island_borders)
+
+
+def _mapped(shared_array):
+    # SharedMemory.close sets its buffer to None.
+    return shared_array.shm.buf is not None
+
+
+def test_attach_shares_memory():
+    array = np.arange(12, dtype = np.int32).reshape((3, 4))
+    with SharedArrays.from_arrays({"a": array}) as owner:
+        attached = SharedArrays.attach(owner.descriptor)
+        np.testing.assert_array_equal(attached.arrays["a"], array)
+        attached.arrays["a"][0, 0] = 100
+        assert owner.arrays["a"][0, 0] == 100
+        attached.close()
+
+
+def test_close_with_live_view():
+    shared_array = SharedArray.from_array(np.arange(10, dtype = np.uint8))
+    try:
+        view = shared_array.array[2:5]
+        shared_array.close()
+        # The mapping stays until the view is gone.
+        assert _mapped(shared_array)
+        np.testing.assert_array_equal(view, [2, 3, 4])
+        view[0] = 42
+        assert view[0] == 42
+
+        del view
+        gc.collect()
+        assert not _mapped(shared_array)
+    finally:
+        shared_array.unlink()
+
+
+def test_close_without_views():
+    shared_array = SharedArray.from_array(np.ones((4, 4)))
+    shared_array.unlink()
+    assert not _mapped(shared_array)
+    # Closing again does nothing.
+    shared_array.close()
+
+
+def test_views_released_on_other_threads():
+    shared_arrays = [SharedArray.from_array(np.full(100, i, dtype = np.uint8)) for i in range(20)]
+    views = [shared_array.array[10:] for shared_array in shared_arrays]
+    for shared_array in shared_arrays:
+        shared_array.unlink()
+
+    def release(start):
+        for i in range(start, len(views), 4):
+            assert views[i][0] == i
+            views[i] = None
+
+    threads = [threading.Thread(target = release, args = (start,)) for start in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    gc.collect()
+    assert not any(_mapped(shared_array) for shared_array in shared_arrays)
+
+
+def test_attach_failure_unlinks_segments():
+    owner = SharedArrays.from_arrays({"a": np.zeros(3), "b": np.zeros(3)})
+    descriptor = dict(owner.descriptor, c = ("psm_missing_segment", (3,), "<f8"))
+    owner.close()
+    with pytest.raises(FileNotFoundError):
+        SharedArrays.attach(descriptor)
+    with pytest.raises(FileNotFoundError):
+        SharedArray.attach(descriptor["a"])
+
+
+def test_pack_island_borders_round_trip():
+    island_borders_list = [
+        (1, (np.array([0, 1, 2]), np.array([3, 4, 5]))),
+        (3, (np.array([7]), np.array([8]))),
+    ]
+    unpacked = unpack_island_borders(**pack_island_borders(island_borders_list))
+    assert [color_id for color_id, _ in unpacked] == [1, 3]
+    for (_, (rows, cols)), (_, (expected_rows, expected_cols)) in zip(unpacked, island_borders_list):
+        np.testing.assert_array_equal(rows, expected_rows)
+        np.testing.assert_array_equal(cols, expected_cols)
+    assert unpack_island_borders(**pack_island_borders([])) == []
+
+
+def _wait_for_cancel(descriptor, seconds):
+    token = SharedCancellationToken.attach(descriptor)
+    try:
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            if token.cancelled:
+                return True
+            time.sleep(0.01)
+        return False
+    finally:
+        token.close()
+
+
+def _run_shared_image(image_descriptor, token_descriptor):
+    token = SharedCancellationToken.attach(token_descriptor)
+    try:
+        ColorByNumber.from_shared_image(
+            image_descriptor, num_colors = 2, config = make_config(denoise = False),
+            cancellation_token = token,
+        ).create_color_by_number()
+    except Cancelled as e:
+        return type(e).__name__
+    finally:
+        token.close()
+
+
+def test_shared_cancellation_token_across_processes():
+    token = SharedCancellationToken.create()
+    try:
+        with ProcessPoolExecutor(max_workers = 1) as pool:
+            waiting = pool.submit(_wait_for_cancel, token.descriptor, 30)
+            assert not token.cancelled
+            time.sleep(0.2)
+            token.cancel()
+            assert waiting.result()
+
+            image = SharedArray.from_array(np.zeros((40, 40, 3), dtype = np.uint8))
+            try:
+                assert pool.submit(_run_shared_image, image.descriptor, token.descriptor).result() \
+                    == "Cancelled"
+            finally:
+                image.unlink()
+    finally:
+        token.unlink()
+    # Cancelling after unlink still works.
+    token.cancel()
+    assert token.cancelled
@@ -0,0 +1,95 @@
+import cv2 as cv
+import numpy as np
+import pytest
+
+from colorbynumber.config import make_config
+from colorbynumber.pipeline import PaletteSpec, Result, run
+from colorbynumber.superpixels import slic, superpixel_colors
+
+
+def _noisy_gradient(seed = 0, shape = (120, 160)):
+    random_state = np.random.RandomState(seed)
+    rows, cols = np.mgrid[0:shape[0], 0:shape[1]]
+    image = np.stack([cols * 1.5, rows * 2.0, (rows + cols) * 0.8], axis = -1) \
+        + random_state.normal(0, 25, shape + (3,))
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+
+def _components(labels):
+    # Number of 4-connected groups of pixels with the same label.
+    return sum(cv.connectedComponents((labels == label).astype(np.uint8), connectivity = 4)[0] - 1
+               for label in np.unique(labels))
+
+
+@pytest.mark.parametrize("region_size", [8, 12, 20])
+def test_slic_label_map(region_size):
+    image = _noisy_gradient()
+    labels = slic(image, region_size = region_size)
+
+    assert labels.shape == image.shape[:2]
+    # Labels are consecutive, starting at 0.
+    assert labels.min() == 0
+    assert np.unique(labels).size == labels.max() + 1
+    expected = image.shape[0] * image.shape[1] / region_size**2
+    assert 0.5 * expected <= labels.max() + 1 <= 1.5 * expected
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_slic_superpixels_are_connected(seed):
+    labels = slic(_noisy_gradient(seed), region_size = 10, compactness = 5)
+    assert _components(labels) == labels.max() + 1
+
+
+def test_slic_is_deterministic():
+    image = _noisy_gradient()
+    np.testing.assert_array_equal(slic(image), slic(image.copy()))
+
+
+def test_slic_small_image():
+    labels = slic(_noisy_gradient(shape = (5, 7)), region_size = 12)
+    np.testing.assert_array_equal(labels, np.zeros((5, 7)))
+
+
+def test_superpixel_colors():
+    image = _noisy_gradient()
+    labels = slic(image)
+    colors, sizes = superpixel_colors(image, labels)
+
+    assert colors.shape == (labels.max() + 1, 3)
+    np.testing.assert_array_equal(sizes, np.bincount(labels.ravel()))
+    for label in (0, labels.max() // 2, labels.max()):
+        np.testing.assert_allclose(colors[label], image[labels == label].mean(axis = 0))
+    # Weighting the means by the sizes gives back the mean of the image.
+    np.testing.assert_allclose((colors * sizes[:, None]).sum(axis = 0) / sizes.sum(),
+                               image.reshape((-1, 3)).mean(axis = 0))
+
+
+def test_superpixels_pipeline():
+    image = _noisy_gradient()
+    results = {}
+    for superpixels in (False, True):
+        config = make_config(denoise = False, kmeans_method = "palette_family",
+                             superpixels = superpixels, superpixel_size = 8)
+        results[superpixels] = run(image, PaletteSpec(num_colors = 6), config)
+
+    result = results[True]
+    assert isinstance(result, Result)
+    assert result.indices_color_choices.shape == image.shape[:2]
+    assert len(result.color_list) == 6
+    assert 1 <= result.indices_color_choices.min() and result.indices_color_choices.max() <= 6
+    np.testing.assert_array_equal(
+        result.simplified_image,
+        np.asarray(result.color_list, dtype = np.uint8)[result.indices_color_choices - 1])
+    assert len(result.island_borders_list) > 0
+    # Whole superpixels get one color, so the page has fewer, larger regions.
+    assert _components(result.indices_color_choices) \
+        <= _components(results[False].indices_color_choices)
+
+
+def test_superpixels_with_color_list():
+    image = _noisy_gradient()
+    color_list = np.array([[0, 0, 0], [255, 255, 255], [200, 100, 50]], dtype = np.uint8)
+    config = make_config(denoise = False, superpixels = True, superpixel_size = 8, apply_kmeans = False)
+    result = run(image, PaletteSpec(color_list = color_list), config)
+    assert np.isin(result.indices_color_choices, [1, 2, 3]).all()
+    np.testing.assert_array_equal(np.asarray(result.color_list), color_list)